@@ -0,0 +1,180 @@
+"""
+JSON API for clients ordering without the HTML pages, like a slack bot or
+a phone shortcut. Requests are authenticated with the session cookie and
+CSRF token as the pages are, and every call runs in one transaction.
+
+Views are async, so under ASGI slow clients wait on the event loop instead
+of holding a thread. The ORM work of each call is one sync function run
+with sync_to_async, thread sensitive so it shares the thread, connection
+and transaction of the rest of the request.
+"""
+import json
+import hashlib
+from functools import wraps
+from asgiref.sync import sync_to_async
+from django.db import transaction
+from django.http import JsonResponse
+from django.utils.cache import get_conditional_response
+from django.utils.http import quote_etag
+from django.utils.timezone import now
+from .db import atomic_write
+from .decorators import async_require_http_methods, is_authenticated
+from .menus import get_today_menu, get_menu_version
+from .models import Order
+from .order_window import menu_order_window
+
+
+def api_login_required(view):
+    """
+    Answers 401 instead of redirecting to the login page
+    """
+    @wraps(view)
+    async def wrapper(request, *args, **kwargs):
+        if not await sync_to_async(is_authenticated)(request):
+            return _error(401, 'authentication required')
+        return await view(request, *args, **kwargs)
+    return wrapper
+
+
+def today_menu_etag(menu):
+    """
+    ETag of today's menu resource, it changes with the menus and when the
+    menu opens or closes
+    """
+    state = [get_menu_version(), menu and menu.pk,
+             menu is not None and menu_order_window(menu).is_open()]
+    return quote_etag(hashlib.md5(repr(state).encode()).hexdigest())
+
+
+@async_require_http_methods(['GET'])
+async def today_menu(request):
+    """
+    Today's menu with its options and their customizations, read from the
+    cached menu so it does not hit the database. Requests with the ETag of
+    the menu in If-None-Match get a 304.
+
+    Parameters:
+    request (HttpReqest): object that contains metadata about the request
+
+    Returns:
+    Return a JsonResponse object {id, uuid, open, opens, closes, options}
+    or 404 when there is no menu today
+    """
+    menu = await sync_to_async(get_today_menu)()
+    etag = today_menu_etag(menu)
+    response = get_conditional_response(request, etag=etag)
+    if response is None:
+        if menu is None:
+            return _error(404, 'there is no menu today')
+        response = _json(_serialize_menu(menu))
+    response['ETag'] = etag
+    return response
+
+
+@async_require_http_methods(['GET', 'PUT'])
+@api_login_required
+async def my_order(request):
+    """
+    Order of the user for today's menu. GET reads it, PUT places or
+    replaces it with its customizations in one transaction, from a body
+    {"menu_option": id, "customizations": [id, ...]}
+
+    Parameters:
+    request (HttpReqest): object that contains metadata about the request
+
+    Returns:
+    Return a JsonResponse object {id, menu, menu_option, customizations},
+    201 when the order is created
+    """
+    if request.method == 'GET':
+        return await sync_to_async(_read_order)(request.user)
+
+    try:
+        body = json.loads(request.body)
+        option_id = int(body['menu_option'])
+        customization_ids = {int(custom_id) for custom_id
+                             in body.get('customizations', [])}
+    except (ValueError, TypeError, KeyError):
+        return _error(400, 'expected {"menu_option": id, '
+                           '"customizations": [id, ...]}')
+    return await sync_to_async(_place_order)(request.user, option_id,
+                                             customization_ids)
+
+
+def _read_order(user):
+    menu = get_today_menu()
+    if menu is None:
+        return _error(404, 'there is no menu today')
+    # the order and its customizations are read from the same snapshot
+    with transaction.atomic():
+        order = Order.objects.filter(user=user, menu=menu).first()
+        if order is None:
+            return _error(404, 'there is no order for today')
+        customization_ids = list(order.ordercustomization_set.values_list(
+            'menu_option_custom_id', flat=True))
+    return _json(_serialize_order(order, customization_ids))
+
+
+def _place_order(user, option_id, customization_ids):
+    menu = get_today_menu()
+    if menu is None:
+        return _error(404, 'there is no menu today')
+    if not menu_order_window(menu).is_open():
+        return _error(403, 'the menu is closed')
+
+    # validated against the prefetched menu, without queries
+    option = next((option for option in menu.menu_options.all()
+                   if option.id == option_id), None)
+    if option is None:
+        return _error(400, 'menu option {} is not in the menu'.format(
+            option_id))
+    invalid = customization_ids - {custom.id for custom
+                                   in option.menuoptioncustomization_set.all()}
+    if invalid:
+        return _error(400, 'customizations {} are not of menu option '
+                           '{}'.format(sorted(invalid), option_id))
+
+    with atomic_write():
+        order, created = Order.objects.update_or_create(
+            user=user, menu=menu,
+            defaults={'menu_option': option, 'purchased_date': now()})
+        order.set_customizations(customization_ids)
+    return _json(_serialize_order(order, customization_ids),
+                 status=201 if created else 200)
+
+
+def _serialize_menu(menu):
+    window = menu_order_window(menu)
+    return {
+        'id': menu.id,
+        'uuid': str(menu.uuid),
+        'open': window.is_open(),
+        'opens': window.opens.isoformat(),
+        'closes': window.closes.isoformat(),
+        'options': [{
+            'id': option.id,
+            'name': option.name,
+            'customizations': [
+                {'id': custom.id, 'name': custom.name}
+                for custom in option.menuoptioncustomization_set.all()]
+        } for option in menu.menu_options.all()],
+    }
+
+
+def _serialize_order(order, customization_ids):
+    return {
+        'id': order.id,
+        'menu': order.menu_id,
+        'menu_option': order.menu_option_id,
+        'customizations': sorted(customization_ids),
+        'purchased_date': order.purchased_date.isoformat(),
+    }
+
+
+def _json(data, status=200):
+    return JsonResponse(data, status=status,
+                        json_dumps_params={'separators': (',', ':')})
+
+
+def _error(status, message):
+    return _json({'error': message}, status=status)
@@ -3,3 +3,9 @@ from django.apps import AppConfig
 
 class AppConfig(AppConfig):
     name = 'app'
+
+    def ready(self):
+        from . import menus  # noqa: connects cache invalidation signals
+        from . import auth_cache  # noqa: connects user cache invalidation
+        from . import db  # noqa: connects sqlite connection configuration
+        from . import rollups  # noqa: connects order rollup signals
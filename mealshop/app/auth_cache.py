@@ -0,0 +1,114 @@
+"""
+Authentication backend keeping the logged in users and their permissions
+in the cache, so with a cached session engine a page of a logged in user
+does not query the database to know who they are and what they can do.
+
+Users are dropped from the cache when they are saved or deleted, which
+includes a new password or the last_login of a login, and again when the
+transaction commits. Permissions of a
+user are dropped when their permissions or groups change, and all of them
+when a group or permission changes.
+"""
+import time
+from django.conf import settings
+from django.contrib.auth.backends import ModelBackend
+from django.contrib.auth.models import Group, Permission, User
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models.signals import post_save, post_delete, m2m_changed
+from django.dispatch import receiver
+
+
+USER_KEY = 'app:auth_user:{}'
+PERMISSIONS_KEY = 'app:auth_permissions:{}:{}'
+PERMISSIONS_VERSION_KEY = 'app:auth_permissions_version'
+
+
+class CachedModelBackend(ModelBackend):
+    """
+    ModelBackend reading users and their permissions from the cache for
+    AUTH_CACHE_TIMEOUT seconds
+    """
+
+    def get_user(self, user_id):
+        key = USER_KEY.format(user_id)
+        user = cache.get(key)
+        if user is None:
+            user = super().get_user(user_id)
+            if user is not None:
+                cache.set(key, user, settings.AUTH_CACHE_TIMEOUT)
+        return user
+
+    def get_all_permissions(self, user_obj, obj=None):
+        if (user_obj.is_active and not user_obj.is_anonymous
+                and obj is None and not hasattr(user_obj, '_perm_cache')):
+            key = _permissions_key(user_obj.pk)
+            permissions = cache.get(key)
+            if permissions is None:
+                permissions = super().get_all_permissions(user_obj)
+                cache.set(key, permissions, settings.AUTH_CACHE_TIMEOUT)
+            user_obj._perm_cache = permissions
+        return super().get_all_permissions(user_obj, obj)
+
+
+def invalidate_user(*user_ids):
+    """
+    Drops the cached users and permissions of user_ids
+    """
+    version = _permissions_version()
+    keys = ([USER_KEY.format(user_id) for user_id in user_ids] +
+            [PERMISSIONS_KEY.format(version, user_id) for user_id in user_ids])
+    cache.delete_many(keys)
+    # dropped again once committed, a request reading the user before the
+    # commit may have cached it again
+    transaction.on_commit(lambda: cache.delete_many(keys))
+
+
+def invalidate_permissions():
+    """
+    Drops the cached permissions of every user
+    """
+    cache.set(PERMISSIONS_VERSION_KEY, time.time(), None)
+    transaction.on_commit(
+        lambda: cache.set(PERMISSIONS_VERSION_KEY, time.time(), None))
+
+
+def _permissions_version():
+    return cache.get(PERMISSIONS_VERSION_KEY, 0)
+
+
+def _permissions_key(user_id):
+    return PERMISSIONS_KEY.format(_permissions_version(), user_id)
+
+
+@receiver(post_save, sender=User)
+@receiver(post_delete, sender=User)
+def invalidate_saved_user(sender, instance, **kwargs):
+    invalidate_user(instance.pk)
+
+
+@receiver(m2m_changed, sender=User.user_permissions.through)
+@receiver(m2m_changed, sender=User.groups.through)
+def invalidate_user_permissions(sender, instance, action, reverse,
+                                **kwargs):
+    # changed from the user, or from the group or permission side with
+    # group.user_set.add(), which may touch many users
+    if action in ('post_add', 'post_remove', 'post_clear'):
+        if reverse:
+            invalidate_permissions()
+        else:
+            invalidate_user(instance.pk)
+
+
+@receiver(m2m_changed, sender=Group.permissions.through)
+def invalidate_group_permissions(sender, action, **kwargs):
+    if action in ('post_add', 'post_remove', 'post_clear'):
+        invalidate_permissions()
+
+
+@receiver(post_save, sender=Group)
+@receiver(post_delete, sender=Group)
+@receiver(post_save, sender=Permission)
+@receiver(post_delete, sender=Permission)
+def invalidate_all_permissions(sender, **kwargs):
+    invalidate_permissions()
@@ -0,0 +1,60 @@
+from contextlib import contextmanager
+from django.conf import settings
+from django.db import transaction
+from django.db.backends.signals import connection_created
+from django.dispatch import receiver
+
+
+@receiver(connection_created)
+def configure_sqlite(sender, connection, **kwargs):
+    """
+    Applies settings.SQLITE_PRAGMAS to every new SQLite connection, with
+    SQLITE_WAL readers go on while an order is written. Concurrent writers
+    wait up to the timeout of the database OPTIONS instead of failing with
+    "database is locked".
+    """
+    if connection.vendor != 'sqlite':
+        return
+
+    with connection.cursor() as cursor:
+        for pragma, value in settings.SQLITE_PRAGMAS.items():
+            cursor.execute('PRAGMA {} = {}'.format(pragma, value))
+
+
+@contextmanager
+def atomic_write(using=None):
+    """
+    transaction.atomic for transactions that read before they write, like
+    update_or_create. A deferred SQLite transaction that reads and then
+    writes fails right away when another writer committed in between, the
+    timeout does not apply, so on SQLite the outermost one is started with
+    BEGIN IMMEDIATE, which waits for the write lock up front.
+
+    Parameters:
+    using (str): database alias, the default one by default
+    """
+    connection = transaction.get_connection(using)
+    if connection.vendor != 'sqlite' or connection.in_atomic_block:
+        with transaction.atomic(using=using):
+            yield
+        return
+
+    # atomic() always starts with a plain BEGIN, the transaction is begun
+    # by hand and atomic() then runs inside it as it does with autocommit
+    # off, leaving the commit or rollback to this block
+    transaction.set_autocommit(False, using=using)
+    try:
+        with connection.cursor() as cursor:
+            cursor.execute('BEGIN IMMEDIATE')
+        with transaction.atomic(using=using, savepoint=False):
+            yield
+        if connection.needs_rollback:
+            transaction.rollback(using=using)
+        else:
+            transaction.commit(using=using)
+    except BaseException:
+        transaction.rollback(using=using)
+        raise
+    finally:
+        # runs the on_commit callbacks once committed
+        transaction.set_autocommit(True, using=using)
@@ -0,0 +1,50 @@
+"""
+Counterparts for async views of the django.views.decorators and
+django.contrib.auth decorators, which only wrap sync views in Django 3.2.
+request.user is loaded lazily from the session and the database, so it is
+only read through sync_to_async.
+"""
+from functools import wraps
+from asgiref.sync import sync_to_async
+from django.contrib.auth.views import redirect_to_login
+from django.http import HttpResponseNotAllowed
+
+
+def async_require_http_methods(methods):
+    """
+    Same as django.views.decorators.http.require_http_methods
+    """
+    def decorator(view):
+        @wraps(view)
+        async def wrapper(request, *args, **kwargs):
+            if request.method not in methods:
+                return HttpResponseNotAllowed(methods)
+            return await view(request, *args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def async_permission_required(perm, login_url=None):
+    """
+    Same as django.contrib.auth.decorators.permission_required, users
+    without the permission are redirected to login_url
+    """
+    def decorator(view):
+        @wraps(view)
+        async def wrapper(request, *args, **kwargs):
+            if not await sync_to_async(_has_perm)(request, perm):
+                return redirect_to_login(request.get_full_path(), login_url)
+            return await view(request, *args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def is_authenticated(request):
+    """
+    Sync check of request.user, to be called through sync_to_async
+    """
+    return request.user.is_authenticated
+
+
+def _has_perm(request, perm):
+    return request.user.has_perm(perm)
@@ -0,0 +1,53 @@
+import asyncio
+from aiohttp import web
+
+
+class FakeSlackServer:
+    """
+    Local Slack Web API answering every method with {"ok": true}, used to
+    test and benchmark reminders without network access.
+
+    Usage:
+    async with FakeSlackServer(latency=0.05) as slack:
+        client = AsyncWebClient(token='x', base_url=slack.url)
+
+    Parameters:
+    latency (float): seconds each call takes to answer
+    rate_limited (int): amount of first calls answered with 429
+    retry_after (int): Retry-After header sent with 429 answers
+    """
+
+    def __init__(self, latency=0, rate_limited=0, retry_after=0):
+        self.latency = latency
+        self.rate_limited = rate_limited
+        self.retry_after = retry_after
+        self.calls = []
+        self.url = None
+        self._runner = None
+
+    async def __aenter__(self):
+        app = web.Application()
+        app.router.add_post('/api/{method}', self._handle)
+        self._runner = web.AppRunner(app)
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, '127.0.0.1', 0)
+        await site.start()
+        port = site._server.sockets[0].getsockname()[1]
+        self.url = 'http://127.0.0.1:{}/api/'.format(port)
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self._runner.cleanup()
+
+    async def _handle(self, request):
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        if self.rate_limited > 0:
+            self.rate_limited -= 1
+            return web.json_response(
+                {'ok': False, 'error': 'ratelimited'}, status=429,
+                headers={'Retry-After': str(self.retry_after)})
+
+        self.calls.append((request.match_info['method'],
+                           await request.json()))
+        return web.json_response({'ok': True})
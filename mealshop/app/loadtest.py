@@ -0,0 +1,343 @@
+import re
+import math
+import time
+import random
+import threading
+import http.client
+from collections import Counter, defaultdict
+from django.conf import settings
+from django.contrib.auth.models import User, Permission
+from django.db import connection
+from django.test import Client
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils.timezone import timedelta
+from .models import (
+    Menu, MenuOption, MenuOptionCustomization, Order, Profile
+)
+from .menus import warm_today_menu
+from .order_window import get_order_window
+
+_SERVER_TIMING_QUERIES = re.compile(r'desc="(\d+) queries"')
+
+
+class LoadTestData:
+    """
+    Employees, a kitchen user and a menu of today created for a load test,
+    delete() removes all of them
+
+    Parameters:
+    users (int): amount of employees
+    options (int): menu options in the menu of today
+    customizations (int): customizations of each menu option
+    """
+
+    def __init__(self, users=50, options=5, customizations=4):
+        prefix = 'loadtest_{}_'.format(int(time.time() * 1000))
+        User.objects.bulk_create(
+            [User(username='{}{}'.format(prefix, i)) for i in range(users)])
+        Profile.objects.bulk_create(
+            [Profile(user_id=user_id) for user_id in User.objects
+             .filter(username__startswith=prefix)
+             .values_list('id', flat=True)])
+        self.users = list(User.objects.filter(username__startswith=prefix))
+        self.kitchen = User.objects.create(username=prefix + 'kitchen')
+        self.kitchen.user_permissions.add(
+            Permission.objects.get(codename='view_order'))
+
+        MenuOption.objects.bulk_create(
+            [MenuOption(name='{}{}'.format(prefix, i), description='')
+             for i in range(options)])
+        self.options = list(MenuOption.objects.filter(
+            name__startswith=prefix))
+        MenuOptionCustomization.objects.bulk_create(
+            [MenuOptionCustomization(name=str(i), menu_option=option)
+             for option in self.options for i in range(customizations)])
+        self.customizations = defaultdict(list)
+        for custom in MenuOptionCustomization.objects.filter(
+                menu_option__in=self.options):
+            self.customizations[custom.menu_option_id].append(custom.id)
+
+        # open for the whole day so the rush can run at any time, and
+        # cached before it starts as the menu scheduler does
+        window = get_order_window()
+        self.menu = Menu.objects.create(
+            pub_date=window.opens + timedelta(hours=1), closes_at=window.ends)
+        self.menu.menu_options.add(*self.options)
+        warm_today_menu()
+
+    def delete(self):
+        User.objects.filter(
+            id__in=[user.id for user in self.users + [self.kitchen]]).delete()
+        MenuOption.objects.filter(
+            id__in=[option.id for option in self.options]).delete()
+        self.menu.delete()
+
+
+class LoadTestReport:
+    """
+    Latency and queries of every request answered with 2xx or 3xx, grouped
+    by step. Other answers are counted per status in rejected and requests
+    without an answer in errors.
+    """
+
+    def __init__(self):
+        self.samples = defaultdict(list)
+        self.rejected = defaultdict(Counter)
+        self.errors = defaultdict(int)
+        self.elapsed = 0
+        self._lock = threading.Lock()
+
+    def add(self, step, seconds, queries):
+        with self._lock:
+            self.samples[step].append((seconds, queries))
+
+    def add_rejected(self, step, status):
+        with self._lock:
+            self.rejected[step][status] += 1
+
+    def add_error(self, step):
+        with self._lock:
+            self.errors[step] += 1
+
+    @property
+    def requests(self):
+        return sum(len(samples) for samples in self.samples.values())
+
+    def summary(self):
+        """
+        Returns:
+        dict step -> {count, p50, p95, p99 (ms), queries (mean),
+                      max_queries}
+        """
+        summary = {}
+        for step, samples in self.samples.items():
+            latencies = sorted(seconds * 1000 for seconds, _ in samples)
+            summary[step] = {
+                'count': len(samples),
+                'p50': _percentile(latencies, 50),
+                'p95': _percentile(latencies, 95),
+                'p99': _percentile(latencies, 99),
+                'queries': sum(q for _, q in samples) / len(samples),
+                'max_queries': max(q for _, q in samples),
+            }
+        return summary
+
+    def lines(self):
+        lines = ['{:<26}{:>7}{:>10}{:>10}{:>10}{:>10}'.format(
+            'step', 'count', 'p50 ms', 'p95 ms', 'p99 ms', 'queries')]
+        for step, row in self.summary().items():
+            lines.append('{:<26}{:>7}{:>10.2f}{:>10.2f}{:>10.2f}{:>10.1f}'
+                         .format(step, row['count'], row['p50'], row['p95'],
+                                 row['p99'], row['queries']))
+        if self.elapsed:
+            lines.append('{} requests in {:.2f}s, {:.1f} requests/s'.format(
+                self.requests, self.elapsed, self.requests / self.elapsed))
+        for step, statuses in self.rejected.items():
+            for status, count in sorted(statuses.items()):
+                lines.append('{} answered {} requests with {}'.format(
+                    step, count, status))
+        for step, errors in self.errors.items():
+            lines.append('{} failed {} requests'.format(step, errors))
+        return lines
+
+
+def run_order_rush(data, concurrency=10, kitchen=True, seed=None):
+    """
+    Every employee of data chooses the menu, orders a random option and
+    sets random customizations through the real urls, spread over
+    `concurrency` threads, while the kitchen reloads view_orders.
+    With concurrency=1 everything runs on the calling thread, which is
+    what a TestCase needs.
+
+    Parameters:
+    data (LoadTestData): users and menu to order from
+    concurrency (int): amount of simultaneous clients
+    kitchen (bool): poll view_orders while employees order
+    seed (int): seed of the random choices, each thread has its own
+        generator seeded from it
+
+    Returns:
+    LoadTestReport
+    """
+    report = LoadTestReport()
+    rng = random.Random(seed)
+    plans = [(user, rng.choice(data.options)) for user in data.users]
+    rngs = [random.Random(rng.getrandbits(64)) for _ in range(concurrency)]
+    done = threading.Event()
+
+    def employees(plans, rng):
+        try:
+            for user, option in plans:
+                _order_flow(report, data, user, option, rng)
+        finally:
+            _close_thread_connection()
+
+    def kitchen_loop():
+        try:
+            client = Client()
+            client.force_login(data.kitchen)
+            while not done.is_set():
+                _request(report, 'view_orders', client.get,
+                         reverse('mealshop:view_orders'))
+        finally:
+            _close_thread_connection()
+
+    start = time.perf_counter()
+    if concurrency == 1:
+        employees(plans, rngs[0])
+        if kitchen:
+            done.set()
+            client = Client()
+            client.force_login(data.kitchen)
+            _request(report, 'view_orders', client.get,
+                     reverse('mealshop:view_orders'))
+    else:
+        workers = [threading.Thread(target=employees,
+                                    args=(plans[i::concurrency], rngs[i]))
+                   for i in range(concurrency)]
+        poller = threading.Thread(target=kitchen_loop) if kitchen else None
+        for worker in workers + ([poller] if poller else []):
+            worker.start()
+        for worker in workers:
+            worker.join()
+        done.set()
+        if poller:
+            poller.join()
+    report.elapsed = time.perf_counter() - start
+    return report
+
+
+def run_http_benchmark(data, host, port, duration=10, concurrency=10):
+    """
+    Employees of data logged in with session cookies read the menu page,
+    today's menu and their order from a server listening on host:port over
+    real connections, from `concurrency` threads during `duration` seconds.
+    Queries per request are read from the Server-Timing header.
+
+    Parameters:
+    data (LoadTestData): users and menu to read, its menu has to be saved
+    host (str): address of the server
+    port (int): port of the server
+    duration (float): seconds the clients send requests
+    concurrency (int): amount of simultaneous clients
+
+    Returns:
+    LoadTestReport
+    """
+    report = LoadTestReport()
+    paths = [
+        ('choose_menu', reverse('mealshop:choose_menu',
+                                args=[data.menu.id])),
+        ('api_today_menu', reverse('mealshop:api_today_menu')),
+        ('api_order', reverse('mealshop:api_order')),
+    ]
+    cookies = []
+    for user in data.users[:concurrency]:
+        client = Client()
+        client.force_login(user)
+        cookies.append('{}={}'.format(
+            settings.SESSION_COOKIE_NAME,
+            client.cookies[settings.SESSION_COOKIE_NAME].value))
+    deadline = time.perf_counter() + duration
+
+    def clients(cookie):
+        while time.perf_counter() < deadline:
+            for step, path in paths:
+                _http_request(report, step, host, port, path, cookie)
+
+    workers = [threading.Thread(target=clients,
+                                args=(cookies[i % len(cookies)],))
+               for i in range(concurrency)]
+    start = time.perf_counter()
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    report.elapsed = time.perf_counter() - start
+    return report
+
+
+def wait_for_server(host, port, timeout=30):
+    """
+    Waits until a server accepts connections on host:port
+
+    Returns:
+    bool False when it did not within timeout seconds
+    """
+    deadline = time.perf_counter() + timeout
+    while time.perf_counter() < deadline:
+        connection = http.client.HTTPConnection(host, port, timeout=1)
+        try:
+            connection.request('GET', reverse('mealshop:api_today_menu'))
+            connection.getresponse().read()
+            return True
+        except OSError:
+            time.sleep(0.2)
+        finally:
+            connection.close()
+    return False
+
+
+def _http_request(report, step, host, port, path, cookie):
+    # a connection per request, runserver closes them after each response
+    connection = http.client.HTTPConnection(host, port, timeout=30)
+    start = time.perf_counter()
+    try:
+        connection.request('GET', path, headers={'Cookie': cookie})
+        response = connection.getresponse()
+        response.read()
+    except OSError:
+        report.add_error(step)
+        return
+    finally:
+        connection.close()
+    seconds = time.perf_counter() - start
+    if not 200 <= response.status < 400:
+        report.add_rejected(step, response.status)
+        return
+    queries = _SERVER_TIMING_QUERIES.search(
+        response.getheader('Server-Timing', ''))
+    report.add(step, seconds, int(queries.group(1)) if queries else 0)
+
+
+def _order_flow(report, data, user, option, rng):
+    client = Client()
+    client.force_login(user)
+    menu_id = data.menu.id
+    _request(report, 'choose_menu', client.get,
+             reverse('mealshop:choose_menu', args=[menu_id]))
+    _request(report, 'add_order', client.post,
+             reverse('mealshop:add_order', args=[menu_id]),
+             {'menu_option_id': option.id})
+    order_id = Order.objects.values_list('id', flat=True).get(
+        user=user, menu_id=menu_id)
+    customizations = data.customizations[option.id]
+    chosen = rng.sample(customizations, rng.randint(0, len(customizations)))
+    _request(report, 'add_order_customizations', client.post,
+             reverse('mealshop:add_order_customizations', args=[order_id]),
+             {'menu_option_customization_{}'.format(custom_id): 'on'
+              for custom_id in chosen})
+
+
+def _request(report, step, method, *args):
+    with CaptureQueriesContext(connection) as context:
+        start = time.perf_counter()
+        response = method(*args)
+        seconds = time.perf_counter() - start
+    if not 200 <= response.status_code < 400:
+        report.add_rejected(step, response.status_code)
+        return
+    report.add(step, seconds, len(context))
+
+
+def _close_thread_connection():
+    if threading.current_thread() is not threading.main_thread():
+        connection.close()
+
+
+def _percentile(values, percent):
+    if not values:
+        return 0
+    index = max(int(math.ceil(percent / 100 * len(values))) - 1, 0)
+    return values[index]
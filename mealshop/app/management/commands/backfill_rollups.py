@@ -0,0 +1,37 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db.models import Max, Min
+from django.utils.dateparse import parse_date
+from django.utils.timezone import localdate
+from app.models import Order
+from app.rollups import rebuild_rollups
+
+
+class Command(BaseCommand):
+    help = ('Rebuilds the daily order rollups from the orders, by default '
+            'for every day with orders')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--start', help='first day, YYYY-MM-DD')
+        parser.add_argument('--end', help='last day, YYYY-MM-DD')
+
+    def handle(self, *args, **options):
+        bounds = Order.objects.aggregate(first=Min('purchased_date'),
+                                         last=Max('purchased_date'))
+        if bounds['first'] is None:
+            self.stdout.write('There are no orders to roll up')
+            return
+        start = self._day(options['start'], localdate(bounds['first']))
+        end = self._day(options['end'], localdate(bounds['last']))
+
+        options_rows, customization_rows = rebuild_rollups(start, end)
+        self.stdout.write(self.style.SUCCESS(
+            'Rolled up {} to {}: {} menu option and {} customization '
+            'rows'.format(start, end, options_rows, customization_rows)))
+
+    def _day(self, value, default):
+        if value is None:
+            return default
+        day = parse_date(value)
+        if day is None:
+            raise CommandError('{} is not a YYYY-MM-DD date'.format(value))
+        return day
@@ -0,0 +1,54 @@
+import time
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from django.test import RequestFactory
+from django.test.utils import CaptureQueriesContext
+from app.models import MenuOption
+from app import views
+
+
+class Command(BaseCommand):
+    help = ('Creates menus through add_menu over a large menu option '
+            'catalog inside a transaction that is rolled back, reporting '
+            'time and queries per menu')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--options', type=int, default=1000,
+                            help='size of the menu option catalog')
+        parser.add_argument('--checked', type=int, default=10,
+                            help='options chosen for each menu')
+        parser.add_argument('--repeat', type=int, default=50)
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            self._run(options['options'], options['checked'],
+                      options['repeat'])
+            transaction.set_rollback(True)
+
+    def _run(self, catalog, checked, repeat):
+        MenuOption.objects.bulk_create(
+            [MenuOption(name='benchmark {}'.format(i), description='')
+             for i in range(catalog)], batch_size=500)
+        option_ids = list(MenuOption.objects.values_list('id', flat=True)
+                          .order_by('-id')[:checked])
+        user = User.objects.create_superuser('benchmark_add_menu')
+        data = {'pub_date': '01/01/2020'}
+        data.update({'menu_option_{}'.format(option_id): 'on'
+                     for option_id in option_ids})
+        factory = RequestFactory()
+
+        queries = 0
+        start = time.perf_counter()
+        for _ in range(repeat):
+            request = factory.post('/add_menu/', data)
+            request.user = user
+            with CaptureQueriesContext(connection) as context:
+                views.add_menu(request)
+            queries += len(context)
+        elapsed = time.perf_counter() - start
+
+        self.stdout.write(
+            '{} options, {} checked: {:.2f} ms and {:.1f} queries '
+            'per menu'.format(catalog, checked, elapsed / repeat * 1000,
+                              queries / repeat))
@@ -0,0 +1,76 @@
+import time
+import datetime
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.utils.timezone import now, timedelta
+from app.models import Menu, MenuOption, Order
+
+
+class Command(BaseCommand):
+    help = ('Seeds a multi-year dataset inside a transaction that is rolled '
+            'back, then prints the query plan and timing of the hot date '
+            'window queries. Run it before and after `migrate app 0015` to '
+            'compare table scans against index lookups.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--years', type=int, default=3)
+        parser.add_argument('--users', type=int, default=100)
+        parser.add_argument('--repeat', type=int, default=200)
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            user, menu = self._seed(options['years'], options['users'])
+            for name, queryset in self._queries(user, menu):
+                self._report(name, queryset, options['repeat'])
+            transaction.set_rollback(True)
+
+    def _seed(self, years, users):
+        start = time.perf_counter()
+        option = MenuOption.objects.create(name='benchmark', description='')
+        users = User.objects.bulk_create(
+            [User(username='benchmark_{}'.format(i)) for i in range(users)])
+        users = list(User.objects.filter(username__startswith='benchmark_'))
+        today = now().replace(hour=9, minute=0, second=0, microsecond=0)
+        menus = Menu.objects.bulk_create(
+            [Menu(pub_date=today - timedelta(days=day))
+             for day in range(years * 365)], batch_size=500)
+        menus = list(Menu.objects.filter(pub_date__lte=today)
+                     .order_by('-pub_date')[:years * 365])
+        for menu in menus:
+            Order.objects.bulk_create(
+                [Order(user=user, menu=menu, menu_option=option,
+                       purchased_date=menu.pub_date) for user in users],
+                batch_size=500)
+        self.stdout.write('Seeded {} menus and {} orders in {:.2f}s'.format(
+            len(menus), len(menus) * len(users),
+            time.perf_counter() - start))
+        return users[0], menus[0]
+
+    def _queries(self, user, menu):
+        today = menu.pub_date
+        today_min = today.replace(hour=0)
+        today_max = today + timedelta(hours=3)
+        return [
+            ('index/daily_menu: menu of today',
+             Menu.objects.filter(pub_date__gte=today_min,
+                                 pub_date__lte=today_max)
+             .order_by('-pub_date')[:1]),
+            ('view_orders: orders of today',
+             Order.objects.filter(purchased_date__gte=today_min,
+                                  purchased_date__lte=today_max)),
+            ('choose_menu: order of user for menu',
+             Order.objects.filter(user=user, menu=menu)),
+            ('menu: menu by uuid',
+             Menu.objects.filter(uuid=menu.uuid)),
+        ]
+
+    def _report(self, name, queryset, repeat):
+        start = time.perf_counter()
+        for _ in range(repeat):
+            list(queryset.all())
+        elapsed = (time.perf_counter() - start) / repeat
+        self.stdout.write(self.style.MIGRATE_HEADING(name))
+        self.stdout.write('  {:.3f} ms per query'.format(elapsed * 1000))
+        for line in queryset.explain().splitlines():
+            self.stdout.write('  ' + line)
@@ -0,0 +1,32 @@
+import time
+import asyncio
+from django.core.management.base import BaseCommand
+from app.fake_slack import FakeSlackServer
+from app.notifiers import SlackNotifier
+from app import services
+
+
+class Command(BaseCommand):
+    help = ('Measures reminder fan-out throughput against a local fake '
+            'Slack server, no network access or database rows needed')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--recipients', type=int, default=1000)
+        parser.add_argument('--latency', type=float, default=0.05,
+                            help='seconds each fake slack call takes')
+
+    def handle(self, *args, **options):
+        elapsed, sent = asyncio.run(self._run(
+            options['recipients'], options['latency']))
+        self.stdout.write(
+            'Sent {} reminders in {:.2f}s ({:.0f} reminders/s)'.format(
+                sent, elapsed, sent / elapsed if elapsed else 0))
+
+    async def _run(self, recipients, latency):
+        slack_users = ['U{:08d}'.format(i) for i in range(recipients)]
+        async with FakeSlackServer(latency=latency) as slack:
+            notifier = SlackNotifier(token='benchmark', base_url=slack.url)
+            start = time.perf_counter()
+            sent = await services._send_reminders_with_slack_async(
+                notifier, 'benchmark', slack_users)
+            return time.perf_counter() - start, sent
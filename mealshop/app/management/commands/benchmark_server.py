@@ -0,0 +1,81 @@
+import os
+import sys
+import subprocess
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from app.loadtest import LoadTestData, run_http_benchmark, wait_for_server
+
+HOST = '127.0.0.1'
+
+
+class Command(BaseCommand):
+    help = ('Starts runserver, as run.sh does by default, and then gunicorn '
+            'with gunicorn.conf.py, as SERVER=wsgi does, and measures the '
+            'requests/s and latency of logged in employees reading the '
+            'menu page and the JSON API of each one. Seeded rows are '
+            'deleted at the end. Both servers use this database, set '
+            'DATABASE_NAME to run it against a copy.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--servers', nargs='+',
+                            choices=['runserver', 'gunicorn'],
+                            default=['runserver', 'gunicorn'])
+        parser.add_argument('--duration', type=float, default=10)
+        parser.add_argument('--concurrency', type=int, default=16)
+        parser.add_argument('--port', type=int, default=8765)
+
+    def handle(self, *args, **options):
+        data = LoadTestData(users=options['concurrency'])
+        try:
+            results = {}
+            for server in options['servers']:
+                report = self._run(server, data, options)
+                self.stdout.write('{} (DEBUG={})'.format(
+                    server, self._env(server)['DEBUG']))
+                for line in report.lines():
+                    self.stdout.write(line)
+                self.stdout.write('')
+                results[server] = report.requests / report.elapsed
+        finally:
+            data.delete()
+
+        if len(results) == 2:
+            self.stdout.write('gunicorn served {:.1f}x the requests/s of '
+                              'runserver'.format(results['gunicorn'] /
+                                                 results['runserver']))
+
+    def _run(self, server, data, options):
+        port = options['port']
+        if server == 'runserver':
+            command = [sys.executable, 'manage.py', 'runserver',
+                       '--noreload', '{}:{}'.format(HOST, port)]
+        else:
+            command = ['gunicorn', '-c', 'gunicorn.conf.py', '--bind',
+                       '{}:{}'.format(HOST, port),
+                       'mealshop.wsgi:application']
+        process = subprocess.Popen(command, cwd=settings.BASE_DIR,
+                                   env=self._env(server),
+                                   stdout=subprocess.DEVNULL,
+                                   stderr=subprocess.DEVNULL)
+        try:
+            if not wait_for_server(HOST, port):
+                raise CommandError('{} did not start on port {}'.format(
+                    server, port))
+            return run_http_benchmark(data, HOST, port,
+                                      options['duration'],
+                                      options['concurrency'])
+        finally:
+            process.terminate()
+            process.wait()
+
+    def _env(self, server):
+        # runserver keeps the DEBUG of the environment like run.sh, gunicorn
+        # gets the DEBUG=false and SQLITE_WAL=true SERVER=wsgi sets when they
+        # are not given
+        env = dict(os.environ, ALLOWED_HOSTS=HOST)
+        if server == 'gunicorn':
+            env.setdefault('DEBUG', 'false')
+            env.setdefault('SQLITE_WAL', 'true')
+        else:
+            env.setdefault('DEBUG', 'true')
+        return env
@@ -0,0 +1,31 @@
+from django.core.management.base import BaseCommand
+from django.test.utils import setup_test_environment
+from app.loadtest import LoadTestData, run_order_rush
+
+
+class Command(BaseCommand):
+    help = ('Simulates the order rush before the cutoff: seeded employees '
+            'choose the menu, order and customize through the real urls '
+            'with concurrent clients while the kitchen polls view_orders. '
+            'Reports latency percentiles, requests/s and queries per '
+            'request. Seeded rows are deleted at the end.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=200)
+        parser.add_argument('--options', type=int, default=5)
+        parser.add_argument('--customizations', type=int, default=4)
+        parser.add_argument('--concurrency', type=int, default=10)
+        parser.add_argument('--seed', type=int, default=None)
+
+    def handle(self, *args, **options):
+        setup_test_environment()
+        data = LoadTestData(options['users'], options['options'],
+                            options['customizations'])
+        try:
+            report = run_order_rush(data, options['concurrency'],
+                                    seed=options['seed'])
+        finally:
+            data.delete()
+
+        for line in report.lines():
+            self.stdout.write(line)
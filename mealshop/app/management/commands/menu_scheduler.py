@@ -0,0 +1,33 @@
+import time
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from app import scheduler
+
+
+class Command(BaseCommand):
+    help = ('Warms the cached menus before they open, when the cache is '
+            'shared with the web workers, and queues the slack reminders of '
+            'scheduled menus when they open')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--poll-interval', type=float, default=30,
+                            help='longest wait between passes, in seconds')
+        parser.add_argument('--once', action='store_true',
+                            help='run one pass and exit, to run from cron')
+
+    def handle(self, *args, **options):
+        if not settings.SHARED_CACHE:
+            self.stderr.write('The cache is not shared with the web '
+                              'workers, menus are not warmed. Set '
+                              'CACHE_BACKEND to a shared cache to warm them.')
+        while True:
+            days, reminded = scheduler.run_schedule()
+            for day in days:
+                self.stdout.write('Warmed menus of {}'.format(day))
+            for menu in reminded:
+                self.stdout.write('Queued reminders of menu {}'.format(
+                    menu.id))
+            if options['once']:
+                return
+            time.sleep(scheduler.seconds_until_next_run(
+                options['poll_interval']))
@@ -0,0 +1,24 @@
+import time
+from django.core.management.base import BaseCommand
+from app import services
+
+
+class Command(BaseCommand):
+    help = 'Sends the queued slack reminders, retrying failed ones'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=100)
+        parser.add_argument('--poll-interval', type=float, default=2,
+                            help='seconds to wait when nothing is due')
+        parser.add_argument('--once', action='store_true',
+                            help='process due reminders and exit')
+
+    def handle(self, *args, **options):
+        while True:
+            claimed = services.process_reminders(options['batch_size'])
+            if claimed:
+                self.stdout.write('Processed {} reminders'.format(claimed))
+            elif options['once']:
+                return
+            else:
+                time.sleep(options['poll_interval'])
@@ -0,0 +1,156 @@
+import time
+import random
+import datetime
+from django.contrib.auth.hashers import make_password
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Max
+from django.utils.timezone import get_current_timezone, localdate, timedelta
+from app.models import (
+    Menu, MenuOption, MenuOptionCustomization, Order, OrderCustomization,
+    Profile
+)
+from app.rollups import rebuild_rollups
+
+
+class Command(BaseCommand):
+    help = ('Generates a production sized dataset with bulk inserts: '
+            'employees with profiles, a dish catalog with customizations '
+            'and a daily menu with its orders for every past day. '
+            'bulk_create does not send post_save, so the per user profile '
+            'signals are skipped: profiles are inserted in bulk too and '
+            'the daily order rollups are rebuilt at the end.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=1000)
+        parser.add_argument('--options', type=int, default=100,
+                            help='dishes in the catalog')
+        parser.add_argument('--customizations', type=int, default=4,
+                            help='customizations of each dish')
+        parser.add_argument('--days', type=int, default=365,
+                            help='days of menus, ending today')
+        parser.add_argument('--menu-options', type=int, default=4,
+                            help='dishes in each daily menu')
+        parser.add_argument('--participation', type=float, default=0.7,
+                            help='share of employees ordering each day')
+        parser.add_argument('--batch-size', type=int, default=2000)
+        parser.add_argument('--password', default='mealshop')
+        parser.add_argument('--seed', type=int, default=None)
+
+    def handle(self, *args, **options):
+        self.rng = random.Random(options['seed'])
+        self.batch_size = options['batch_size']
+        self.prefix = 'seed_{}_'.format(int(time.time()))
+        start = time.perf_counter()
+
+        with transaction.atomic():
+            users = self._seed_users(options['users'], options['password'])
+            catalog = self._seed_catalog(options['options'],
+                                         options['customizations'])
+            menus, orders, customizations = self._seed_menus(
+                users, catalog, options['days'], options['menu_options'],
+                options['participation'])
+            today = localdate()
+            rebuild_rollups(today - timedelta(days=options['days']), today)
+
+        self.stdout.write(self.style.SUCCESS(
+            'Seeded {} users, {} dishes, {} menus, {} orders and {} order '
+            'customizations in {:.1f}s'.format(
+                len(users), len(catalog), menus, orders, customizations,
+                time.perf_counter() - start)))
+
+    def _seed_users(self, amount, password):
+        password = make_password(password)
+        User.objects.bulk_create(
+            [User(username='{}{}'.format(self.prefix, i), password=password,
+                  email='{}{}@mealshop.local'.format(self.prefix, i))
+             for i in range(amount)], batch_size=self.batch_size)
+        users = list(User.objects.filter(username__startswith=self.prefix)
+                     .values_list('id', flat=True))
+        Profile.objects.bulk_create(
+            [Profile(user_id=user_id) for user_id in users],
+            batch_size=self.batch_size)
+        return users
+
+    def _seed_catalog(self, amount, customizations):
+        MenuOption.objects.bulk_create(
+            [MenuOption(name='{}dish {}'.format(self.prefix, i),
+                        description='')
+             for i in range(amount)], batch_size=self.batch_size)
+        options = list(MenuOption.objects
+                       .filter(name__startswith=self.prefix)
+                       .values_list('id', flat=True))
+        MenuOptionCustomization.objects.bulk_create(
+            [MenuOptionCustomization(name='extra {}'.format(i),
+                                     menu_option_id=option_id)
+             for option_id in options for i in range(customizations)],
+            batch_size=self.batch_size)
+
+        catalog = {option_id: [] for option_id in options}
+        for custom_id, option_id in (MenuOptionCustomization.objects
+                                     .filter(menu_option_id__in=options)
+                                     .values_list('id', 'menu_option_id')):
+            catalog[option_id].append(custom_id)
+        return catalog
+
+    def _seed_menus(self, users, catalog, days, menu_options, participation):
+        """
+        Menus are inserted a chunk of days at a time, then their orders and
+        then the customizations of those orders, reading back the ids
+        because SQLite bulk_create does not return them
+        """
+        tz = get_current_timezone()
+        today = localdate()
+        dates = [today - timedelta(days=day) for day in range(days)]
+        days_per_chunk = max(self.batch_size // max(len(users), 1), 1)
+        totals = [0, 0, 0]
+
+        for i in range(0, len(dates), days_per_chunk):
+            chunk = dates[i:i + days_per_chunk]
+            pub_dates = [tz.localize(datetime.datetime.combine(
+                date, datetime.time(hour=1))) for date in chunk]
+            last_id = Menu.objects.aggregate(last=Max('id'))['last'] or 0
+            Menu.objects.bulk_create([Menu(pub_date=pub_date)
+                                      for pub_date in pub_dates])
+            menus = list(Menu.objects.filter(id__gt=last_id)
+                         .values_list('id', 'pub_date'))
+
+            through, orders = [], []
+            for menu_id, pub_date in menus:
+                dishes = self.rng.sample(list(catalog),
+                                         min(menu_options, len(catalog)))
+                through.extend(Menu.menu_options.through(
+                    menu_id=menu_id, menuoption_id=dish) for dish in dishes)
+                for user_id in self.rng.sample(
+                        users, int(len(users) * participation)):
+                    orders.append(Order(
+                        user_id=user_id, menu_id=menu_id,
+                        menu_option_id=self.rng.choice(dishes),
+                        purchased_date=pub_date + timedelta(
+                            minutes=self.rng.randint(60, 590))))
+            Menu.menu_options.through.objects.bulk_create(
+                through, batch_size=self.batch_size)
+            Order.objects.bulk_create(orders, batch_size=self.batch_size)
+
+            order_customizations = []
+            for order_id, option_id in (Order.objects
+                                        .filter(menu_id__in=[
+                                            menu_id for menu_id, _ in menus])
+                                        .values_list('id', 'menu_option_id')
+                                        .iterator()):
+                customizations = catalog[option_id]
+                for custom_id in self.rng.sample(
+                        customizations,
+                        self.rng.randint(0, min(2, len(customizations)))):
+                    order_customizations.append(OrderCustomization(
+                        order_id=order_id, menu_option_custom_id=custom_id))
+            OrderCustomization.objects.bulk_create(
+                order_customizations, batch_size=self.batch_size)
+
+            totals[0] += len(menus)
+            totals[1] += len(orders)
+            totals[2] += len(order_customizations)
+            self.stdout.write('  {} menus seeded'.format(totals[0]))
+
+        return totals
@@ -0,0 +1,22 @@
+from asgiref.sync import async_to_sync
+from django.core.management.base import BaseCommand, CommandError
+from app.models import Menu
+from app import services
+
+
+class Command(BaseCommand):
+    help = 'Sends the slack reminder of a menu to all employees'
+
+    def add_arguments(self, parser):
+        parser.add_argument('menu_id', type=int)
+
+    def handle(self, *args, **options):
+        try:
+            menu = Menu.objects.get(pk=options['menu_id'])
+        except Menu.DoesNotExist:
+            raise CommandError('Menu {} does not exist'.format(
+                options['menu_id']))
+
+        sent = async_to_sync(services.send_reminders)(menu)
+        self.stdout.write(self.style.SUCCESS(
+            'Sent {} reminders of menu {}'.format(sent, menu)))
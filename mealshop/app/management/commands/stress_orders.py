@@ -0,0 +1,75 @@
+import time
+import threading
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from django.db import connection, OperationalError
+from django.test import RequestFactory
+from app.models import Menu, MenuOption, Order
+from app import views
+
+
+class Command(BaseCommand):
+    help = ('Posts orders through add_order from many threads at once '
+            'against the configured database, to check concurrent writes '
+            'at the order cutoff do not fail. Rows created are deleted at '
+            'the end.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--threads', type=int, default=20)
+        parser.add_argument('--users', type=int, default=200)
+
+    def handle(self, *args, **options):
+        users, menu, menu_option = self._seed(options['users'])
+        try:
+            self._run(users, menu, menu_option, options['threads'])
+        finally:
+            User.objects.filter(id__in=[user.id for user in users]).delete()
+            menu.delete()
+            menu_option.delete()
+
+    def _seed(self, amount):
+        prefix = 'stress_{}_'.format(int(time.time()))
+        User.objects.bulk_create(
+            [User(username='{}{}'.format(prefix, i)) for i in range(amount)])
+        users = list(User.objects.filter(username__startswith=prefix))
+        menu_option = MenuOption.objects.create(name='stress',
+                                                description='')
+        menu = Menu.objects.create()
+        menu.menu_options.add(menu_option)
+        return users, menu, menu_option
+
+    def _run(self, users, menu, menu_option, threads):
+        factory = RequestFactory()
+        errors = []
+
+        def post_orders(users):
+            try:
+                for user in users:
+                    request = factory.post(
+                        '/{}/add_order'.format(menu.id),
+                        {'menu_option_id': menu_option.id})
+                    request.user = user
+                    try:
+                        views.add_order(request, menu.id)
+                    except OperationalError as e:
+                        errors.append(e)
+            finally:
+                connection.close()
+
+        workers = [threading.Thread(target=post_orders,
+                                    args=(users[i::threads],))
+                   for i in range(threads)]
+        start = time.perf_counter()
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+        elapsed = time.perf_counter() - start
+
+        created = Order.objects.filter(menu=menu).count()
+        self.stdout.write(
+            '{} orders from {} threads in {:.2f}s ({:.0f} orders/s), '
+            '{} errors'.format(created, threads, elapsed,
+                               created / elapsed, len(errors)))
+        for error in set(str(e) for e in errors):
+            self.stderr.write(error)
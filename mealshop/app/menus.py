@@ -0,0 +1,212 @@
+import hashlib
+from functools import wraps
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.http import HttpResponse
+from django.db.models.signals import (
+    post_save, post_delete, pre_delete, m2m_changed
+)
+from django.dispatch import receiver
+from django.utils.timezone import localdate, now
+from .models import Menu, MenuOption, MenuOptionCustomization
+from .order_window import get_order_window, menu_order_window
+
+
+TODAY_MENU_KEY = 'app:today_menu:{}'
+MENU_PAGE_KEY = 'app:menu_page:{}'
+# menu options and their customizations, everything the menu pages render
+MENU_PREFETCH = 'menu_options__menuoptioncustomization_set'
+
+
+def get_today_menu():
+    """
+    Menu of today with its menu options and their customizations
+    prefetched, cached until a menu, menu option or customization changes
+    so menu pages do not hit the database. Menus
+    scheduled to open later in the day are cached too, so they replace the
+    current one at their opens_at without a query.
+
+    Returns:
+    Menu or None if there is no menu open today
+    """
+    when = now()
+    for menu in _get_today_menus()['menus']:
+        if menu.opens_at is None or menu.opens_at <= when:
+            return menu
+    return None
+
+
+def warm_today_menu(day=None):
+    """
+    Loads the menus of a day with MENU_PREFETCH and caches them, the
+    menu scheduler calls it before a menu opens when the cache is shared
+    with the web workers, so the first employees do not all miss it at once
+
+    Parameters:
+    day (date): day of the menus, today by default
+
+    Returns:
+    dict {'menus': list of Menu, latest published first,
+          'version': digest of their rows, 'updated': last change or None}
+    """
+    day = localdate() if day is None else day
+    window = get_order_window(day)
+    menus = list(Menu.objects
+                 .filter(pub_date__gte=window.opens,
+                         pub_date__lte=window.ends)
+                 .prefetch_related(MENU_PREFETCH)
+                 .order_by('-pub_date'))
+    # derived from the rows only, so every process caching the same menus
+    # gives the same version and the same ETags
+    rows = [(menu.pk, menu.updated_at, menu.pub_date, menu.opens_at,
+             menu.closes_at,
+             [(option.pk, option.updated_at,
+               [(custom.pk, custom.updated_at) for custom
+                in option.menuoptioncustomization_set.all()])
+              for option in menu.menu_options.all()])
+            for menu in menus]
+    updated = [menu.updated_at for menu in menus] + [
+        row.updated_at for menu in menus for option in menu.menu_options.all()
+        for row in [option, *option.menuoptioncustomization_set.all()]]
+    cached = {'menus': menus,
+              'version': hashlib.md5(repr(rows).encode()).hexdigest(),
+              'updated': max(updated, default=None)}
+    cache.set(_today_menu_key(day), cached,
+              settings.TODAY_MENU_CACHE_TIMEOUT)
+    return cached
+
+
+def invalidate_today_menu(*dates):
+    """
+    Drops the cached menu of today and of every date given
+
+    Parameters:
+    dates (date): other dates whose cached menu has to be dropped
+    """
+    keys = [_today_menu_key(date) for date in {localdate(), *dates}]
+    cache.delete_many(keys)
+    # dropped again once committed, a request reading the menus before the
+    # commit may have cached them again
+    transaction.on_commit(lambda: cache.delete_many(keys))
+
+
+def get_menu_version():
+    """
+    Digest of today's menus, their options and customizations, it changes
+    when any of them does
+    """
+    return _get_today_menus()['version']
+
+
+def menu_page_etag(request, *args, **kwargs):
+    """
+    ETag of the public menu pages, it changes with the menus, the menu
+    open, the order cutoff and the user displayed on the page
+    """
+    menu = get_today_menu()
+    state = [request.get_full_path(), get_menu_version(),
+             localdate().isoformat(), menu and menu.pk,
+             get_today_order_window().is_open(), request.user.pk]
+    return hashlib.md5(repr(state).encode()).hexdigest()
+
+
+def menu_page_last_modified(request, *args, **kwargs):
+    """
+    Last-Modified of the public menu pages, the last menu change or the
+    start of the day or the order cutoff if they are more recent
+    """
+    window = get_today_order_window()
+    updated = _get_today_menus()['updated']
+    boundaries = [window.opens] + (
+        [window.closes] if now() > window.closes else [])
+    return max(boundaries + ([updated] if updated else []))
+
+
+def cache_anonymous_page(view):
+    """
+    Keeps the rendered page of anonymous users keyed by its ETag, so repeated
+    requests skip the view and the template engine
+    """
+    @wraps(view)
+    def wrapper(request, *args, **kwargs):
+        if request.user.is_authenticated:
+            return view(request, *args, **kwargs)
+
+        key = MENU_PAGE_KEY.format(menu_page_etag(request, *args, **kwargs))
+        cached = cache.get(key)
+        if cached is not None:
+            content, content_type = cached
+            return HttpResponse(content, content_type=content_type)
+
+        response = view(request, *args, **kwargs)
+        if response.status_code == 200 and not response.streaming:
+            cache.set(key, (response.content, response['Content-Type']),
+                      settings.TODAY_MENU_CACHE_TIMEOUT)
+        return response
+    return wrapper
+
+
+def get_today_order_window():
+    """
+    Order window of today's menu, or of the site when there is no menu
+    """
+    menu = get_today_menu()
+    if menu is None:
+        return get_order_window()
+    return menu_order_window(menu)
+
+
+def _get_today_menus():
+    cached = cache.get(_today_menu_key(localdate()))
+    if cached is None:
+        cached = warm_today_menu()
+    return cached
+
+
+def _today_menu_key(date):
+    return TODAY_MENU_KEY.format(date.isoformat())
+
+
+# Menus are touched when options are added, removed or deleted from them,
+# so their updated_at, the Last-Modified of the menu pages, follows every
+# change of what they show. update() does not send post_save again.
+
+@receiver(m2m_changed, sender=Menu.menu_options.through)
+def touch_menu_options_changed(sender, instance, action, reverse, pk_set,
+                               **kwargs):
+    if not reverse and action in ('post_add', 'post_remove', 'post_clear'):
+        menus = Menu.objects.filter(pk=instance.pk)
+    elif reverse and action in ('post_add', 'post_remove'):
+        menus = Menu.objects.filter(pk__in=pk_set)
+    elif reverse and action == 'pre_clear':
+        menus = Menu.objects.filter(menu_options=instance)
+    else:
+        return
+    menus.update(updated_at=now())
+
+
+@receiver(pre_delete, sender=MenuOption)
+def touch_menus_of_deleted_option(sender, instance, **kwargs):
+    Menu.objects.filter(menu_options=instance).update(updated_at=now())
+
+
+@receiver(post_delete, sender=MenuOptionCustomization)
+def touch_menus_of_deleted_customization(sender, instance, **kwargs):
+    Menu.objects.filter(menu_options=instance.menu_option_id).update(
+        updated_at=now())
+
+
+@receiver(post_save, sender=Menu)
+@receiver(post_delete, sender=Menu)
+def invalidate_menu(sender, instance, **kwargs):
+    invalidate_today_menu(localdate(instance.pub_date))
+
+
+@receiver(post_save, sender=MenuOption)
+@receiver(post_delete, sender=MenuOption)
+@receiver(post_save, sender=MenuOptionCustomization)
+@receiver(post_delete, sender=MenuOptionCustomization)
+@receiver(m2m_changed, sender=Menu.menu_options.through)
+def invalidate_menu_options(sender, **kwargs):
+    invalidate_today_menu()
@@ -0,0 +1,258 @@
+import threading
+from collections import defaultdict
+from django.db.models import Count, Q
+
+
+class Histogram:
+    """
+    Cumulative histogram in the Prometheus style, counts[i] is the amount
+    of observations lower or equal than buckets[i], the last count is +Inf
+
+    Parameters:
+    buckets (list of float): upper bounds of the buckets
+    """
+
+    def __init__(self, buckets):
+        self.buckets = sorted(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.count = 0
+        self.sum = 0
+
+    def observe(self, value):
+        self.count += 1
+        self.sum += value
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[i] += 1
+        self.counts[-1] += 1
+
+    def add(self, counts, total):
+        """
+        Adds the observations of another histogram with the same buckets
+
+        Parameters:
+        counts (list of int): its counts
+        total (float): its sum
+        """
+        self.counts = [count + other
+                       for count, other in zip(self.counts, counts)]
+        self.count = self.counts[-1]
+        self.sum += total
+
+    def copy(self):
+        histogram = Histogram(self.buckets)
+        histogram.counts = list(self.counts)
+        histogram.count = self.count
+        histogram.sum = self.sum
+        return histogram
+
+    def as_dict(self):
+        buckets = [str(bound) for bound in self.buckets] + ['+Inf']
+        return {
+            'count': self.count,
+            'sum': self.sum,
+            'mean': self.sum / self.count if self.count else 0,
+            'buckets': dict(zip(buckets, self.counts)),
+        }
+
+
+class RequestMetrics:
+    """
+    In process aggregate of the requests served, per view
+    """
+    LATENCY_BUCKETS = [5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000]
+    QUERY_BUCKETS = [0, 1, 2, 5, 10, 20, 50, 100]
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._views = defaultdict(self._new_view)
+
+    def _new_view(self):
+        return {
+            'total_ms': Histogram(self.LATENCY_BUCKETS),
+            'db_ms': Histogram(self.LATENCY_BUCKETS),
+            'template_ms': Histogram(self.LATENCY_BUCKETS),
+            'queries': Histogram(self.QUERY_BUCKETS),
+            'over_query_budget': 0,
+        }
+
+    def record(self, view, total_ms, db_ms, template_ms, queries,
+               over_budget):
+        with self._lock:
+            metrics = self._views[view]
+            metrics['total_ms'].observe(total_ms)
+            metrics['db_ms'].observe(db_ms)
+            metrics['template_ms'].observe(template_ms)
+            metrics['queries'].observe(queries)
+            metrics['over_query_budget'] += int(over_budget)
+
+    def snapshot(self):
+        """
+        Copy of the metrics of every view, safe to read while requests
+        keep being recorded
+
+        Returns:
+        dict {view: {metric: Histogram or int}}
+        """
+        with self._lock:
+            return {view: {name: (value.copy()
+                                  if isinstance(value, Histogram) else value)
+                           for name, value in metrics.items()}
+                    for view, metrics in self._views.items()}
+
+    def as_dict(self):
+        return {view: {name: (value.as_dict()
+                              if isinstance(value, Histogram) else value)
+                       for name, value in metrics.items()}
+                for view, metrics in self.snapshot().items()}
+
+    def reset(self):
+        with self._lock:
+            self._views.clear()
+
+
+class ReminderMetrics:
+    """
+    Counters and timings of the slack reminders queued per menu. Counters
+    are aggregated from the Reminder rows, rate limits and timings are kept
+    by the reminder worker until its batch is done and stored as
+    ReminderBatch rows, so every process reports what the worker did.
+    """
+    COUNTERS = {
+        'recipients': 'Employees a reminder was queued for',
+        'sent': 'Reminders accepted by slack',
+        'failed': 'Reminders that failed their last attempt',
+        'rate_limited': 'Calls answered with 429 by slack',
+    }
+    HISTOGRAMS = {
+        'call_seconds': ('Latency of each reminders.add call',
+                         [0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10]),
+        'batch_seconds': ('Duration of a reminder batch, from the first '
+                          'call to the last answer',
+                          [1, 5, 10, 30, 60, 120, 300, 600]),
+    }
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._batches = defaultdict(self._new_batch)
+
+    def _new_batch(self):
+        return {
+            'rate_limited': 0,
+            'call_seconds': Histogram(self.HISTOGRAMS['call_seconds'][1]),
+        }
+
+    def inc(self, name, menu_id, amount=1):
+        with self._lock:
+            self._batches[menu_id][name] += amount
+
+    def observe(self, name, menu_id, value):
+        with self._lock:
+            self._batches[menu_id][name].observe(value)
+
+    def save_batch(self, menu_id, seconds):
+        """
+        Stores the rate limits and call timings recorded for the menu since
+        its last batch, with the duration of the batch
+
+        Parameters:
+        menu_id (int): menu of the reminders sent
+        seconds (float): duration of the batch
+        """
+        from .models import ReminderBatch
+        with self._lock:
+            batch = self._batches.pop(menu_id, None) or self._new_batch()
+        ReminderBatch.objects.create(
+            menu_id=menu_id, seconds=seconds,
+            call_counts=batch['call_seconds'].counts,
+            call_seconds=batch['call_seconds'].sum,
+            rate_limited=batch['rate_limited'])
+
+    def snapshot(self):
+        """
+        Metrics of every menu with queued reminders
+
+        Returns:
+        dict {metric: {menu_id: int or Histogram}}, histograms only for the
+        menus with observations
+        """
+        from .models import Reminder, ReminderBatch
+        rows = (Reminder.objects.values('menu_id')
+                .annotate(recipients=Count('id'),
+                          sent=Count('id', filter=Q(status=Reminder.SENT)),
+                          failed=Count('id',
+                                       filter=Q(status=Reminder.FAILED)))
+                .order_by('menu_id'))
+        metrics = {name: {} for name in [*self.COUNTERS, *self.HISTOGRAMS]}
+        for row in rows:
+            for name in ('recipients', 'sent', 'failed'):
+                metrics[name][row['menu_id']] = row[name]
+            metrics['rate_limited'][row['menu_id']] = 0
+
+        histograms = {name: defaultdict(lambda buckets=buckets:
+                                        Histogram(buckets))
+                      for name, (_, buckets) in self.HISTOGRAMS.items()}
+        for batch in ReminderBatch.objects.filter(
+                menu_id__in=metrics['recipients']).order_by('id'):
+            metrics['rate_limited'][batch.menu_id] += batch.rate_limited
+            histograms['batch_seconds'][batch.menu_id].observe(batch.seconds)
+            histograms['call_seconds'][batch.menu_id].add(
+                batch.call_counts, batch.call_seconds)
+        for name, values in histograms.items():
+            metrics[name] = {menu_id: histogram
+                             for menu_id, histogram in values.items()
+                             if histogram.count}
+        return metrics
+
+    def as_dict(self):
+        return {name: {menu_id: (value.as_dict()
+                                 if isinstance(value, Histogram) else value)
+                       for menu_id, value in values.items()}
+                for name, values in self.snapshot().items()}
+
+    def prometheus_lines(self):
+        lines = []
+        metrics = self.snapshot()
+        for name, description in self.COUNTERS.items():
+            metric = 'mealshop_reminder_{}_total'.format(name)
+            lines += ['# HELP {} {}'.format(metric, description),
+                      '# TYPE {} counter'.format(metric)]
+            for menu_id, value in sorted(metrics[name].items()):
+                lines.append('{}{{menu="{}"}} {}'.format(
+                    metric, menu_id, value))
+        for name, (description, _) in self.HISTOGRAMS.items():
+            metric = 'mealshop_reminder_{}'.format(name)
+            lines += ['# HELP {} {}'.format(metric, description),
+                      '# TYPE {} histogram'.format(metric)]
+            for menu_id, histogram in sorted(metrics[name].items()):
+                lines += _prometheus_histogram(
+                    metric, 'menu="{}"'.format(menu_id), histogram)
+        return lines
+
+
+def prometheus_text():
+    """
+    Reminder and request metrics in the Prometheus text exposition format
+    """
+    lines = reminder_metrics.prometheus_lines()
+    views = sorted(request_metrics.snapshot().items())
+    for name in ('total_ms', 'db_ms', 'template_ms', 'queries'):
+        metric = 'mealshop_request_{}'.format(name)
+        lines.append('# TYPE {} histogram'.format(metric))
+        for view, metrics in views:
+            lines += _prometheus_histogram(
+                metric, 'view="{}"'.format(view), metrics[name])
+    return '\n'.join(lines) + '\n'
+
+
+def _prometheus_histogram(metric, labels, histogram):
+    bounds = [str(bound) for bound in histogram.buckets] + ['+Inf']
+    lines = ['{}_bucket{{{},le="{}"}} {}'.format(metric, labels, bound, count)
+             for bound, count in zip(bounds, histogram.counts)]
+    lines.append('{}_sum{{{}}} {}'.format(metric, labels, histogram.sum))
+    lines.append('{}_count{{{}}} {}'.format(metric, labels, histogram.count))
+    return lines
+
+
+request_metrics = RequestMetrics()
+reminder_metrics = ReminderMetrics()
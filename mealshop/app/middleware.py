@@ -0,0 +1,137 @@
+import json
+import time
+import logging
+import contextvars
+from contextlib import ExitStack
+from asgiref.sync import (
+    iscoroutinefunction, markcoroutinefunction, sync_to_async
+)
+from django.conf import settings
+from django.db import connections
+from .metrics import request_metrics
+from .templating import render_time
+
+
+logger = logging.getLogger('app.metrics')
+
+# [count, seconds] of the database queries of the current request. It is a
+# context variable so queries run by async views through sync_to_async, in
+# another thread and connection, are counted too.
+request_queries = contextvars.ContextVar('request_queries', default=None)
+
+
+def count_queries(execute, sql, params, many, context):
+    """
+    Execute wrapper installed by RequestMetricsMiddleware while a request is
+    served, it adds the query to request_queries
+    """
+    queries = request_queries.get()
+    # async requests served at the same time install it on the same thread
+    # and connection, only the outermost one counts the query
+    if queries is None or context.get('counted'):
+        return execute(sql, params, many, context)
+    context['counted'] = True
+    start = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        queries[0] += 1
+        queries[1] += time.perf_counter() - start
+
+
+def _count_queries():
+    """
+    Installs count_queries on the connections of the current thread until
+    the returned ExitStack is closed
+    """
+    stack = ExitStack()
+    for connection in connections.all():
+        stack.enter_context(connection.execute_wrapper(count_queries))
+    return stack
+
+
+class RequestMetricsMiddleware:
+    """
+    Measures every request: wall time, database queries and time, and
+    template render time. They are logged as a JSON line, sent in the
+    Server-Timing header and aggregated per view in
+    app.metrics.request_metrics. Views doing more queries than
+    settings.REQUEST_QUERY_BUDGET are logged as warnings.
+
+    Streaming responses are measured until the view returns, before their
+    content is read, so the queries made while streaming (the chunks of
+    export_orders) are not counted and the query budget is not checked.
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.is_async = iscoroutinefunction(get_response)
+        if self.is_async:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self.is_async:
+            return self.__acall__(request)
+        measures = self._start()
+        try:
+            with _count_queries():
+                response = self.get_response(request)
+        finally:
+            self._stop(measures)
+        return self._record(request, response, measures)
+
+    async def __acall__(self, request):
+        measures = self._start()
+        # installed in the thread sync_to_async runs the queries of async
+        # views in
+        wrappers = await sync_to_async(_count_queries)()
+        try:
+            response = await self.get_response(request)
+        finally:
+            await sync_to_async(wrappers.close)()
+            self._stop(measures)
+        return self._record(request, response, measures)
+
+    def _start(self):
+        queries, template = [0, 0.0], [0.0]
+        tokens = (request_queries.set(queries), render_time.set(template))
+        return {'queries': queries, 'template': template, 'tokens': tokens,
+                'start': time.perf_counter()}
+
+    def _stop(self, measures):
+        measures['total'] = time.perf_counter() - measures['start']
+        queries_token, template_token = measures['tokens']
+        request_queries.reset(queries_token)
+        render_time.reset(template_token)
+
+    def _record(self, request, response, measures):
+        total = measures['total']
+        template = measures['template'][0]
+        match = request.resolver_match
+        view = match.view_name if match else 'unresolved'
+        query_count, db_time = measures['queries']
+        over_budget = (not response.streaming and
+                       query_count > settings.REQUEST_QUERY_BUDGET)
+        request_metrics.record(view, total * 1000, db_time * 1000,
+                               template * 1000, query_count, over_budget)
+
+        response['Server-Timing'] = ', '.join([
+            'db;dur={:.2f};desc="{} queries"'.format(
+                db_time * 1000, query_count),
+            'tpl;dur={:.2f}'.format(template * 1000),
+            'total;dur={:.2f}'.format(total * 1000),
+        ])
+        logger.info(json.dumps({
+            'view': view, 'method': request.method, 'path': request.path,
+            'status': response.status_code, 'total_ms': total * 1000,
+            'db_ms': db_time * 1000, 'queries': query_count,
+            'template_ms': template * 1000,
+        }))
+        if over_budget:
+            logger.warning('View {} made {} queries, over the budget of '
+                           '{}'.format(view, query_count,
+                                       settings.REQUEST_QUERY_BUDGET))
+        return response
@@ -0,0 +1,59 @@
+# Generated by Django 3.2.25 on 2026-10-17 06:46
+
+from django.conf import settings
+from django.db import migrations, models
+import django.utils.timezone
+import uuid
+
+
+def delete_duplicate_orders(apps, schema_editor):
+    # the latest order of a user for a menu is the one they meant, as
+    # placing an order now replaces the previous one
+    Order = apps.get_model('app', 'Order')
+    duplicated = (Order.objects
+                  .filter(user__isnull=False)
+                  .values('user_id', 'menu_id')
+                  .annotate(orders=models.Count('id'))
+                  .filter(orders__gt=1)
+                  .order_by())
+    for row in duplicated:
+        orders = Order.objects.filter(user_id=row['user_id'],
+                                      menu_id=row['menu_id'])
+        latest = orders.latest('purchased_date', 'id')
+        orders.exclude(pk=latest.pk).delete()
+    if schema_editor.connection.vendor == 'postgresql':
+        # the order table is altered next in this transaction, which
+        # PostgreSQL refuses while the foreign key checks are deferred
+        schema_editor.execute('SET CONSTRAINTS ALL IMMEDIATE')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('app', '0014_reminder'),
+    ]
+
+    operations = [
+        migrations.RunPython(delete_duplicate_orders,
+                             migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name='menu',
+            name='pub_date',
+            field=models.DateTimeField(db_index=True, default=django.utils.timezone.now, verbose_name='date published'),
+        ),
+        migrations.AlterField(
+            model_name='menu',
+            name='uuid',
+            field=models.UUIDField(db_index=True, default=uuid.uuid4, editable=False),
+        ),
+        migrations.AlterField(
+            model_name='order',
+            name='purchased_date',
+            field=models.DateTimeField(db_index=True, default=django.utils.timezone.now, verbose_name='purchased date'),
+        ),
+        migrations.AlterUniqueTogether(
+            name='order',
+            unique_together={('user', 'menu')},
+        ),
+    ]
@@ -0,0 +1,70 @@
+# Generated by Django 3.2.25 on 2026-10-17 07:01
+
+from django.db import migrations, models
+from django.db.models.functions import TruncDate
+import django.db.models.deletion
+
+
+def backfill_rollups(apps, schema_editor):
+    # the orders placed before the rollups existed, as rebuild_rollups
+    # counts them. Without their rows the deltas of deleting those orders
+    # would be dropped, rollups are only inserted for positive ones
+    Order = apps.get_model('app', 'Order')
+    OrderCustomization = apps.get_model('app', 'OrderCustomization')
+    DailyOptionRollup = apps.get_model('app', 'DailyOptionRollup')
+    DailyCustomizationRollup = apps.get_model('app',
+                                              'DailyCustomizationRollup')
+    DailyOptionRollup.objects.bulk_create([
+        DailyOptionRollup(day=row['day'],
+                          menu_option_id=row['menu_option_id'],
+                          orders=row['total'])
+        for row in (Order.objects
+                    .annotate(day=TruncDate('purchased_date'))
+                    .values('day', 'menu_option_id')
+                    .annotate(total=models.Count('id'))
+                    .order_by())], batch_size=1000)
+    DailyCustomizationRollup.objects.bulk_create([
+        DailyCustomizationRollup(
+            day=row['day'],
+            menu_option_custom_id=row['menu_option_custom_id'],
+            orders=row['total'])
+        for row in (OrderCustomization.objects
+                    .annotate(day=TruncDate('order__purchased_date'))
+                    .values('day', 'menu_option_custom_id')
+                    .annotate(total=models.Count('id'))
+                    .order_by())], batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0015_order_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DailyOptionRollup',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('day', models.DateField()),
+                ('orders', models.IntegerField(default=0)),
+                ('menu_option', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='app.menuoption')),
+            ],
+            options={
+                'unique_together': {('day', 'menu_option')},
+            },
+        ),
+        migrations.CreateModel(
+            name='DailyCustomizationRollup',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('day', models.DateField()),
+                ('orders', models.IntegerField(default=0)),
+                ('menu_option_custom', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='app.menuoptioncustomization')),
+            ],
+            options={
+                'unique_together': {('day', 'menu_option_custom')},
+            },
+        ),
+        migrations.RunPython(backfill_rollups, migrations.RunPython.noop),
+    ]
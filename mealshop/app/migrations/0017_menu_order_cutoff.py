@@ -0,0 +1,18 @@
+# Generated by Django 3.2.25 on 2026-10-17 07:04
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0016_daily_rollups'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='menu',
+            name='order_cutoff',
+            field=models.TimeField(blank=True, help_text='Orders are taken until this time, ORDER_CUTOFF if empty', null=True),
+        ),
+    ]
@@ -0,0 +1,44 @@
+# Generated by Django 3.2.25 on 2026-10-17 07:06
+
+import datetime
+from django.db import migrations, models
+from django.utils.timezone import get_current_timezone, localdate
+
+
+def copy_order_cutoff(apps, schema_editor):
+    Menu = apps.get_model('app', 'Menu')
+    tz = get_current_timezone()
+    for menu in Menu.objects.filter(order_cutoff__isnull=False):
+        menu.closes_at = tz.localize(datetime.datetime.combine(
+            localdate(menu.pub_date), menu.order_cutoff))
+        menu.save(update_fields=['closes_at'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0017_menu_order_cutoff'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='menu',
+            name='closes_at',
+            field=models.DateTimeField(blank=True, help_text='Orders are taken until this time, ORDER_CUTOFF of the pub_date day if empty', null=True),
+        ),
+        migrations.AddField(
+            model_name='menu',
+            name='opens_at',
+            field=models.DateTimeField(blank=True, db_index=True, help_text='Published and open to orders at this time, the start of the pub_date day if empty', null=True),
+        ),
+        migrations.AddField(
+            model_name='menu',
+            name='reminded_at',
+            field=models.DateTimeField(blank=True, editable=False, null=True),
+        ),
+        migrations.RunPython(copy_order_cutoff, migrations.RunPython.noop),
+        migrations.RemoveField(
+            model_name='menu',
+            name='order_cutoff',
+        ),
+    ]
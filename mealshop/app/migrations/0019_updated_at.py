@@ -0,0 +1,28 @@
+# Generated by Django 3.2.25 on 2026-10-17 07:33
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0018_menu_schedule'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='menu',
+            name='updated_at',
+            field=models.DateTimeField(auto_now=True),
+        ),
+        migrations.AddField(
+            model_name='menuoption',
+            name='updated_at',
+            field=models.DateTimeField(auto_now=True),
+        ),
+        migrations.AddField(
+            model_name='menuoptioncustomization',
+            name='updated_at',
+            field=models.DateTimeField(auto_now=True),
+        ),
+    ]
@@ -0,0 +1,27 @@
+# Generated by Django 3.2.25 on 2026-10-17 07:54
+
+from django.db import migrations, models
+import django.db.models.deletion
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0019_updated_at'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ReminderBatch',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('finished_at', models.DateTimeField(default=django.utils.timezone.now)),
+                ('seconds', models.FloatField()),
+                ('call_counts', models.JSONField(default=list)),
+                ('call_seconds', models.FloatField(default=0)),
+                ('rate_limited', models.PositiveIntegerField(default=0)),
+                ('menu', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='app.menu')),
+            ],
+        ),
+    ]
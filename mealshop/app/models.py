@@ -1,14 +1,16 @@
 import uuid
-from django.db import models
+from django.db import IntegrityError, models, transaction
 from django.contrib.auth.models import User
 from django.db.models.signals import post_save
 from django.dispatch import receiver
-from django.utils.timezone import now
+from django.utils.timezone import localdate, now
+from .db import atomic_write
 
 
 class MenuOption(models.Model):
     name = models.CharField(max_length=250)
     description = models.TextField()
+    updated_at = models.DateTimeField(auto_now=True)
 
     def __str__(self):
         return self.name
@@ -17,24 +19,144 @@ class MenuOption(models.Model):
 class MenuOptionCustomization(models.Model):
     name = models.CharField(max_length=250)
     menu_option = models.ForeignKey(MenuOption, on_delete=models.CASCADE)
+    updated_at = models.DateTimeField(auto_now=True)
 
     def __str__(self):
         return self.name
 
 
 class Menu(models.Model):
-    uuid = models.UUIDField(default=uuid.uuid4, editable=False)
+    uuid = models.UUIDField(default=uuid.uuid4, editable=False,
+                            db_index=True)
 
     user = models.ForeignKey(User, on_delete=models.CASCADE,
                              related_name='menu', null=True)
     menu_options = models.ManyToManyField(MenuOption)
-    pub_date = models.DateTimeField('date published', default=now)
+    pub_date = models.DateTimeField('date published', default=now,
+                                    db_index=True)
+    opens_at = models.DateTimeField(
+        null=True, blank=True, db_index=True,
+        help_text='Published and open to orders at this time, '
+                  'the start of the pub_date day if empty')
+    closes_at = models.DateTimeField(
+        null=True, blank=True,
+        help_text='Orders are taken until this time, '
+                  'ORDER_CUTOFF of the pub_date day if empty')
+    reminded_at = models.DateTimeField(null=True, blank=True, editable=False)
     slack_url = models.CharField(max_length=300)
+    # also touched when its menu options change, see app.menus
+    updated_at = models.DateTimeField(auto_now=True)
 
     def __str__(self):
         return str(self.pub_date)
 
 
+class OrderQuerySet(models.QuerySet):
+
+    def purchased_between(self, date_min, date_max):
+        return self.filter(purchased_date__gte=date_min,
+                           purchased_date__lte=date_max)
+
+    def kitchen_report(self, date_min, date_max):
+        """
+        Orders purchased between date_min and date_max with everything the
+        kitchen list renders already loaded: user and menu option are joined
+        and customizations are prefetched with their names, so the whole
+        report costs two queries no matter how many orders there are.
+
+        Parameters:
+        date_min (datetime): lower bound of purchased_date (inclusive)
+        date_max (datetime): upper bound of purchased_date (inclusive)
+
+        Returns:
+        QuerySet of Order
+        """
+        customizations = OrderCustomization.objects.select_related(
+            'menu_option_custom')
+        return (self
+                .purchased_between(date_min, date_max)
+                .select_related('user', 'menu_option')
+                .prefetch_related(models.Prefetch(
+                    'ordercustomization_set', queryset=customizations))
+                .order_by('purchased_date'))
+
+    def iter_export(self, chunk_size=2000):
+        """
+        Rows of the orders for exports, read with a server side cursor
+        chunk_size rows at a time. The customizations of each chunk are
+        fetched with one query, so memory stays flat whatever the amount
+        of orders.
+
+        Parameters:
+        chunk_size (int): orders read per chunk
+
+        Returns:
+        generator of dicts {id, purchased_date, username, menu_id,
+                            menu_option, customizations (list of names)}
+        """
+        rows = (self
+                .order_by('id')
+                .values('id', 'purchased_date', 'user__username', 'menu_id',
+                        'menu_option__name')
+                .iterator(chunk_size=chunk_size))
+        chunk = []
+        for row in rows:
+            chunk.append(row)
+            if len(chunk) == chunk_size:
+                yield from self._export_chunk(chunk)
+                chunk = []
+        if chunk:
+            yield from self._export_chunk(chunk)
+
+    def _export_chunk(self, chunk):
+        customizations = {}
+        for order_id, name in (OrderCustomization.objects
+                               .filter(order_id__in=[row['id']
+                                                     for row in chunk])
+                               .order_by('id')
+                               .values_list('order_id',
+                                            'menu_option_custom__name')):
+            customizations.setdefault(order_id, []).append(name)
+        for row in chunk:
+            yield {
+                'id': row['id'],
+                'purchased_date': row['purchased_date'],
+                'username': row['user__username'],
+                'menu_id': row['menu_id'],
+                'menu_option': row['menu_option__name'],
+                'customizations': customizations.get(row['id'], []),
+            }
+
+    def option_counts(self):
+        """
+        Number of orders per menu option, grouped by the database
+
+        Returns:
+        QuerySet of dicts with menu_option_id, menu_option__name and total
+        """
+        return (self
+                .values('menu_option_id', 'menu_option__name')
+                .annotate(total=models.Count('id'))
+                .order_by('-total', 'menu_option__name'))
+
+    def customization_counts(self):
+        """
+        Number of orders per menu option customization, grouped by the
+        database
+
+        Returns:
+        QuerySet of dicts with menu_option_custom_id,
+        menu_option_custom__name, menu_option_custom__menu_option_id and total
+        """
+        return (OrderCustomization.objects
+                .filter(order__in=self.values('id'))
+                .values('menu_option_custom_id',
+                        'menu_option_custom__name',
+                        'menu_option_custom__menu_option_id')
+                .annotate(total=models.Count('id'))
+                .order_by('-total', 'menu_option_custom__name'))
+
+
 class Order(models.Model):
     user = models.ForeignKey(User, on_delete=models.CASCADE,
                              related_name='order', null=True)
@@ -42,12 +164,51 @@ class Order(models.Model):
         MenuOption, on_delete=models.CASCADE, default=None)
     menu = models.ForeignKey(Menu, on_delete=models.CASCADE, null=False)
     purchased_date = models.DateTimeField(
-        'purchased date', default=now)
+        'purchased date', default=now, db_index=True)
+
+    objects = OrderQuerySet.as_manager()
+
+    class Meta:
+        unique_together = [['user', 'menu']]
 
     def __str__(self):
         return 'user {} option {} on date {}'.format(
             self.user, self.menu_option, self.purchased_date)
 
+    def set_customizations(self, customization_ids):
+        """
+        Replaces the customizations of the order with customization_ids,
+        ids not belonging to the menu option of the order are ignored.
+        Only the difference with the current customizations is written,
+        with one DELETE and one bulk INSERT inside a transaction.
+
+        Parameters:
+        customization_ids (iterable of int): MenuOptionCustomization ids
+        """
+        with atomic_write():
+            chosen = set(MenuOptionCustomization.objects
+                         .filter(menu_option_id=self.menu_option_id,
+                                 id__in=customization_ids)
+                         .values_list('id', flat=True))
+            customizations = self.ordercustomization_set
+            current = set(customizations
+                          .values_list('menu_option_custom_id', flat=True))
+            removed = current - chosen
+            added = chosen - current
+            if removed:
+                customizations.filter(
+                    menu_option_custom_id__in=removed).delete()
+            if added:
+                OrderCustomization.objects.bulk_create(
+                    [OrderCustomization(order=self,
+                                        menu_option_custom_id=custom_id)
+                     for custom_id in added])
+                # bulk_create does not send post_save
+                from .rollups import record_rollups
+                day = localdate(self.purchased_date)
+                record_rollups(customizations={
+                    (day, custom_id): 1 for custom_id in added})
+
 
 class OrderCustomization(models.Model):
     order = models.ForeignKey(Order, on_delete=models.CASCADE)
@@ -59,11 +220,174 @@ class OrderCustomization(models.Model):
             self.order, self.menu_option_custom)
 
 
+class RollupQuerySet(models.QuerySet):
+
+    def between(self, day_min, day_max):
+        return self.filter(day__gte=day_min, day__lte=day_max)
+
+    def add(self, deltas):
+        """
+        Adds the deltas to the orders of each row with one UPDATE, rows
+        missing are inserted in bulk when the delta is positive
+
+        Parameters:
+        deltas (dict): {(day, id of the rolled up model): delta}
+        """
+        deltas = {key: delta for key, delta in deltas.items() if delta}
+        if not deltas:
+            return
+        field = self.model.ROLLUP_FIELD + '_id'
+        existing = {
+            (day, related_id): pk
+            for pk, day, related_id in self.filter(**{
+                'day__in': {day for day, _ in deltas},
+                field + '__in': {related_id for _, related_id in deltas},
+            }).values_list('pk', 'day', field)}
+
+        changed = {pk: deltas[key] for key, pk in existing.items()
+                   if key in deltas}
+        if changed:
+            self.filter(pk__in=changed).update(orders=models.F('orders') + (
+                models.Case(*[models.When(pk=pk, then=models.Value(delta))
+                              for pk, delta in changed.items()],
+                            default=models.Value(0))))
+
+        missing = {key: delta for key, delta in deltas.items()
+                   if key not in existing and delta > 0}
+        if missing:
+            try:
+                with transaction.atomic():
+                    self.bulk_create([
+                        self.model(day=day, orders=delta,
+                                   **{field: related_id})
+                        for (day, related_id), delta in missing.items()])
+            except IntegrityError:
+                # inserted by a concurrent transaction, now they exist
+                self.add(missing)
+
+    def top(self, day_min, day_max, limit=10):
+        """
+        Most ordered between day_min and day_max, one query on the
+        (day, rolled up model) index
+
+        Parameters:
+        day_min (date): first day (inclusive)
+        day_max (date): last day (inclusive)
+        limit (int): amount of rows
+
+        Returns:
+        list of dicts with the id, name and total of orders
+        """
+        field = self.model.ROLLUP_FIELD
+        return [{'id': row[field], 'name': row[field + '__name'],
+                 'total': row['total']}
+                for row in (self
+                            .between(day_min, day_max)
+                            .values(field, field + '__name')
+                            .annotate(total=models.Sum('orders'))
+                            .filter(total__gt=0)
+                            .order_by('-total', field + '__name')[:limit])]
+
+
+class DailyOptionRollup(models.Model):
+    """
+    Orders of a menu option in a day, kept up to date by the order signals
+    in app.rollups and rebuilt with `manage.py backfill_rollups`
+    """
+    ROLLUP_FIELD = 'menu_option'
+
+    day = models.DateField()
+    menu_option = models.ForeignKey(MenuOption, on_delete=models.CASCADE)
+    orders = models.IntegerField(default=0)
+
+    objects = RollupQuerySet.as_manager()
+
+    class Meta:
+        unique_together = [['day', 'menu_option']]
+
+    def __str__(self):
+        return '{} {}x {}'.format(self.day, self.orders, self.menu_option)
+
+
+class DailyCustomizationRollup(models.Model):
+    """
+    Orders of a menu option customization in a day, see DailyOptionRollup
+    """
+    ROLLUP_FIELD = 'menu_option_custom'
+
+    day = models.DateField()
+    menu_option_custom = models.ForeignKey(MenuOptionCustomization,
+                                           on_delete=models.CASCADE)
+    orders = models.IntegerField(default=0)
+
+    objects = RollupQuerySet.as_manager()
+
+    class Meta:
+        unique_together = [['day', 'menu_option_custom']]
+
+    def __str__(self):
+        return '{} {}x {}'.format(self.day, self.orders,
+                                  self.menu_option_custom)
+
+
 class Profile(models.Model):
     user = models.OneToOneField(User, on_delete=models.CASCADE)
     slack_user = models.CharField(max_length=100, blank=True)
 
 
+class Reminder(models.Model):
+    """
+    Delivery of a menu slack reminder to one employee, processed by
+    `manage.py reminder_worker`. A reminder being sent is leased until
+    next_attempt_at, so if the worker dies it is claimed again.
+    """
+    PENDING = 'pending'
+    SENDING = 'sending'
+    SENT = 'sent'
+    FAILED = 'failed'
+    STATUS_CHOICES = [
+        (PENDING, 'Pending'),
+        (SENDING, 'Sending'),
+        (SENT, 'Sent'),
+        (FAILED, 'Failed'),
+    ]
+
+    menu = models.ForeignKey(Menu, on_delete=models.CASCADE)
+    profile = models.ForeignKey(Profile, on_delete=models.CASCADE)
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES,
+                              default=PENDING)
+    attempts = models.PositiveIntegerField(default=0)
+    next_attempt_at = models.DateTimeField(default=now)
+    sent_at = models.DateTimeField(null=True, blank=True)
+    last_error = models.TextField(blank=True)
+
+    class Meta:
+        unique_together = [['menu', 'profile']]
+        indexes = [models.Index(fields=['status', 'next_attempt_at'])]
+
+    def __str__(self):
+        return 'reminder {} to {} {}'.format(
+            self.menu, self.profile.slack_user, self.status)
+
+
+class ReminderBatch(models.Model):
+    """
+    Timings of the reminders of a menu sent in one batch by the reminder
+    worker, stored so the metrics of every process include them.
+    call_counts holds Histogram.counts of the reminders.add calls, with the
+    buckets of ReminderMetrics.HISTOGRAMS['call_seconds'].
+    """
+    menu = models.ForeignKey(Menu, on_delete=models.CASCADE)
+    finished_at = models.DateTimeField(default=now)
+    seconds = models.FloatField()
+    call_counts = models.JSONField(default=list)
+    call_seconds = models.FloatField(default=0)
+    rate_limited = models.PositiveIntegerField(default=0)
+
+    def __str__(self):
+        return 'reminder batch {} of {}s'.format(self.menu, self.seconds)
+
+
 @receiver(post_save, sender=User)
 def create_user_profile(sender, instance, created, **kwargs):
     if created:
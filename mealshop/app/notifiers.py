@@ -0,0 +1,204 @@
+import sys
+import threading
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.core.signals import setting_changed
+from django.dispatch import receiver
+from django.utils.module_loading import import_string
+
+
+_notifier = None
+_notifier_lock = threading.Lock()
+
+
+class NotifierError(Exception):
+    """
+    A reminder could not be delivered
+
+    Parameters:
+    error (str): error code given by the backend
+    """
+
+    def __init__(self, error):
+        super().__init__(error)
+        self.error = error
+
+
+class RateLimited(NotifierError):
+    """
+    The backend asks to wait retry_after seconds before calling again
+    """
+
+    def __init__(self, retry_after):
+        super().__init__('ratelimited')
+        self.retry_after = retry_after
+
+
+def get_notifier():
+    """
+    Backend delivering the reminders, settings.REMINDER_NOTIFIER, built on
+    first use so importing the app does not load or configure slack
+
+    Returns:
+    BaseNotifier
+    """
+    global _notifier
+    with _notifier_lock:
+        if _notifier is None:
+            _notifier = import_string(settings.REMINDER_NOTIFIER)()
+        return _notifier
+
+
+def reset_notifier():
+    """
+    Drops the notifier, the next get_notifier() builds a new one
+    """
+    global _notifier
+    with _notifier_lock:
+        _notifier = None
+
+
+@receiver(setting_changed)
+def notifier_setting_changed(setting, **kwargs):
+    if setting in ('REMINDER_NOTIFIER', 'SLACK_TOKEN', 'SLACK_API_URL'):
+        reset_notifier()
+
+
+class BaseNotifier:
+    """
+    A notifier sets reminders for employees. add_reminder returns a truthy
+    value when delivered and raises NotifierError (RateLimited on 429)
+    otherwise. async_sender() returns an async context manager whose
+    add_reminder is a coroutine, by default it calls add_reminder.
+    """
+
+    def add_reminder(self, json_data):
+        raise NotImplementedError
+
+    def async_sender(self):
+        return _SyncAsyncSender(self)
+
+
+class _SyncAsyncSender:
+
+    def __init__(self, notifier):
+        self.notifier = notifier
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        return None
+
+    async def add_reminder(self, json_data):
+        return self.notifier.add_reminder(json_data)
+
+
+class SlackNotifier(BaseNotifier):
+    """
+    Calls slack reminders.add with settings.SLACK_TOKEN, the slack client
+    is imported and created on the first reminder
+    """
+
+    def __init__(self, token=None, base_url=None):
+        self.token = token or settings.SLACK_TOKEN
+        self.base_url = base_url or settings.SLACK_API_URL
+        if not self.token:
+            raise ImproperlyConfigured('SLACK_TOKEN is required to send '
+                                       'reminders with slack')
+        self._client = None
+
+    def add_reminder(self, json_data):
+        from slack import WebClient
+        from slack.errors import SlackApiError
+
+        if self._client is None:
+            self._client = WebClient(token=self.token,
+                                     base_url=self.base_url)
+        try:
+            return self._client.api_call(api_method='reminders.add',
+                                         json=json_data)
+        except SlackApiError as e:
+            raise _translate_slack_error(e)
+
+    def async_sender(self):
+        return _SlackAsyncSender(self.token, self.base_url)
+
+
+class _SlackAsyncSender:
+    """
+    AsyncWebClient sharing one aiohttp session for a batch of reminders
+    """
+
+    def __init__(self, token, base_url):
+        self.token = token
+        self.base_url = base_url
+
+    async def __aenter__(self):
+        import aiohttp
+        from slack import AsyncWebClient
+
+        self.session = aiohttp.ClientSession()
+        self.client = AsyncWebClient(token=self.token,
+                                     base_url=self.base_url,
+                                     session=self.session)
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.session.close()
+
+    async def add_reminder(self, json_data):
+        from slack.errors import SlackApiError
+
+        try:
+            return await self.client.api_call(api_method='reminders.add',
+                                              json=json_data)
+        except SlackApiError as e:
+            raise _translate_slack_error(e)
+
+
+def _translate_slack_error(e):
+    response = e.response
+    if getattr(response, 'status_code', None) == 429:
+        headers = getattr(response, 'headers', None) or {}
+        try:
+            return RateLimited(int(headers.get('Retry-After', 1)))
+        except (TypeError, ValueError):
+            return RateLimited(1)
+    return NotifierError(response['error'])
+
+
+class ConsoleNotifier(BaseNotifier):
+    """
+    Writes the reminders to stdout instead of sending them
+    """
+
+    def __init__(self, stream=None):
+        self.stream = stream or sys.stdout
+        self._lock = threading.Lock()
+
+    def add_reminder(self, json_data):
+        with self._lock:
+            self.stream.write('Reminder for {user} at {time}: {text}\n'
+                              .format(**json_data))
+            self.stream.flush()
+        return {'ok': True}
+
+
+class InMemoryNotifier(BaseNotifier):
+    """
+    Keeps the reminders in self.sent, for tests. Exceptions put in
+    self.errors are raised, one per call, before reminders are accepted.
+    """
+
+    def __init__(self):
+        self.sent = []
+        self.errors = []
+        self._lock = threading.Lock()
+
+    def add_reminder(self, json_data):
+        with self._lock:
+            if self.errors:
+                raise self.errors.pop(0)
+            self.sent.append(json_data)
+        return {'ok': True}
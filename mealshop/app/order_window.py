@@ -0,0 +1,82 @@
+import datetime
+from collections import namedtuple
+from functools import lru_cache
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.utils.dateparse import parse_time
+from django.utils.timezone import (
+    get_current_timezone, localdate, make_aware, now
+)
+
+
+class OrderWindow(namedtuple('OrderWindow', ['day', 'opens', 'closes',
+                                             'ends'])):
+    """
+    Boundaries of a day of orders, all of them aware datetimes: the day
+    opens at midnight, orders are taken until closes (the cutoff) and the
+    day ends one microsecond before the next midnight
+    """
+    __slots__ = ()
+
+    def is_open(self, when=None):
+        """
+        Whether orders are taken at when, by default now
+        """
+        when = now() if when is None else when
+        return self.opens <= when <= self.closes
+
+
+def get_order_window(day=None, cutoff=None):
+    """
+    Order window of a day in the current timezone, windows are computed
+    once per day, timezone and cutoff and then kept in memory
+
+    Parameters:
+    day (date): day of the window, today by default
+    cutoff (time): last time orders are taken, ORDER_CUTOFF by default
+
+    Returns:
+    OrderWindow
+    """
+    return _build_window(localdate() if day is None else day,
+                         get_current_timezone(),
+                         get_site_cutoff() if cutoff is None else cutoff)
+
+
+def menu_order_window(menu):
+    """
+    Order window of the day a menu was published, opening and closing at
+    the opens_at and closes_at of the menu when it has them
+    """
+    window = get_order_window(localdate(menu.pub_date))
+    return window._replace(opens=menu.opens_at or window.opens,
+                           closes=menu.closes_at or window.closes)
+
+
+def get_site_cutoff():
+    """
+    ORDER_CUTOFF setting as a time
+    """
+    return _parse_cutoff(settings.ORDER_CUTOFF)
+
+
+@lru_cache(maxsize=None)
+def _parse_cutoff(value):
+    cutoff = parse_time(value) if isinstance(value, str) else value
+    if not isinstance(cutoff, datetime.time):
+        raise ImproperlyConfigured(
+            'ORDER_CUTOFF has to be a time as HH:MM, got {!r}'.format(value))
+    return cutoff
+
+
+@lru_cache(maxsize=128)
+def _build_window(day, tz, cutoff):
+    # make_aware localizes with the offset of that day instead of the LMT
+    # offset a pytz timezone given as tzinfo has, is_dst resolves midnights
+    # skipped or repeated by daylight saving changes
+    def aware(time):
+        return make_aware(datetime.datetime.combine(day, time), tz,
+                          is_dst=False)
+
+    return OrderWindow(day=day, opens=aware(datetime.time()),
+                       closes=aware(cutoff), ends=aware(datetime.time.max))
@@ -0,0 +1,218 @@
+"""
+Daily rollups of the orders of each menu option and customization, kept up
+to date by the signals of Order and OrderCustomization.
+
+Changes that do not send them are not rolled up: queryset update(),
+bulk_create() and raw SQL. Order.set_customizations records its bulk
+insert itself, anything else writing orders in bulk has to call
+record_rollups or rebuild_rollups (`manage.py backfill_rollups`) for the
+days it changed. Deltas recorded inside a savepoint that rolls back are
+still written when the transaction had recorded others before it.
+"""
+import weakref
+import datetime
+import threading
+from collections import Counter
+from django.db import transaction
+from django.db.models import Count
+from django.db.models.functions import TruncDate
+from django.db.models.signals import post_init, post_save, post_delete
+from django.dispatch import receiver
+from django.utils.timezone import get_current_timezone, localdate
+from .models import (
+    Order, OrderCustomization, DailyOptionRollup, DailyCustomizationRollup
+)
+
+
+def rebuild_rollups(day_min, day_max, batch_size=1000):
+    """
+    Recomputes the daily rollups between day_min and day_max from the
+    orders, used to backfill history and data inserted in bulk
+
+    Parameters:
+    day_min (date): first day (inclusive)
+    day_max (date): last day (inclusive)
+
+    Returns:
+    tuple(int, int) rows of menu options and of customizations written
+    """
+    tz = get_current_timezone()
+    orders = Order.objects.purchased_between(
+        tz.localize(datetime.datetime.combine(day_min, datetime.time())),
+        tz.localize(datetime.datetime.combine(day_max, datetime.time.max)))
+    options = [
+        DailyOptionRollup(day=row['day'],
+                          menu_option_id=row['menu_option_id'],
+                          orders=row['total'])
+        for row in (orders
+                    .annotate(day=TruncDate('purchased_date'))
+                    .values('day', 'menu_option_id')
+                    .annotate(total=Count('id'))
+                    .order_by())]
+    customizations = [
+        DailyCustomizationRollup(
+            day=row['day'],
+            menu_option_custom_id=row['menu_option_custom_id'],
+            orders=row['total'])
+        for row in (OrderCustomization.objects
+                    .filter(order__in=orders.values('id'))
+                    .annotate(day=TruncDate('order__purchased_date'))
+                    .values('day', 'menu_option_custom_id')
+                    .annotate(total=Count('id'))
+                    .order_by())]
+
+    with transaction.atomic():
+        DailyOptionRollup.objects.between(day_min, day_max).delete()
+        DailyCustomizationRollup.objects.between(day_min, day_max).delete()
+        DailyOptionRollup.objects.bulk_create(options,
+                                              batch_size=batch_size)
+        DailyCustomizationRollup.objects.bulk_create(customizations,
+                                                     batch_size=batch_size)
+    return len(options), len(customizations)
+
+
+def record_rollups(options=None, customizations=None):
+    """
+    Adds deltas to the daily rollups. Inside a transaction they are summed
+    up and written with one batch when it commits, so the queries do not
+    grow with the orders and customizations changed and nothing is counted
+    when it rolls back.
+
+    Parameters:
+    options (dict): {(day, menu option id): delta}
+    customizations (dict): {(day, menu option customization id): delta}
+    """
+    batch = _get_batch()
+    batch.options.update(options or {})
+    batch.customizations.update(customizations or {})
+    _write_outside_transaction(batch)
+
+
+# Batch of the transaction running on each connection of the thread. Only
+# the on_commit hooks of the connection hold it, so it is dropped with them
+# when the transaction or the savepoint it was created in rolls back.
+_batches = threading.local()
+
+
+def _get_batch():
+    connection = transaction.get_connection()
+    if not connection.in_atomic_block:
+        return _RollupBatch()
+    if not hasattr(_batches, 'by_alias'):
+        _batches.by_alias = weakref.WeakValueDictionary()
+    batch = _batches.by_alias.get(connection.alias)
+    if batch is None or batch.written:
+        batch = _batches.by_alias[connection.alias] = _RollupBatch()
+        transaction.on_commit(batch)
+    return batch
+
+
+def _write_outside_transaction(batch):
+    if not transaction.get_connection().in_atomic_block:
+        batch()
+
+
+class _RollupBatch:
+
+    def __init__(self):
+        self.options = Counter()
+        self.customizations = Counter()
+        # {(order id, menu option customization id): delta} of order
+        # customizations deleted without their order loaded, the day of
+        # each order is read once when the batch is written
+        self.order_customizations = Counter()
+        # day of the orders deleted in the transaction
+        self.order_days = {}
+        self.written = False
+
+    def __call__(self):
+        self.written = True
+        if self.order_customizations:
+            missing = ({order_id for order_id, _ in self.order_customizations}
+                       - set(self.order_days))
+            self.order_days.update(
+                (order_id, localdate(purchased_date))
+                for order_id, purchased_date in Order.objects
+                .filter(id__in=missing).values_list('id', 'purchased_date'))
+            for (order_id, custom_id), delta in \
+                    self.order_customizations.items():
+                if order_id in self.order_days:
+                    self.customizations[
+                        (self.order_days[order_id], custom_id)] += delta
+        DailyOptionRollup.objects.add(self.options)
+        DailyCustomizationRollup.objects.add(self.customizations)
+
+
+# Rows loaded from the database remember the values they were rolled up
+# with, so an update moves the counts without reading the old row again.
+# Only values already loaded are read, deferred fields are not fetched.
+
+@receiver(post_init, sender=Order)
+def remember_order(sender, instance, **kwargs):
+    instance._rollup = (instance.__dict__.get('purchased_date'),
+                        instance.__dict__.get('menu_option_id'))
+
+
+@receiver(post_init, sender=OrderCustomization)
+def remember_order_customization(sender, instance, **kwargs):
+    instance._rollup = instance.__dict__.get('menu_option_custom_id')
+
+
+@receiver(post_save, sender=Order)
+def rollup_saved_order(sender, instance, created, raw, **kwargs):
+    if raw:
+        return
+    purchased_date, menu_option_id = instance._rollup
+    day = localdate(instance.purchased_date)
+    options = Counter({(day, instance.menu_option_id): 1})
+    customizations = Counter()
+    if not created and purchased_date is not None:
+        old_day = localdate(purchased_date)
+        options[(old_day, menu_option_id)] -= 1
+        if old_day != day:
+            for custom_id in (instance.ordercustomization_set
+                              .values_list('menu_option_custom_id',
+                                           flat=True)):
+                customizations[(old_day, custom_id)] -= 1
+                customizations[(day, custom_id)] += 1
+    elif not created:
+        options.clear()
+    record_rollups(options, customizations)
+    instance._rollup = (instance.purchased_date, instance.menu_option_id)
+
+
+@receiver(post_delete, sender=Order)
+def rollup_deleted_order(sender, instance, **kwargs):
+    day = localdate(instance.purchased_date)
+    batch = _get_batch()
+    batch.options[(day, instance.menu_option_id)] -= 1
+    batch.order_days[instance.pk] = day
+    _write_outside_transaction(batch)
+
+
+@receiver(post_save, sender=OrderCustomization)
+def rollup_saved_order_customization(sender, instance, created, raw,
+                                     **kwargs):
+    if raw or (not created and
+               instance._rollup == instance.menu_option_custom_id):
+        return
+    day = localdate(instance.order.purchased_date)
+    customizations = Counter({(day, instance.menu_option_custom_id): 1})
+    if not created and instance._rollup is not None:
+        customizations[(day, instance._rollup)] -= 1
+    record_rollups(customizations=customizations)
+    instance._rollup = instance.menu_option_custom_id
+
+
+@receiver(post_delete, sender=OrderCustomization)
+def rollup_deleted_order_customization(sender, instance, **kwargs):
+    # customizations deleted in cascade, with a user or a menu option, do
+    # not have their order loaded, reading it here would be a query each
+    batch = _get_batch()
+    if OrderCustomization.order.is_cached(instance):
+        batch.customizations[(localdate(instance.order.purchased_date),
+                              instance.menu_option_custom_id)] -= 1
+    else:
+        batch.order_customizations[(instance.order_id,
+                                    instance.menu_option_custom_id)] -= 1
+    _write_outside_transaction(batch)
@@ -0,0 +1,76 @@
+from django.conf import settings
+from django.db.models import Min, Q
+from django.utils.timezone import localdate, now, timedelta
+from .menus import warm_today_menu
+from .models import Menu
+from .order_window import get_order_window, menu_order_window
+from .services import enqueue_reminders
+
+
+def run_schedule(when=None):
+    """
+    One pass of the menu schedule, run by `manage.py menu_scheduler` in a
+    loop or from cron. With a SHARED_CACHE, the menus of the days with a
+    menu opening within MENU_WARM_LEAD seconds, and of tomorrow close to
+    midnight, are loaded into the cache. A cache per process is not warmed:
+    the scheduler runs in its own process, so each web worker loads the
+    menus on its first miss instead. Scheduled menus that opened get their
+    slack reminders queued once, while their orders are taken.
+
+    Parameters:
+    when (datetime): time of the pass, now by default
+
+    Returns:
+    tuple(list of date warmed, list of Menu reminded)
+    """
+    when = now() if when is None else when
+    until = when + timedelta(seconds=settings.MENU_WARM_LEAD)
+    days = set()
+    if settings.SHARED_CACHE:
+        days = {localdate(opens_at) for opens_at in (Menu.objects
+                .filter(opens_at__gt=when, opens_at__lte=until)
+                .values_list('opens_at', flat=True))}
+        if localdate(until) != localdate(when):
+            days.add(localdate(until))
+    for day in sorted(days):
+        warm_today_menu(day)
+
+    # menus taking orders now: closing later, or without a closes_at
+    # published today and closing at the site cutoff
+    today = get_order_window(localdate(when))
+    reminded = []
+    for menu in (Menu.objects
+                 .filter(opens_at__lte=when, reminded_at__isnull=True)
+                 .filter(Q(closes_at__gt=when) |
+                         Q(closes_at__isnull=True,
+                           pub_date__gte=today.opens,
+                           pub_date__lte=today.ends))):
+        if not menu_order_window(menu).is_open(when):
+            continue
+        # claimed with a conditional update, so concurrent schedulers
+        # queue the reminders of a menu only once
+        if Menu.objects.filter(pk=menu.pk, reminded_at__isnull=True)\
+                .update(reminded_at=when):
+            enqueue_reminders(menu)
+            reminded.append(menu)
+    return sorted(days), reminded
+
+
+def seconds_until_next_run(max_seconds, when=None):
+    """
+    Seconds to wait until a menu has to be warmed or opens, at most
+    max_seconds
+
+    Parameters:
+    max_seconds (float): longest wait
+    when (datetime): time the wait starts, now by default
+    """
+    when = now() if when is None else when
+    lead = timedelta(seconds=settings.MENU_WARM_LEAD)
+    next_opening = Menu.objects.filter(opens_at__gt=when).aggregate(
+        next=Min('opens_at'))['next']
+    if next_opening is None:
+        return max_seconds
+    next_run = next_opening - lead if next_opening - lead > when \
+        else next_opening
+    return max(min((next_run - when).total_seconds(), max_seconds), 0)
@@ -1,54 +1,248 @@
 import re
-import os
+import time
+import asyncio
 import logging
+import threading
 import concurrent.futures
 import datetime
-from slack import WebClient
-from slack.errors import SlackApiError
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db.models import F
 from django.utils.timezone import now, timedelta
-from markdown_strings import header, code_block
-from .models import Profile
+from .db import atomic_write
+from .models import Profile, Reminder
+from .metrics import reminder_metrics
+from .notifiers import get_notifier, NotifierError, RateLimited
 
 
 logger = logging.getLogger(__name__)
-client = WebClient(token=os.environ['SLACK_TOKEN'])
+
+_executor = None
+_executor_lock = threading.Lock()
+_rate_limited_until = 0
+_rate_limit_lock = threading.Lock()
+
+
+def _get_executor():
+    """
+    Process wide pool shared by every reminder, its size is the amount of
+    concurrent calls made to slack (settings.SLACK_REMINDER_WORKERS)
+    """
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = concurrent.futures.ThreadPoolExecutor(
+                max_workers=settings.SLACK_REMINDER_WORKERS,
+                thread_name_prefix='slack-reminder')
+        return _executor
+
+
+def _call_reminders_add(json_data, menu_id=None):
+    """
+    Sets the reminder with the notifier, when it is rate limited every
+    worker waits for retry_after before calling again, up to
+    settings.SLACK_REMINDER_MAX_RETRIES times.
+    Latency and rate limits are recorded for menu_id.
+
+    Raises:
+    NotifierError when the reminder keeps failing
+    """
+    notifier = get_notifier()
+    for attempt in range(settings.SLACK_REMINDER_MAX_RETRIES + 1):
+        _wait_rate_limit()
+        start = time.perf_counter()
+        try:
+            response = notifier.add_reminder(json_data)
+            logger.debug(response)
+            return response
+        except RateLimited as e:
+            reminder_metrics.inc('rate_limited', menu_id)
+            if attempt == settings.SLACK_REMINDER_MAX_RETRIES:
+                raise
+            logger.warning(f"Rate limited, retrying in {e.retry_after}s")
+            _set_rate_limit(e.retry_after)
+        finally:
+            reminder_metrics.observe('call_seconds', menu_id,
+                                     time.perf_counter() - start)
+
+
+def enqueue_reminders(menu):
+    """
+    Stores a pending Reminder of menu for every employee with a slack user,
+    they are sent by `manage.py reminder_worker`. Reminders already queued
+    for the menu are not duplicated.
+
+    Paramters:
+    menu (Menu): Menu to remind
+    """
+    profiles = Profile.objects.exclude(slack_user__exact='')
+    Reminder.objects.bulk_create(
+        [Reminder(menu=menu, profile_id=profile_id)
+         for profile_id in profiles.values_list('id', flat=True)],
+        ignore_conflicts=True)
 
 
 def create_reminder_async(menu):
     """
-    Creates a ThreadPool to call a call _send_reminder in a different thread
-    which makes this funciong non blocking
+    Queues a slack reminder of menu for every employee, which makes this
+    function non blocking. They are sent by `manage.py reminder_worker`,
+    see enqueue_reminders.
 
     Paramters:
-    menu (Menu): Menu send to _send_reminder function
+    menu (Menu): Menu to remind
+    """
+    enqueue_reminders(menu)
+
+
+def process_reminders(batch_size=100):
+    """
+    Claims a batch of due reminders, sends them concurrently on the shared
+    reminder pool and records the outcome. Failed reminders are retried
+    with exponential backoff until settings.SLACK_REMINDER_MAX_ATTEMPTS.
+
+    Parameters:
+    batch_size (int): maximum amount of reminders claimed
+
+    Returns:
+    int amount of reminders claimed
     """
-    THREAD_POOL = concurrent.futures.ThreadPoolExecutor(max_workers=5)
-    future = THREAD_POOL.submit(_send_reminder, menu)
+    reminders = _claim_reminders(batch_size)
+    executor = _get_executor()
+    start = time.perf_counter()
+    futures = {}
+    for reminder in reminders:
+        futures[executor.submit(_call_reminders_add, {
+            'time': _get_time_in_epoch(),
+            'text': _format_menu_message(reminder.menu),
+            'user': reminder.profile.slack_user
+        }, reminder.menu_id)] = reminder
 
+    sent, errors = [], {}
+    for future in concurrent.futures.as_completed(futures):
+        reminder = futures[future]
+        try:
+            future.result()
+            sent.append(reminder.id)
+        except Exception as e:
+            logger.error('Reminder {} failed: {}'.format(reminder.id, e))
+            errors.setdefault((reminder.attempts, str(e)),
+                              []).append(reminder.id)
+    for menu_id in {reminder.menu_id for reminder in reminders}:
+        reminder_metrics.save_batch(menu_id, time.perf_counter() - start)
 
-def _send_reminder(menu):
+    Reminder.objects.filter(id__in=sent).update(
+        status=Reminder.SENT, sent_at=now(), last_error='')
+    # one update per attempt count and error, reminders failing alike
+    # share it
+    for (attempts, error), ids in errors.items():
+        if attempts >= settings.SLACK_REMINDER_MAX_ATTEMPTS:
+            Reminder.objects.filter(id__in=ids).update(
+                status=Reminder.FAILED, last_error=error)
+            continue
+        backoff = settings.SLACK_REMINDER_BACKOFF * 2 ** (attempts - 1)
+        Reminder.objects.filter(id__in=ids).update(
+            status=Reminder.PENDING, last_error=error,
+            next_attempt_at=now() + timedelta(seconds=backoff))
+
+    return len(reminders)
+
+
+def _claim_reminders(batch_size):
+    """
+    Due reminders are pending ones and those whose sending lease expired,
+    claiming them leases them for settings.SLACK_REMINDER_LEASE seconds.
+    """
+    with atomic_write():
+        ids = list(Reminder.objects
+                   .select_for_update(skip_locked=True)
+                   .filter(status__in=[Reminder.PENDING, Reminder.SENDING],
+                           next_attempt_at__lte=now())
+                   .order_by('next_attempt_at')
+                   .values_list('id', flat=True)[:batch_size])
+        Reminder.objects.filter(id__in=ids).update(
+            status=Reminder.SENDING, attempts=F('attempts') + 1,
+            next_attempt_at=now() + timedelta(
+                seconds=settings.SLACK_REMINDER_LEASE))
+
+    return list(Reminder.objects.filter(id__in=ids)
+                .select_related('menu', 'profile'))
+
+
+async def send_reminders(menu, notifier=None):
+    """
+    Sends the reminders of menu right away, without the queue: every
+    reminder is sent concurrently
+    through the notifier async sender (one aiohttp session for slack), at
+    most settings.SLACK_REMINDER_WORKERS at a time.
+    Can be awaited from an async view or run with async_to_sync. No
+    Reminder is stored, so they are not part of the reminder metrics.
+
+    Parameters:
+    menu (Menu): Menu to remind
+    notifier (BaseNotifier): optional, settings.REMINDER_NOTIFIER by default
+
+    Returns:
+    int amount of reminders sent
+    """
     logger.info('Sending reminder to {}'.format(menu))
     message = _format_menu_message(menu)
-    profiles = Profile.objects.exclude(slack_user__exact='')
+    slack_users = await sync_to_async(_get_slack_users)()
+    return await _send_reminders_with_slack_async(
+        notifier or get_notifier(), message, slack_users)
+
+
+async def _send_reminders_with_slack_async(notifier, message, slack_users):
+    semaphore = asyncio.Semaphore(settings.SLACK_REMINDER_WORKERS)
+
+    async with notifier.async_sender() as sender:
+        async def send(slack_user):
+            async with semaphore:
+                return await _send_reminder_with_slack_async(sender, {
+                    'time': _get_time_in_epoch(), 'text': message,
+                    'user': slack_user
+                })
+
+        responses = await asyncio.gather(*[send(user)
+                                           for user in slack_users])
+    return len([response for response in responses if response])
+
+
+async def _send_reminder_with_slack_async(sender, json_data):
+    for attempt in range(settings.SLACK_REMINDER_MAX_RETRIES + 1):
+        delay = _rate_limited_until - time.monotonic()
+        if delay > 0:
+            await asyncio.sleep(delay)
+        try:
+            response = await sender.add_reminder(json_data)
+            logger.debug(response)
+            return response
+        except RateLimited as e:
+            if attempt == settings.SLACK_REMINDER_MAX_RETRIES:
+                logger.error(f"Got an error: {e.error}")
+                return None
+            logger.warning(f"Rate limited, retrying in {e.retry_after}s")
+            _set_rate_limit(e.retry_after)
+        except NotifierError as e:
+            logger.error(f"Got an error: {e.error}")
+            return None
+
+
+def _get_slack_users():
+    return list(Profile.objects.exclude(slack_user__exact='')
+                .values_list('slack_user', flat=True))
+
 
-    for profile in profiles:
-        time = _get_time_in_epoch()
-        logger.info('Timestamp reminder'.format(time))
-        _send_reminder_all_employees_with_slack({
-            'time': time, 'text': message, 'user': profile.slack_user
-        })
+def _set_rate_limit(seconds):
+    global _rate_limited_until
+    with _rate_limit_lock:
+        _rate_limited_until = max(_rate_limited_until,
+                                  time.monotonic() + seconds)
 
 
-def _send_reminder_all_employees_with_slack(json_data):
-    try:
-        response = client.api_call(
-            api_method='reminders.add',
-            json=json_data
-        )
-        logger.debug(response)
-    except SlackApiError as e:
-        assert e.response["error"]
-        logger.error(f"Got an error: {e.response['error']}")
+def _wait_rate_limit():
+    delay = _rate_limited_until - time.monotonic()
+    if delay > 0:
+        time.sleep(delay)
 
 
 def _get_time_in_epoch():
@@ -59,5 +253,5 @@ def _get_time_in_epoch():
 
 
 def _format_menu_message(menu):
-    message = '{}/menu/{}'.format(os.environ['HOSTNAME'], menu.uuid)
+    message = '{}/menu/{}'.format(settings.HOSTNAME, menu.uuid)
     return message
@@ -0,0 +1,40 @@
+import time
+import contextvars
+from django.template.backends.django import DjangoTemplates
+
+
+# list with the seconds spent rendering templates in the current request,
+# set by app.middleware.RequestMetricsMiddleware
+render_time = contextvars.ContextVar('render_time', default=None)
+
+
+class InstrumentedDjangoTemplates(DjangoTemplates):
+    """
+    Django template backend that adds the time spent rendering to
+    render_time, templates included or extended are rendered inside the
+    outer one so they are not counted twice
+    """
+
+    def from_string(self, template_code):
+        return TimedTemplate(super().from_string(template_code))
+
+    def get_template(self, template_name):
+        return TimedTemplate(super().get_template(template_name))
+
+
+class TimedTemplate:
+
+    def __init__(self, template):
+        self.template = template
+
+    def __getattr__(self, name):
+        return getattr(self.template, name)
+
+    def render(self, context=None, request=None):
+        start = time.perf_counter()
+        try:
+            return self.template.render(context, request)
+        finally:
+            elapsed = render_time.get()
+            if elapsed is not None:
+                elapsed[0] += time.perf_counter() - start
@@ -1,16 +1,52 @@
+import os
+import csv
+import json
+import tempfile
+import asyncio
 import datetime
 import pytz
+from io import StringIO
 from unittest.mock import patch
-from unittest.mock import MagicMock
-from django.test import TestCase
-from django.utils.timezone import now, localtime, timedelta
+from asgiref.sync import async_to_sync
+from django.test import TestCase, TransactionTestCase
+from django.core.cache import cache
+from django.core.cache.backends.locmem import LocMemCache
+from django.template.loader import render_to_string
+from django.utils.timezone import now, localtime, localdate, timedelta
 from django.test.utils import setup_test_environment
-from django.test import Client
+from django.test.utils import CaptureQueriesContext
+from django.db import connection, transaction, close_old_connections
+from django.db.backends.sqlite3.base import DatabaseWrapper
+from django.core.signals import request_started, request_finished
+from django.core.handlers.asgi import ASGIHandler
+from django.test import Client, RequestFactory
+from django.test import override_settings
+from django.conf import settings
+from django.core.management import call_command
 from django.urls import reverse
+from django.contrib.auth.models import Group, Permission
 from .models import (Menu, MenuOption, MenuOptionCustomization, Order,
-                     User, OrderCustomization, Profile)
+                     User, OrderCustomization, Profile, Reminder,
+                     DailyOptionRollup, DailyCustomizationRollup)
+from . import api
+from . import db
 from . import views
 from . import services
+from . import menus
+from . import scheduler
+from .fake_slack import FakeSlackServer
+from .notifiers import (
+    get_notifier, reset_notifier, SlackNotifier, NotifierError, RateLimited
+)
+from . import loadtest
+from .loadtest import LoadTestData, LoadTestReport, run_order_rush
+from . import auth_cache
+from .auth_cache import CachedModelBackend
+from .metrics import ReminderMetrics, request_metrics, reminder_metrics
+from .middleware import RequestMetricsMiddleware, count_queries
+from .order_window import (
+    OrderWindow, get_order_window, menu_order_window
+)
 
 
 class MenuViewTests(TestCase):
@@ -20,11 +56,11 @@ class MenuViewTests(TestCase):
     def setUp(self):
         self.client = Client()
 
-    @patch(views.__name__+'._get_datetime_today_range')
+    @patch(views.__name__+'.menu_order_window')
     def test_time_before_restricted(self, mock):
         '''
-        Create a menu with date now and mock today_max
-        that has to be greater that now() to get a menu response
+        Create a menu with date now and mock its order window
+        that has to be open to get a menu response
         '''
         # GIVEN: a valid datetime to view a menu
         mock.return_value = self._mock_return_valid_date_menu()
@@ -41,7 +77,7 @@ class MenuViewTests(TestCase):
         # THEN:
         self.assertIn('menu', response.context)
 
-    @patch(views.__name__+'._get_datetime_today_range')
+    @patch(views.__name__+'.menu_order_window')
     def test_view_order_created_by_employee(self, mock):
         # GIVEN: order with a menu and menu option
         mock.return_value = self._mock_return_valid_date_menu()
@@ -64,7 +100,7 @@ class MenuViewTests(TestCase):
         # THEN: order is added to response context
         self.assertIn('order', response.context)
 
-    @patch(views.__name__+'._get_datetime_today_range')
+    @patch(views.__name__+'.menu_order_window')
     def test_orders_of_others_employees(self, mock):
         # GIVEN: order with a menu and menu option
         mock.return_value = self._mock_return_valid_date_menu()
@@ -87,11 +123,307 @@ class MenuViewTests(TestCase):
         # THEN: order is added to response context
         self.assertIsNot('order', response.context)
 
+    def test_choose_menu_fixed_queries(self):
+        # GIVEN: an open menu and joaco's customized order
+        cache.clear()
+        menu = Menu.objects.create(closes_at=now() + timedelta(hours=1))
+        option = MenuOptionCustomization.objects.first().menu_option
+        order = Order.objects.create(user=User.objects.get(username='joaco'),
+                                     menu=menu, menu_option=option)
+        chosen = set(option.menuoptioncustomization_set
+                     .values_list('id', flat=True))
+        order.set_customizations(chosen)
+        self.client.login(username='joaco', password='1234corner')
+        url = reverse('mealshop:choose_menu', args=[menu.id])
+
+        queries = []
+        for catalog in (0, 20):
+            # AND: a menu with more options and customizations
+            for i in range(catalog):
+                extra = MenuOption.objects.create(name=str(i))
+                MenuOptionCustomization.objects.bulk_create(
+                    [MenuOptionCustomization(name=str(j), menu_option=extra)
+                     for j in range(3)])
+                menu.menu_options.add(extra)
+            menu.menu_options.add(option)
+            self.client.get(url)
+
+            # WHEN: joaco opens the menu to order
+            with CaptureQueriesContext(connection) as context:
+                response = self.client.get(url)
+            queries.append(len(context))
+
+        # THEN: session, user, order, its customizations and the two
+        # permission queries of the menu bar, whatever the size of the menu
+        self.assertEqual(queries, [6, 6])
+        self.assertEqual(response.context['customization_user'], chosen)
+        self.assertContains(response, 'checked', count=len(chosen))
+
     def _mock_return_valid_date_menu(self):
         menu = Menu(pub_date=now())
         menu.save()
-        t_max = now() + timedelta(days=1)
-        return ((t_max, t_max))
+        return OrderWindow(localdate(), now() - timedelta(hours=1),
+                           now() + timedelta(hours=1),
+                           now() + timedelta(days=1))
+
+
+class TodayMenuCacheTests(TestCase):
+
+    fixtures = ['mealshop.json']
+
+    def setUp(self):
+        self.client = Client()
+        cache.clear()
+
+    def test_index_without_queries_once_cached(self):
+        # GIVEN: a menu for today
+        menu = Menu.objects.create(pub_date=now())
+        menu.menu_options.set(MenuOption.objects.all()[:2])
+
+        # WHEN: the landing page is requested twice
+        self.client.get(reverse('mealshop:index'))
+        with self.assertNumQueries(0):
+            response = self.client.get(reverse('mealshop:index'))
+
+        # THEN: the menu of today is displayed from cache
+        self.assertContains(response, str(menu.uuid))
+
+    def test_menu_options_change_invalidates(self):
+        # GIVEN: a cached menu of today
+        menu = Menu.objects.create(pub_date=now())
+        menu.menu_options.set(MenuOption.objects.all()[:1])
+        self.assertEqual(len(menus.get_today_menu().menu_options.all()), 1)
+
+        # WHEN: an option is added to the menu
+        menu.menu_options.add(MenuOption.objects.last())
+
+        # THEN: the cached menu is refreshed
+        self.assertEqual(len(menus.get_today_menu().menu_options.all()), 2)
+
+    def test_menu_change_invalidates_after_commit(self):
+        # GIVEN: a menu of today
+        menu = Menu.objects.create(pub_date=now())
+        key = menus.TODAY_MENU_KEY.format(localdate().isoformat())
+
+        # WHEN: an option is added while a request reading the menus before
+        # the commit caches them again
+        with self.captureOnCommitCallbacks(execute=True) as callbacks:
+            menu.menu_options.add(MenuOption.objects.first())
+            cache.set(key, {'menus': [], 'version': 'stale',
+                            'updated': None})
+
+        # THEN: the commit drops them
+        self.assertTrue(callbacks)
+        self.assertIsNone(cache.get(key))
+        self.assertEqual(len(menus.get_today_menu().menu_options.all()), 1)
+
+    def test_index_not_modified_with_etag(self):
+        # GIVEN: the landing page already visited
+        response = self.client.get(reverse('mealshop:index'))
+        etag = response['ETag']
+
+        # WHEN: it is requested again with its ETag
+        response = self.client.get(reverse('mealshop:index'),
+                                   HTTP_IF_NONE_MATCH=etag)
+
+        # THEN: a 304 is returned
+        self.assertEqual(response.status_code, 304)
+
+        # WHEN: a menu changes
+        Menu.objects.create(pub_date=now())
+        response = self.client.get(reverse('mealshop:index'),
+                                   HTTP_IF_NONE_MATCH=etag)
+
+        # THEN: the page is rendered again
+        self.assertEqual(response.status_code, 200)
+
+    def test_etag_same_in_every_worker(self):
+        # GIVEN: the landing page visited with a menu of today
+        menu = Menu.objects.create(pub_date=now())
+        menu.menu_options.set(MenuOption.objects.all()[:2])
+        response = self.client.get(reverse('mealshop:index'))
+
+        # WHEN: another worker, with an empty cache, serves it
+        cache.clear()
+        other = self.client.get(reverse('mealshop:index'))
+
+        # THEN: both have the same ETag and Last-Modified
+        self.assertEqual(response['ETag'], other['ETag'])
+        self.assertEqual(response['Last-Modified'], other['Last-Modified'])
+
+        # WHEN: a customization of the menu is renamed
+        custom = MenuOptionCustomization.objects.filter(
+            menu_option__menu=menu).first()
+        custom.name = 'sin sal'
+        custom.save()
+
+        # THEN: the ETag changes
+        changed = self.client.get(reverse('mealshop:index'))
+        self.assertNotEqual(response['ETag'], changed['ETag'])
+
+    @patch(views.__name__+'.render', wraps=views.render)
+    def test_anonymous_menu_page_rendered_once(self, mock):
+        # GIVEN: a public menu page
+        menu = Menu.objects.get(pk=1)
+        url = reverse('mealshop:menu', args=[menu.uuid])
+
+        # WHEN: anonymous users request it twice
+        first = self.client.get(url)
+        second = self.client.get(url)
+
+        # THEN: the template is rendered only once
+        self.assertEqual(mock.call_count, 1)
+        self.assertEqual(first.content, second.content)
+
+
+class OrderWindowTest(TestCase):
+    fixtures = ['mealshop.json']
+
+    def test_window_uses_offset_of_the_day(self):
+        # WHEN: the windows of a winter and a summer day are computed
+        winter = get_order_window(datetime.date(2020, 6, 12),
+                                  datetime.time(hour=11))
+        summer = get_order_window(datetime.date(2020, 12, 12),
+                                  datetime.time(hour=11))
+
+        # THEN: boundaries have the offset of each day, not LMT
+        self.assertEqual(winter.opens.utcoffset(), timedelta(hours=-4))
+        self.assertEqual(summer.closes.utcoffset(), timedelta(hours=-3))
+        self.assertEqual(winter.closes.astimezone(pytz.utc).hour, 15)
+
+    def test_window_on_daylight_saving_midnight(self):
+        # WHEN: the window of a day whose midnight is skipped is computed
+        window = get_order_window(datetime.date(2020, 9, 6))
+
+        # THEN: it opens on that day
+        self.assertEqual(localtime(window.opens).date(),
+                         datetime.date(2020, 9, 6))
+
+    @override_settings(ORDER_CUTOFF='09:30')
+    def test_menu_cutoff_overrides_site_cutoff(self):
+        # GIVEN: a menu without cutoff and another closing later
+        menu = Menu.objects.create()
+        closes_at = get_order_window().opens + timedelta(hours=14)
+        late_menu = Menu.objects.create(closes_at=closes_at)
+
+        # THEN: each window closes at its cutoff
+        self.assertEqual(localtime(menu_order_window(menu).closes).time(),
+                         datetime.time(9, 30))
+        self.assertEqual(menu_order_window(late_menu).closes, closes_at)
+
+    def test_choose_menu_closed_after_menu_cutoff(self):
+        # GIVEN: a menu closed at midnight and another open for one hour
+        closed = Menu.objects.create(closes_at=get_order_window().opens)
+        opened = Menu.objects.create(closes_at=now() + timedelta(hours=1))
+        self.client.login(username='joaco', password='1234corner')
+
+        # WHEN: joaco opens both menus to order
+        closed_response = self.client.get(reverse('mealshop:choose_menu',
+                                                  args=[closed.id]))
+        opened_response = self.client.get(reverse('mealshop:choose_menu',
+                                                  args=[opened.id]))
+
+        # THEN: only the open one can be ordered, showing its closing time
+        self.assertNotIn('menu', closed_response.context)
+        self.assertEqual(opened_response.context['menu'], opened)
+        self.assertContains(opened_response, 'se cerrará a las {}'.format(
+            localtime(opened.closes_at).strftime('%H:%M')))
+
+
+class MenuSchedulerTest(TestCase):
+    fixtures = ['mealshop.json']
+
+    def setUp(self):
+        cache.clear()
+
+    @override_settings(SHARED_CACHE=True)
+    def test_scheduled_menu_opens_from_warm_cache(self):
+        # GIVEN: a menu scheduled to open in 30 seconds
+        opens_at = now() + timedelta(seconds=30)
+        menu = Menu.objects.create(pub_date=opens_at, opens_at=opens_at)
+        menu.menu_options.set(MenuOption.objects.all()[:2])
+
+        # WHEN: the scheduler runs before it opens
+        days, reminded = scheduler.run_schedule()
+
+        # THEN: the menus of its day are cached but it is not open yet
+        self.assertEqual(days, [localdate(opens_at)])
+        self.assertNotEqual(menus.get_today_menu(), menu)
+
+        # WHEN: it opens
+        with patch(menus.__name__ + '.now',
+                   return_value=opens_at + timedelta(seconds=1)):
+            with self.assertNumQueries(0):
+                today_menu = menus.get_today_menu()
+                options = list(today_menu.menu_options.all())
+
+        # THEN: it is today's menu without hitting the database
+        self.assertEqual(today_menu, menu)
+        self.assertEqual(len(options), 2)
+
+    @override_settings(SHARED_CACHE=False)
+    def test_scheduled_menu_opens_without_shared_cache(self):
+        # GIVEN: a menu scheduled to open in 30 seconds
+        opens_at = now() + timedelta(seconds=30)
+        menu = Menu.objects.create(pub_date=opens_at, opens_at=opens_at)
+        menu.menu_options.set(MenuOption.objects.all()[:2])
+
+        # WHEN: the scheduler runs, in its own process with its own cache
+        scheduler_cache = LocMemCache('scheduler', {})
+        with patch(menus.__name__ + '.cache', scheduler_cache):
+            days, reminded = scheduler.run_schedule()
+
+        # THEN: nothing is warmed, it would not reach the web workers
+        self.assertEqual(days, [])
+        self.assertIsNone(scheduler_cache.get(
+            menus.TODAY_MENU_KEY.format(localdate(opens_at).isoformat())))
+
+        # WHEN: it opens
+        with patch(menus.__name__ + '.now',
+                   return_value=opens_at + timedelta(seconds=1)):
+            today_menu = menus.get_today_menu()
+
+        # THEN: a web worker loads it on its first miss
+        self.assertEqual(today_menu, menu)
+        self.assertEqual(len(today_menu.menu_options.all()), 2)
+
+    def test_reminders_queued_once_when_menu_opens(self):
+        # GIVEN: a menu that just opened
+        menu = Menu.objects.create(opens_at=now() - timedelta(seconds=1),
+                                   closes_at=now() + timedelta(hours=1))
+
+        # WHEN: the scheduler runs twice
+        first = scheduler.run_schedule()[1]
+        second = scheduler.run_schedule()[1]
+
+        # THEN: the reminders of the menu are queued only once
+        self.assertEqual((first, second), ([menu], []))
+        self.assertEqual(Reminder.objects.filter(menu=menu).count(),
+                         Profile.objects.exclude(slack_user='').count())
+        menu.refresh_from_db()
+        self.assertIsNotNone(menu.reminded_at)
+
+    def test_no_reminders_for_stale_menu(self):
+        # GIVEN: a menu that opened a week ago without a closes_at
+        week_ago = now() - timedelta(days=7)
+        menu = Menu.objects.create(pub_date=week_ago, opens_at=week_ago)
+        self.assertFalse(menu_order_window(menu).is_open())
+
+        # WHEN: the scheduler runs
+        reminded = scheduler.run_schedule()[1]
+
+        # THEN: nobody is reminded of it
+        self.assertEqual(reminded, [])
+        self.assertFalse(Reminder.objects.filter(menu=menu).exists())
+
+    def test_wait_until_next_opening(self):
+        # GIVEN: a menu opening in ten minutes
+        Menu.objects.create(opens_at=now() + timedelta(minutes=10))
+
+        # THEN: the scheduler waits until its warm up, at most the interval
+        self.assertEqual(scheduler.seconds_until_next_run(30), 30)
+        self.assertAlmostEqual(scheduler.seconds_until_next_run(3600),
+                               540, delta=5)
 
 
 class OrdersTest(TestCase):
@@ -118,6 +450,143 @@ class OrdersTest(TestCase):
         # THEN: user is redirected with 302 status code
         self.assertEqual(response.status_code, 302)
 
+    def test_kitchen_report_query_count(self):
+        # GIVEN: every employee ordered with customizations
+        Order.objects.update(purchased_date=now())
+        for order in Order.objects.all():
+            for customization in MenuOptionCustomization.objects.filter(
+                    menu_option=order.menu_option):
+                OrderCustomization.objects.get_or_create(
+                    order=order, menu_option_custom=customization)
+        t_min, t_max = now() - timedelta(hours=1), now() + timedelta(hours=1)
+
+        # WHEN: the kitchen report is rendered
+        # THEN: orders and customizations are loaded in two queries
+        with self.assertNumQueries(2):
+            orders = Order.objects.kitchen_report(t_min, t_max)
+            html = render_to_string('app/view_orders.html',
+                                    {'orders': orders})
+
+        self.assertEqual(len(orders), Order.objects.count())
+        self.assertIn('mayonesa', html)
+
+    def test_orders_summary_counts(self):
+        # GIVEN: two orders of the same option, one with a customization
+        Order.objects.update(purchased_date=now() - timedelta(days=10))
+        menu = Menu.objects.get(pk=3)
+        option = MenuOption.objects.get(pk=1)
+        customization = MenuOptionCustomization.objects.get(pk=1)
+        for username in ('joaco', 'duce'):
+            Order.objects.filter(menu=menu, user__username=username)\
+                .update(purchased_date=now(), menu_option=option)
+        OrderCustomization.objects.all().delete()
+        OrderCustomization.objects.create(
+            order=Order.objects.get(menu=menu, user__username='joaco'),
+            menu_option_custom=customization)
+
+        # AND: nora authenticated
+        self.client.login(username='nora', password='1234corner')
+
+        # WHEN: nora asks for the summary
+        response = self.client.get(reverse('mealshop:orders_summary_json'))
+
+        # THEN: orders are counted per option and per customization
+        self.assertEqual(response.json()['summary'], [{
+            'id': option.id, 'name': option.name, 'total': 2,
+            'customizations': [{
+                'id': customization.id, 'name': customization.name,
+                'total': 1
+            }]
+        }])
+
+    def test_export_orders_csv(self):
+        # GIVEN: nora authenticated
+        self.client.login(username='nora', password='1234corner')
+
+        # WHEN: nora exports the orders of the fixture dates
+        response = self.client.get(reverse('mealshop:export_orders'), {
+            'start': '2020-06-12', 'end': '2020-06-13'})
+
+        # THEN: every order is streamed as a csv row
+        rows = list(csv.reader(
+            b''.join(response.streaming_content).decode().splitlines()))
+        self.assertEqual(rows[0][0], 'id')
+        self.assertEqual(len(rows) - 1, Order.objects.count())
+
+    def test_export_orders_ndjson(self):
+        # GIVEN: nora authenticated
+        self.client.login(username='nora', password='1234corner')
+
+        # WHEN: nora exports the orders as ndjson
+        response = self.client.get(reverse('mealshop:export_orders'), {
+            'start': '2020-06-12', 'end': '2020-06-13',
+            'format': 'ndjson'})
+
+        # THEN: each line has an order with its customizations
+        orders = [json.loads(line) for line in b''.join(
+            response.streaming_content).decode().splitlines()]
+        exported = {order['id']: set(order['customizations'])
+                    for order in orders}
+        for order in Order.objects.all():
+            self.assertEqual(exported[order.id], {
+                custom.menu_option_custom.name
+                for custom in order.ordercustomization_set.all()})
+
+    def test_export_orders_under_asgi(self):
+        # GIVEN: nora authenticated
+        self.client.login(username='nora', password='1234corner')
+
+        # WHEN: nora exports the orders from a server running the ASGI
+        # handler, which iterates the response in its event loop
+        status, body = self._asgi_get(
+            reverse('mealshop:export_orders'),
+            'start=2020-06-12&end=2020-06-13')
+
+        # THEN: the whole export is downloaded
+        self.assertEqual(status, 200)
+        rows = list(csv.reader(body.decode().splitlines()))
+        self.assertEqual(len(rows) - 1, Order.objects.count())
+
+    def _asgi_get(self, path, query_string):
+        # the async test client does not send the body through the handler,
+        # so the request goes to ASGIHandler as an ASGI server sends it
+        cookie = '{}={}'.format(
+            settings.SESSION_COOKIE_NAME,
+            self.client.cookies[settings.SESSION_COOKIE_NAME].value)
+        scope = {'type': 'http', 'method': 'GET', 'path': path,
+                 'query_string': query_string.encode(),
+                 'headers': [(b'host', b'testserver'),
+                             (b'cookie', cookie.encode())]}
+        messages = []
+
+        async def receive():
+            return {'type': 'http.request', 'body': b''}
+
+        async def send(message):
+            messages.append(message)
+
+        # as the test client does, the test transaction has to outlive the
+        # request
+        request_started.disconnect(close_old_connections)
+        request_finished.disconnect(close_old_connections)
+        try:
+            async_to_sync(ASGIHandler())(scope, receive, send)
+        finally:
+            request_started.connect(close_old_connections)
+            request_finished.connect(close_old_connections)
+        return messages[0]['status'], b''.join(
+            message.get('body', b'') for message in messages[1:])
+
+    def test_export_reads_customizations_per_chunk(self):
+        # GIVEN: five orders
+        orders = Order.objects.all()
+
+        # WHEN: they are exported two at a time
+        # THEN: one query reads orders and one per chunk customizations
+        with self.assertNumQueries(4):
+            rows = list(orders.iter_export(chunk_size=2))
+        self.assertEqual(len(rows), 5)
+
     def test_add_orders_authenticated_user(self):
         # GIVEN: a employee with menu and menu options
         menu = Menu.objects.filter().latest('pub_date')
@@ -159,6 +628,48 @@ class OrdersTest(TestCase):
         self.assertEqual(response.status_code, 302)
 
 
+class MenuCreationTest(TestCase):
+    fixtures = ['mealshop.json']
+
+    def setUp(self):
+        self.client = Client()
+        self.client.login(username='nora', password='1234corner')
+
+    def test_add_menu_with_checked_options(self):
+        # WHEN: nora creates a menu with two options
+        response = self.client.post(reverse('mealshop:add_menu'), {
+            'pub_date': '06/20/2020', 'menu_option_1': 'on',
+            'menu_option_3': 'on', 'menu_option_999': 'on'
+        })
+
+        # THEN: the menu has the existing checked options
+        menu = Menu.objects.latest('id')
+        self.assertEqual(response.status_code, 302)
+        self.assertEqual(menu.user.username, 'nora')
+        self.assertEqual(set(menu.menu_options.values_list('id', flat=True)),
+                         {1, 3})
+
+    def test_add_menu_queries_independent_of_catalog(self):
+        # GIVEN: a small and a large menu option catalog
+        queries = []
+        for catalog in (0, 200):
+            MenuOption.objects.bulk_create(
+                [MenuOption(name=str(i), description='')
+                 for i in range(catalog)])
+            data = {'pub_date': '06/20/2020'}
+            data.update({'menu_option_{}'.format(option_id): 'on'
+                         for option_id in MenuOption.objects
+                         .values_list('id', flat=True)[:4]})
+
+            # WHEN: a menu is created
+            with CaptureQueriesContext(connection) as context:
+                self.client.post(reverse('mealshop:add_menu'), data)
+            queries.append(len(context))
+
+        # THEN: both cost the same amount of queries
+        self.assertEqual(queries[0], queries[1])
+
+
 class OrderCustomizationTest(TestCase):
     fixtures = ['mealshop.json']
 
@@ -170,9 +681,8 @@ class OrderCustomizationTest(TestCase):
         menu = Menu.objects.get(pk=1)
         menu_option = MenuOption.objects.filter(menu=menu).first()
         user = User.objects.get(username='joaco')
-        order = Order(user=user, menu_option=menu_option,
-                      menu=menu)
-        order.save()
+        order, created = Order.objects.update_or_create(
+            user=user, menu=menu, defaults={'menu_option': menu_option})
 
         # AND: user is authenticated
         self.client.login(username='joaco', password='1234corner')
@@ -209,21 +719,780 @@ class OrderCustomizationTest(TestCase):
 
         self.assertEqual(query_id, {customization_update.id})
 
+    def test_customizations_cost_constant_queries(self):
+        # GIVEN: two orders, one of an option with many customizations
+        user = User.objects.get(username='joaco')
+        small_option = MenuOption.objects.get(pk=1)
+        large_option = MenuOption.objects.create(name='Many', description='')
+        MenuOptionCustomization.objects.bulk_create(
+            [MenuOptionCustomization(name=str(i), menu_option=large_option)
+             for i in range(30)])
+        small = Order.objects.create(user=user, menu_option=small_option,
+                                     menu=Menu.objects.create())
+        large = Order.objects.create(user=user, menu_option=large_option,
+                                     menu=Menu.objects.create())
+
+        # AND: user is authenticated
+        self.client.login(username='joaco', password='1234corner')
+
+        # WHEN: every customization of each order is checked
+        queries = []
+        for order in (small, large):
+            data = {'menu_option_customization_{}'.format(custom.id): 'on'
+                    for custom in MenuOptionCustomization.objects.filter(
+                        menu_option=order.menu_option)}
+            with CaptureQueriesContext(connection) as context:
+                self.client.post(
+                    '/{}/add_order_customizations'.format(order.id), data)
+            queries.append(len(context))
+
+        # THEN: both requests cost the same amount of queries
+        self.assertEqual(queries[0], queries[1])
+        self.assertEqual(large.ordercustomization_set.count(), 30)
 
+
+@override_settings(REMINDER_NOTIFIER='app.notifiers.InMemoryNotifier')
 class ServiceTest(TestCase):
     fixtures = ['mealshop.json']
 
     def setUp(self):
         self.client = Client()
+        reset_notifier()
+        self.notifier = get_notifier()
 
-    @patch(services.__name__+'.WebClient.api_call')
-    def test_send_reminder_all_users(self, mock):
+    def test_send_reminder_all_users(self):
         # GIVEN: a menu
         menu = Menu.objects.latest('pub_date')
         profiles = Profile.objects.exclude(slack_user__exact='')
 
-        # WHEN: _send a reminder
-        services._send_reminder(menu)
+        # WHEN: a reminder is created and the worker sends it
+        services.create_reminder_async(menu)
+        services.process_reminders()
+
+        # THEN: a reminder is set for every employee
+        self.assertEqual(len(self.notifier.sent), len(profiles))
+
+    def test_send_reminder_retries_when_rate_limited(self):
+        # GIVEN: queued reminders, slack rate limits the first call
+        self.notifier.errors = [RateLimited(0)]
+        menu = Menu.objects.latest('pub_date')
+        profiles = Profile.objects.exclude(slack_user__exact='')
+        services.enqueue_reminders(menu)
+
+        # WHEN: the reminders are sent
+        services.process_reminders()
+
+        # THEN: the rate limited call is retried
+        self.assertEqual(len(self.notifier.sent), len(profiles))
+        self.assertEqual(self.notifier.errors, [])
+
+
+@override_settings(REMINDER_NOTIFIER='app.notifiers.InMemoryNotifier')
+class ReminderQueueTest(TestCase):
+    fixtures = ['mealshop.json']
+
+    def setUp(self):
+        self.menu = Menu.objects.latest('pub_date')
+        self.profiles = Profile.objects.exclude(slack_user__exact='')
+        reset_notifier()
+        self.notifier = get_notifier()
+
+    def test_enqueue_reminders_once_per_employee(self):
+        # WHEN: reminders of a menu are queued twice
+        services.enqueue_reminders(self.menu)
+        services.enqueue_reminders(self.menu)
+
+        # THEN: one pending reminder exists per employee
+        self.assertEqual(
+            Reminder.objects.filter(menu=self.menu,
+                                    status=Reminder.PENDING).count(),
+            len(self.profiles))
+
+    def test_create_reminder_view_queues_reminders(self):
+        # GIVEN: joaco without permission to add menus and nora with it
+        url = reverse('mealshop:create_reminder', args=[self.menu.id])
+        self.client.login(username='joaco', password='1234corner')
+
+        # WHEN: joaco asks for the reminders
+        # THEN: he is sent to log in and nothing is queued
+        self.assertRedirects(self.client.get(url),
+                             '/?next={}'.format(url),
+                             fetch_redirect_response=False)
+        self.assertFalse(Reminder.objects.filter(menu=self.menu).exists())
+
+        # WHEN: nora asks for the reminders
+        self.client.login(username='nora', password='1234corner')
+        response = self.client.get(url)
+
+        # THEN: they are queued by the async view
+        self.assertRedirects(response, reverse('mealshop:daily_menu'),
+                             fetch_redirect_response=False)
+        self.assertEqual(Reminder.objects.filter(menu=self.menu).count(),
+                         len(self.profiles))
+
+    def test_process_reminders_sends_queued(self):
+        # GIVEN: queued reminders
+        services.enqueue_reminders(self.menu)
+
+        # WHEN: the worker processes them
+        claimed = services.process_reminders()
+
+        # THEN: every reminder is sent
+        self.assertEqual(claimed, len(self.profiles))
+        self.assertEqual(len(self.notifier.sent), len(self.profiles))
+        self.assertFalse(Reminder.objects.exclude(status=Reminder.SENT)
+                         .exists())
+
+    @override_settings(METRICS_TOKEN='scraper')
+    def test_process_reminders_metrics(self):
+        # GIVEN: reminders queued twice, slack rate limiting the first call
+        self.notifier.errors = [RateLimited(0)]
+        services.enqueue_reminders(self.menu)
+        services.enqueue_reminders(self.menu)
+
+        # WHEN: the worker processes them
+        services.process_reminders()
+
+        # THEN: counters and timings are recorded for the menu
+        metrics = reminder_metrics.as_dict()
+        self.assertEqual(metrics['recipients'][self.menu.id],
+                         len(self.profiles))
+        self.assertEqual(metrics['sent'][self.menu.id], len(self.profiles))
+        self.assertEqual(metrics['rate_limited'][self.menu.id], 1)
+        self.assertEqual(metrics['call_seconds'][self.menu.id]['count'],
+                         len(self.profiles) + 1)
+        self.assertEqual(metrics['batch_seconds'][self.menu.id]['count'], 1)
+
+        # AND: they are exposed to prometheus
+        response = Client().get(reverse('mealshop:metrics'),
+                                HTTP_AUTHORIZATION='Bearer scraper')
+        self.assertContains(response, 'mealshop_reminder_sent_total'
+                            '{{menu="{}"}} {}'.format(self.menu.id,
+                                                      len(self.profiles)))
+        self.assertEqual(Client().get(reverse('mealshop:metrics'))
+                         .status_code, 403)
+
+    @override_settings(METRICS_TOKEN='scraper')
+    def test_reminder_metrics_from_worker_process(self):
+        # GIVEN: queued reminders and slack rate limiting the first call
+        self.notifier.errors = [RateLimited(0)]
+        services.enqueue_reminders(self.menu)
+
+        # WHEN: the worker, in its own process with its own metrics, sends
+        # them
+        with patch('app.services.reminder_metrics', ReminderMetrics()):
+            services.process_reminders()
+
+        # THEN: the metrics of the web process include its counters and
+        # timings
+        response = Client().get(reverse('mealshop:metrics'),
+                                HTTP_AUTHORIZATION='Bearer scraper')
+        labels = '{{menu="{}"}}'.format(self.menu.id)
+        self.assertContains(response, 'mealshop_reminder_sent_total{} {}'
+                            .format(labels, len(self.profiles)))
+        self.assertContains(response, 'mealshop_reminder_rate_limited_total'
+                            '{} 1'.format(labels))
+        self.assertContains(response, 'mealshop_reminder_call_seconds_count'
+                            '{} {}'.format(labels, len(self.profiles) + 1))
+        self.assertContains(response, 'mealshop_reminder_batch_seconds_count'
+                            '{} 1'.format(labels))
+
+    @override_settings(SLACK_REMINDER_MAX_ATTEMPTS=2,
+                       SLACK_REMINDER_BACKOFF=0)
+    def test_reminder_failed_counted_once(self):
+        # GIVEN: queued reminders and slack failing
+        self.notifier.errors = [NotifierError('invalid_auth')] * 10
+        services.enqueue_reminders(self.menu)
+
+        # WHEN: the worker processes them until their last attempt
+        services.process_reminders()
+        self.assertEqual(reminder_metrics.as_dict()['failed'], {
+            self.menu.id: 0})
+        services.process_reminders()
+
+        # THEN: each reminder is counted as failed once
+        self.assertEqual(reminder_metrics.as_dict()['failed'], {
+            self.menu.id: len(self.profiles)})
+
+    def test_process_reminders_retries_failed_later(self):
+        # GIVEN: queued reminders and slack failing
+        self.notifier.errors = [NotifierError('invalid_auth')] * 10
+        services.enqueue_reminders(self.menu)
+
+        # WHEN: the worker processes them twice
+        services.process_reminders()
+        claimed = services.process_reminders()
+
+        # THEN: reminders wait their backoff before a new attempt
+        self.assertEqual(claimed, 0)
+        for reminder in Reminder.objects.all():
+            self.assertEqual(reminder.status, Reminder.PENDING)
+            self.assertEqual(reminder.attempts, 1)
+            self.assertGreater(reminder.next_attempt_at, now())
+            self.assertEqual(reminder.last_error, 'invalid_auth')
+
+
+class AsyncServiceTest(TestCase):
+    fixtures = ['mealshop.json']
+
+    def test_send_reminders_to_fake_slack(self):
+        # GIVEN: a menu and a slack rate limiting the first call
+        menu = Menu.objects.latest('pub_date')
+        profiles = Profile.objects.exclude(slack_user__exact='')
+
+        # WHEN: reminders are sent with the asyncio slack client
+        sent, calls = async_to_sync(self._send_reminders)(menu)
+
+        # THEN: every employee gets a reminders.add call
+        self.assertEqual(sent, len(profiles))
+        self.assertEqual([method for method, _ in calls],
+                         ['reminders.add'] * len(profiles))
+        self.assertEqual({data['user'] for _, data in calls},
+                         {profile.slack_user for profile in profiles})
+
+    async def _send_reminders(self, menu):
+        async with FakeSlackServer(rate_limited=1) as slack:
+            notifier = SlackNotifier(token='test', base_url=slack.url)
+            sent = await services.send_reminders(menu, notifier=notifier)
+            return sent, slack.calls
+
+
+class OrderRushLoadTest(TestCase):
+    # Queries allowed per request of each step of the order rush
+    QUERY_BUDGET = {
+        'choose_menu': 6,
+        'add_order': 13,
+        'add_order_customizations': 8,
+        'view_orders': 6,
+    }
+
+    def test_order_rush_within_query_budget(self):
+        # GIVEN: employees and a menu of today
+        data = LoadTestData(users=10, options=3, customizations=3)
+
+        # WHEN: every employee orders
+        report = run_order_rush(data, concurrency=1, seed=1)
+
+        # THEN: each order is stored and every step keeps its query budget
+        self.assertEqual(Order.objects.filter(menu=data.menu).count(), 10)
+        self.assertEqual(report.rejected, {})
+        for step, row in report.summary().items():
+            self.assertLessEqual(row['max_queries'],
+                                 self.QUERY_BUDGET[step], step)
+
+    def test_rejected_requests_reported_apart(self):
+        # GIVEN: a load test report
+        report = LoadTestReport()
+
+        # WHEN: a request is answered with 404 and another with 200
+        loadtest._request(report, 'missing', Client().get, '/missing/')
+        loadtest._request(report, 'api_today_menu', Client().get,
+                          reverse('mealshop:api_today_menu'))
+
+        # THEN: the 404 is counted by status, without its latency
+        self.assertEqual(report.rejected, {'missing': {404: 1}})
+        self.assertEqual(list(report.summary()), ['api_today_menu'])
+        self.assertIn('missing answered 1 requests with 404', report.lines())
+
+
+class OrderApiTest(TestCase):
+    fixtures = ['mealshop.json']
+
+    def setUp(self):
+        cache.clear()
+        self.menu = Menu.objects.create(closes_at=now() + timedelta(hours=1))
+        self.option = MenuOptionCustomization.objects.first().menu_option
+        self.menu.menu_options.set([self.option, MenuOption.objects.exclude(
+            pk=self.option.pk).first()])
+        self.customizations = sorted(self.option.menuoptioncustomization_set
+                                     .values_list('id', flat=True))
+
+    def _put_order(self, data):
+        return self.client.put(reverse('mealshop:api_order'),
+                               json.dumps(data),
+                               content_type='application/json')
+
+    def test_today_menu_with_etag(self):
+        # WHEN: today's menu is requested
+        response = self.client.get(reverse('mealshop:api_today_menu'))
+
+        # THEN: it has its options and customizations
+        menu = response.json()
+        self.assertEqual(menu['id'], self.menu.id)
+        self.assertTrue(menu['open'])
+        self.assertEqual(
+            {option['id']: [custom['id']
+                            for custom in option['customizations']]
+             for option in menu['options']}[self.option.id],
+            self.customizations)
+
+        # WHEN: it is requested again with its ETag
+        # THEN: a 304 is returned without queries
+        with self.assertNumQueries(0):
+            response = self.client.get(reverse('mealshop:api_today_menu'),
+                                       HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(response.status_code, 304)
+
+    def test_place_update_and_read_order(self):
+        # GIVEN: joaco authenticated
+        self.client.login(username='joaco', password='1234corner')
+
+        # WHEN: joaco places an order with every customization
+        response = self._put_order({'menu_option': self.option.id,
+                                    'customizations': self.customizations})
+
+        # THEN: the order is created
+        self.assertEqual(response.status_code, 201)
+        order = Order.objects.get(user__username='joaco', menu=self.menu)
+        self.assertEqual(response.json()['id'], order.id)
+
+        # WHEN: joaco replaces it by the other option
+        other = self.menu.menu_options.exclude(pk=self.option.pk).get()
+        response = self._put_order({'menu_option': other.id})
+
+        # THEN: the order changes and loses its customizations
+        self.assertEqual(response.status_code, 200)
+        response = self.client.get(reverse('mealshop:api_order'))
+        self.assertEqual(response.json()['menu_option'], other.id)
+        self.assertEqual(response.json()['customizations'], [])
+        self.assertFalse(order.ordercustomization_set.exists())
+
+    async def test_api_served_by_async_views(self):
+        # GIVEN: the API views are coroutines
+        self.assertTrue(asyncio.iscoroutinefunction(api.today_menu))
+        self.assertTrue(asyncio.iscoroutinefunction(api.my_order))
+
+        # WHEN: they are requested through the ASGI handler
+        menu = await self.async_client.get(
+            reverse('mealshop:api_today_menu'))
+        order = await self.async_client.get(reverse('mealshop:api_order'))
+
+        # THEN: the menu is read and anonymous clients are refused
+        self.assertEqual(menu.json()['id'], self.menu.id)
+        self.assertEqual(order.status_code, 401)
+
+        # AND: queries run through sync_to_async are measured
+        self.assertIn('"3 queries"', menu['Server-Timing'])
+
+    def test_invalid_order_is_rejected(self):
+        # GIVEN: joaco authenticated
+        self.client.login(username='joaco', password='1234corner')
+
+        # WHEN: joaco orders a customization of another menu option
+        other_custom = MenuOptionCustomization.objects.exclude(
+            menu_option=self.option).first()
+        response = self._put_order({'menu_option': self.option.id,
+                                    'customizations': [other_custom.id]})
+
+        # THEN: nothing is ordered
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(Order.objects.filter(menu=self.menu).exists())
+
+    def test_order_requires_authentication_and_open_menu(self):
+        # WHEN: an anonymous client reads its order
+        # THEN: it is unauthorized
+        response = self.client.get(reverse('mealshop:api_order'))
+        self.assertEqual(response.status_code, 401)
+
+        # WHEN: joaco orders once the menu closed
+        self.client.login(username='joaco', password='1234corner')
+        self.menu.closes_at = now() - timedelta(minutes=1)
+        self.menu.save()
+        response = self._put_order({'menu_option': self.option.id})
+
+        # THEN: the order is refused
+        self.assertEqual(response.status_code, 403)
+
+
+class OrderRollupTest(TestCase):
+    fixtures = ['mealshop.json']
+
+    def _rollups(self):
+        return (set(DailyOptionRollup.objects.filter(orders__gt=0)
+                    .values_list('day', 'menu_option_id', 'orders')),
+                set(DailyCustomizationRollup.objects.filter(orders__gt=0)
+                    .values_list('day', 'menu_option_custom_id', 'orders')))
+
+    def test_rollups_follow_order_changes(self):
+        # GIVEN: rollups backfilled and a menu for today
+        call_command('backfill_rollups', stdout=StringIO())
+        menu = Menu.objects.create()
+        option, other = [custom.menu_option for custom in
+                         MenuOptionCustomization.objects.all()[:2]]
+        joaco, nora = (User.objects.get(username='joaco'),
+                       User.objects.get(username='nora'))
+
+        # WHEN: orders are placed, customized, changed and deleted
+        with self.captureOnCommitCallbacks(execute=True):
+            order = Order.objects.create(user=joaco, menu=menu,
+                                         menu_option=option)
+        with self.captureOnCommitCallbacks(execute=True):
+            order.set_customizations(option.menuoptioncustomization_set
+                                     .values_list('id', flat=True))
+        with self.captureOnCommitCallbacks(execute=True):
+            other_order = Order.objects.create(user=nora, menu=menu,
+                                               menu_option=other)
+            OrderCustomization.objects.create(
+                order=other_order,
+                menu_option_custom=other.menuoptioncustomization_set.first())
+        with self.captureOnCommitCallbacks(execute=True):
+            order = Order.objects.get(pk=order.pk)
+            order.menu_option = other
+            order.save()
+            order.ordercustomization_set.all().delete()
+        with self.captureOnCommitCallbacks(execute=True):
+            other_order.purchased_date = now() - timedelta(days=3)
+            other_order.save()
+        with self.captureOnCommitCallbacks(execute=True):
+            Order.objects.get(pk=other_order.pk).delete()
+
+        # THEN: the incremental rollups match the ones rebuilt from orders
+        incremental = self._rollups()
+        self.assertIn((localdate(), other.id, 1), incremental[0])
+        call_command('backfill_rollups', stdout=StringIO())
+        self.assertEqual(self._rollups(), incremental)
+
+    def test_rollups_written_in_one_batch(self):
+        # GIVEN: an order with every customization of its menu option
+        custom = MenuOptionCustomization.objects.first()
+        with self.captureOnCommitCallbacks(execute=True):
+            order = Order.objects.create(
+                user=User.objects.get(username='joaco'),
+                menu=Menu.objects.create(), menu_option=custom.menu_option)
+
+        # WHEN: the customizations are set inside a transaction
+        with self.captureOnCommitCallbacks() as callbacks:
+            order.set_customizations(custom.menu_option
+                                     .menuoptioncustomization_set
+                                     .values_list('id', flat=True))
+
+        # THEN: rollups are written once, when the transaction commits
+        self.assertEqual(len(callbacks), 1)
+        with self.assertNumQueries(4):
+            callbacks[0]()
+
+    def test_rolled_back_savepoint_not_rolled_up(self):
+        # GIVEN: joaco's order placed in a savepoint that rolls back
+        option = MenuOptionCustomization.objects.first().menu_option
+        with self.captureOnCommitCallbacks(execute=True):
+            with self.assertRaises(ValueError):
+                with transaction.atomic():
+                    Order.objects.create(
+                        user=User.objects.get(username='joaco'),
+                        menu=Menu.objects.create(), menu_option=option)
+                    raise ValueError
+
+            # WHEN: nora places hers in the same transaction
+            Order.objects.create(user=User.objects.get(username='nora'),
+                                 menu=Menu.objects.create(),
+                                 menu_option=option)
+
+        # THEN: only nora's order is counted
+        self.assertEqual(self._rollups()[0], {(localdate(), option.id, 1)})
+
+    def test_cascade_delete_reads_orders_once(self):
+        # GIVEN: rollups of joaco's customized orders on three menus
+        call_command('backfill_rollups', stdout=StringIO())
+        joaco = User.objects.get(username='joaco')
+        custom = MenuOptionCustomization.objects.first()
+        customization_ids = (custom.menu_option.menuoptioncustomization_set
+                             .values_list('id', flat=True))
+        with self.captureOnCommitCallbacks(execute=True):
+            for _ in range(3):
+                Order.objects.create(
+                    user=joaco, menu=Menu.objects.create(),
+                    menu_option=custom.menu_option,
+                ).set_customizations(customization_ids)
+
+        # WHEN: joaco is deleted with his orders and customizations
+        with CaptureQueriesContext(connection) as context:
+            with self.captureOnCommitCallbacks(execute=True):
+                joaco.delete()
+
+        # THEN: orders are not read again per deleted customization
+        order_reads = [query['sql'] for query in context.captured_queries
+                       if query['sql'].startswith('SELECT')
+                       and 'FROM "app_order" WHERE' in query['sql']]
+        self.assertEqual(len(order_reads), 1, order_reads)
+
+        # AND: the rollups match the ones rebuilt from the orders
+        incremental = self._rollups()
+        call_command('backfill_rollups', stdout=StringIO())
+        self.assertEqual(self._rollups(), incremental)
+
+    def test_top_dishes_in_one_query(self):
+        # GIVEN: rollups of the orders in the fixture
+        call_command('backfill_rollups', stdout=StringIO())
+        day = localtime(Order.objects.first().purchased_date).date()
+
+        # WHEN: the top dishes of the days around the orders are read
+        with self.assertNumQueries(1):
+            top = DailyOptionRollup.objects.top(day - timedelta(days=90),
+                                                day + timedelta(days=1))
+
+        # THEN: totals are the orders per menu option
+        self.assertEqual(
+            {dish['id']: dish['total'] for dish in top},
+            {row['menu_option_id']: row['total']
+             for row in Order.objects.option_counts()})
+
+    def test_analytics_view(self):
+        # GIVEN: nora authenticated
+        self.client.login(username='nora', password='1234corner')
+
+        # WHEN: nora opens the analytics of the last 30 days
+        response = self.client.get(reverse('mealshop:analytics'),
+                                   {'days': 30})
+
+        # THEN: the top dishes are listed for those days
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.context['days'], 30)
+        self.assertEqual(response.context['top_dishes'], [])
+
+
+class SeedMealshopTest(TestCase):
+
+    def test_seed_generates_related_rows(self):
+        # WHEN: a small dataset is seeded
+        call_command('seed_mealshop', users=10, options=5, customizations=2,
+                     days=3, menu_options=2, participation=0.5, seed=1,
+                     stdout=StringIO())
+
+        # THEN: every user has a profile and every day its menu and orders
+        self.assertEqual(Profile.objects.count(), 10)
+        self.assertEqual(Menu.objects.count(), 3)
+        self.assertEqual(Order.objects.count(), 15)
+        for menu in Menu.objects.all():
+            self.assertEqual(menu.menu_options.count(), 2)
+        self.assertEqual(sum(DailyOptionRollup.objects
+                             .values_list('orders', flat=True)), 15)
+
+
+class RequestMetricsTest(TestCase):
+    fixtures = ['mealshop.json']
+
+    def setUp(self):
+        self.client = Client()
+        request_metrics.reset()
+
+    def test_server_timing_and_aggregate(self):
+        # GIVEN: nora authenticated
+        self.client.login(username='nora', password='1234corner')
+
+        # WHEN: nora views the orders
+        response = self.client.get(reverse('mealshop:view_orders'))
+
+        # THEN: timings are sent and aggregated for the view
+        self.assertIn('db;dur=', response['Server-Timing'])
+        self.assertIn('tpl;dur=', response['Server-Timing'])
+        metrics = request_metrics.as_dict()['mealshop:view_orders']
+        self.assertEqual(metrics['total_ms']['count'], 1)
+        self.assertGreater(metrics['queries']['sum'], 0)
+        self.assertGreater(metrics['template_ms']['sum'], 0)
+
+    @override_settings(REQUEST_QUERY_BUDGET=1)
+    def test_over_query_budget_logged(self):
+        # GIVEN: nora authenticated
+        self.client.login(username='nora', password='1234corner')
+
+        # WHEN: a view does more queries than the budget
+        with self.assertLogs('app.metrics', level='WARNING') as logs:
+            self.client.get(reverse('mealshop:view_orders'))
+
+        # THEN: it is flagged
+        self.assertIn('mealshop:view_orders', logs.output[0])
+        self.assertEqual(request_metrics.as_dict()['mealshop:view_orders']
+                         ['over_query_budget'], 1)
+
+    @override_settings(REQUEST_QUERY_BUDGET=0)
+    def test_streaming_response_not_over_budget(self):
+        # GIVEN: nora authenticated
+        self.client.login(username='nora', password='1234corner')
+
+        # WHEN: nora exports orders, read after the view returns
+        response = self.client.get(reverse('mealshop:export_orders'), {
+            'start': '2020-06-12', 'end': '2020-06-13'})
+        b''.join(response.streaming_content)
+
+        # THEN: the budget is not checked for the streamed response
+        self.assertEqual(request_metrics.as_dict()['mealshop:export_orders']
+                         ['over_query_budget'], 0)
+
+    def test_query_counter_removed_after_error(self):
+        # GIVEN: a view failing after a query
+        def failing_view(request):
+            User.objects.count()
+            raise ValueError('boom')
+        middleware = RequestMetricsMiddleware(failing_view)
+
+        # WHEN: it is served
+        with self.assertRaises(ValueError):
+            middleware(RequestFactory().get('/'))
+
+        # THEN: the query counter is not left on the connection
+        self.assertNotIn(count_queries, connection.execute_wrappers)
+
+    def test_metrics_only_for_staff(self):
+        # GIVEN: nora is not staff
+        self.client.login(username='nora', password='1234corner')
+        response = self.client.get(reverse('mealshop:request_metrics'))
+        self.assertEqual(response.status_code, 302)
+
+        # WHEN: nora becomes staff
+        User.objects.filter(username='nora').update(is_staff=True)
+        response = self.client.get(reverse('mealshop:request_metrics'))
+
+        # THEN: metrics are returned
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('mealshop:request_metrics', response.json())
+
+
+class DatabaseSettingsTest(TestCase):
+
+    @override_settings(SQLITE_PRAGMAS={'journal_mode': 'WAL',
+                                       'synchronous': 'NORMAL'})
+    def test_sqlite_pragmas_applied(self):
+        # WHEN: a connection is opened with SQLITE_WAL
+        journal_mode, busy_timeout, synchronous = self._pragmas()
+
+        # THEN: readers do not wait for writers, writers wait for locks and
+        # syncs are relaxed
+        self.assertEqual(journal_mode, 'wal')
+        self.assertEqual(busy_timeout, 20000)
+        self.assertEqual(synchronous, 1)
+
+    @override_settings(SQLITE_PRAGMAS={})
+    def test_rollback_journal_by_default(self):
+        # WHEN: a connection is opened without SQLITE_WAL
+        journal_mode, busy_timeout, _ = self._pragmas()
+
+        # THEN: the database file keeps its journal
+        self.assertEqual(journal_mode, 'delete')
+        self.assertEqual(busy_timeout, 20000)
+
+    def _pragmas(self):
+        # a database file of its own, the test database is in memory and
+        # its connection already configured
+        with tempfile.TemporaryDirectory() as directory:
+            other = DatabaseWrapper(dict(
+                connection.settings_dict,
+                NAME=os.path.join(directory, 'db.sqlite3')), 'pragmas')
+            try:
+                with other.cursor() as cursor:
+                    pragmas = []
+                    for pragma in ('journal_mode', 'busy_timeout',
+                                   'synchronous'):
+                        cursor.execute('PRAGMA {}'.format(pragma))
+                        pragmas.append(cursor.fetchone()[0])
+                    return pragmas
+            finally:
+                other.close()
+
+
+class AtomicWriteTest(TransactionTestCase):
+
+    def test_commits_and_runs_on_commit_callbacks(self):
+        # WHEN: an option is written in an atomic_write block
+        committed = []
+        with CaptureQueriesContext(connection) as context:
+            with db.atomic_write():
+                MenuOption.objects.create(name='sopa', description='')
+                transaction.on_commit(lambda: committed.append(True))
+                self.assertEqual(committed, [])
+
+        # THEN: the transaction took the write lock up front and committed
+        self.assertEqual(context.captured_queries[0]['sql'],
+                         'BEGIN IMMEDIATE')
+        self.assertTrue(MenuOption.objects.filter(name='sopa').exists())
+        self.assertEqual(committed, [True])
+        self.assertTrue(connection.get_autocommit())
+
+    def test_rolls_back_on_error(self):
+        # WHEN: an atomic_write block fails after writing
+        with self.assertRaises(ValueError):
+            with db.atomic_write():
+                MenuOption.objects.create(name='sopa', description='')
+                transaction.on_commit(self.fail)
+                raise ValueError
+
+        # THEN: nothing is written and autocommit is back
+        self.assertFalse(MenuOption.objects.filter(name='sopa').exists())
+        self.assertTrue(connection.get_autocommit())
+
+
+@override_settings(
+    SHARED_CACHE=True,
+    SESSION_ENGINE='django.contrib.sessions.backends.cached_db',
+    AUTHENTICATION_BACKENDS=['app.auth_cache.CachedModelBackend'])
+class AuthCacheTest(TestCase):
+    fixtures = ['mealshop.json']
+
+    def setUp(self):
+        cache.clear()
+        self.backend = CachedModelBackend()
+        self.joaco = User.objects.get(username='joaco')
+
+    def test_logged_in_page_without_auth_queries(self):
+        # GIVEN: nora logged in and opened a page
+        self.client.login(username='nora', password='1234corner')
+        self.client.get(reverse('mealshop:index'))
+
+        # WHEN: nora opens it again
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.get(reverse('mealshop:index'))
+
+        # THEN: her session, user and permissions are not read
+        self.assertEqual(response.status_code, 200)
+        tables = ('django_session', 'auth_user', 'auth_permission')
+        self.assertEqual([query['sql'] for query in context.captured_queries
+                          if any(table in query['sql'] for table in tables)],
+                         [])
+
+    def test_user_permission_change_invalidates_cache(self):
+        # GIVEN: joaco's permissions are cached
+        self.assertNotIn('app.view_order', self._joaco_permissions())
+
+        # WHEN: joaco gets a permission
+        self.joaco.user_permissions.add(
+            Permission.objects.get(codename='view_order'))
+
+        # THEN: the next request sees it
+        self.assertIn('app.view_order', self._joaco_permissions())
+
+    def test_group_permission_change_invalidates_cache(self):
+        # GIVEN: joaco is in the kitchen group
+        kitchen = Group.objects.create(name='kitchen')
+        kitchen.user_set.add(self.joaco)
+        self.assertNotIn('app.view_order', self._joaco_permissions())
+
+        # WHEN: the group gets a permission
+        kitchen.permissions.add(Permission.objects.get(codename='view_order'))
+
+        # THEN: joaco has it, until the group is deleted
+        self.assertIn('app.view_order', self._joaco_permissions())
+        kitchen.delete()
+        self.assertNotIn('app.view_order', self._joaco_permissions())
+
+    def test_permission_revoked_after_commit(self):
+        # GIVEN: joaco with a permission
+        permission = Permission.objects.get(codename='view_order')
+        self.joaco.user_permissions.add(permission)
+        self.assertIn('app.view_order', self._joaco_permissions())
+
+        # WHEN: it is revoked while a request reading joaco before the
+        # commit caches his permissions again
+        with self.captureOnCommitCallbacks(execute=True):
+            self.joaco.user_permissions.remove(permission)
+            cache.set(auth_cache._permissions_key(self.joaco.pk),
+                      {'app.view_order'})
+            cache.set(auth_cache.USER_KEY.format(self.joaco.pk), self.joaco)
+
+        # THEN: the commit drops them
+        self.assertNotIn('app.view_order', self._joaco_permissions())
 
-        # THEN: call slack API
-        self.assertEqual(mock.call_count, len(profiles))
+    def _joaco_permissions(self):
+        # read once from the database and then from the cache by the
+        # following requests
+        self.backend.get_user(self.joaco.pk).get_all_permissions()
+        with self.assertNumQueries(0):
+            return self.backend.get_user(self.joaco.pk).get_all_permissions()
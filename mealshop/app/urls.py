@@ -1,6 +1,7 @@
 import uuid
 from django.urls import path
 from . import views
+from . import api
 
 app_name = 'mealshop'
 
@@ -11,6 +12,12 @@ urlpatterns = [
     path('<int:menu_id>/choose_menu/', views.choose_menu, name='choose_menu'),
     path('<int:menu_id>/add_order', views.add_order, name='add_order'),
     path('view_orders/', views.view_orders, name='view_orders'),
+    path('view_orders/summary/', views.orders_summary,
+         name='orders_summary'),
+    path('view_orders/summary.json', views.orders_summary_json,
+         name='orders_summary_json'),
+    path('orders/export', views.export_orders, name='export_orders'),
+    path('analytics/', views.analytics, name='analytics'),
     path('<int:order_id>/add_order_customizations',
          views.add_order_customizations, name='add_order_customizations'),
     # Menu paths
@@ -31,5 +38,12 @@ urlpatterns = [
     path('menu_options/',
          views.menu_options, name='menu_options'),
     path('add_menu_option/',
-         views.add_menu_option, name='add_menu_option')
+         views.add_menu_option, name='add_menu_option'),
+    # JSON API
+    path('api/menu/today', api.today_menu, name='api_today_menu'),
+    path('api/order', api.my_order, name='api_order'),
+    # Metrics
+    path('metrics/requests/', views.request_metrics_view,
+         name='request_metrics'),
+    path('metrics', views.metrics, name='metrics'),
 ]
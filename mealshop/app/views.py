@@ -1,24 +1,71 @@
+import csv
+import json
 import uuid
 import logging
-import pytz
 import datetime
+import tempfile
+from asgiref.sync import sync_to_async
 from django.utils.formats import get_format
 from django.shortcuts import render, get_object_or_404
-from django.http import HttpResponse, HttpResponseRedirect
-from django.http import Http404
+from django.http import HttpResponse, HttpResponseRedirect, JsonResponse
+from django.http import Http404, HttpResponseBadRequest
+from django.http import StreamingHttpResponse, FileResponse
+from django.core.handlers.asgi import ASGIRequest
 from django.urls import reverse
-from django.utils.timezone import localtime, now, get_current_timezone
-from django.contrib.auth.decorators import permission_required, login_required
-from django.views.decorators.http import require_http_methods
-from django.utils.dateparse import parse_date
+from django.conf import settings
+from django.db import transaction
+from django.utils.timezone import (
+    localtime, localdate, now, get_current_timezone, make_aware
+)
+from django.contrib.auth.decorators import (
+    permission_required, login_required, user_passes_test
+)
+from django.views.decorators.http import require_http_methods, condition
+from django.views.decorators.vary import vary_on_cookie
+from django.utils.dateparse import parse_date, parse_time
 from .models import (
-    Menu, MenuOption, MenuOptionCustomization, User, Order, OrderCustomization
+    Menu, MenuOption, MenuOptionCustomization, User, Order, OrderCustomization,
+    DailyOptionRollup, DailyCustomizationRollup
 )
+from .decorators import (
+    async_permission_required, async_require_http_methods
+)
+from .db import atomic_write
 from .forms import MenuForm
-from .services import create_reminder_async, _send_reminder
+from .metrics import request_metrics, prometheus_text
+from .services import enqueue_reminders
+from .order_window import get_order_window, menu_order_window
+from .menus import (
+    get_today_menu, cache_anonymous_page, menu_page_etag,
+    menu_page_last_modified, MENU_PREFETCH
+)
+
+# Days of orders ranked by the analytics page
+ANALYTICS_DAYS = 90
+
+# Orders read per query by export_orders, and the columns exported
+EXPORT_CHUNK_SIZE = 2000
+# Bytes of an export kept in memory under ASGI before it goes to disk
+EXPORT_SPOOL_SIZE = 1024 * 1024
+EXPORT_COLUMNS = ['id', 'purchased_date', 'username', 'menu_id',
+                  'menu_option', 'customizations']
+
+
+class _Echo:
+    """
+    File-like object for csv.writer, returns the line written so it can be
+    streamed
+    """
+
+    def write(self, value):
+        return value
 
 
 @require_http_methods(['GET'])
+@vary_on_cookie
+@condition(etag_func=menu_page_etag,
+           last_modified_func=menu_page_last_modified)
+@cache_anonymous_page
 def index(request):
     """
     Landing view for all users, no authentication is required
@@ -29,12 +76,8 @@ def index(request):
     Returns:
     Return a HttpResponse object
     """
-    today_min, today_max = _get_datetime_today_range()
-    try:
-        menu = (Menu.objects
-                .filter(pub_date__gte=today_min, pub_date__lte=today_max)
-                .latest('pub_date'))
-    except Menu.DoesNotExist:
+    menu = get_today_menu()
+    if menu is None:
         return render(request, 'app/index.html')
 
     return render(request, 'app/index.html', {'menu': menu})
@@ -81,26 +124,28 @@ def add_menu(request):
     tz = get_current_timezone()
     dt = tz.localize(datetime.datetime.strptime(str_date + " 01:00:00",
                                                 '%m/%d/%Y  %H:%M:%S'))
-    menu = Menu(pub_date=dt)
-    menu.save()
-    request.user.menu.add(menu)
+    option_ids = _get_ids_from_post(request.POST, 'menu_option_')
+    opens_at = _get_datetime_from_post(request.POST, 'opens_at', dt)
+    closes_at = _get_datetime_from_post(request.POST, 'closes_at', dt)
+
+    with transaction.atomic():
+        menu = Menu.objects.create(pub_date=opens_at or dt,
+                                   user=request.user, opens_at=opens_at,
+                                   closes_at=closes_at)
+        menu.menu_options.add(*MenuOption.objects
+                              .filter(id__in=option_ids)
+                              .values_list('id', flat=True))
 
-    try:
-        for option in MenuOption.objects.all():
-            if request.POST.get('menu_option_' + str(option.id)):
-                menu.menu_options.add(option)
-    except KeyError:
-        return create_menu(request)
-    else:
-        menu.save()
-        return HttpResponseRedirect(reverse('mealshop:daily_menu'))
+    return HttpResponseRedirect(reverse('mealshop:daily_menu'))
 
 
-@permission_required('app.add_menu', login_url='/')
-@require_http_methods(['GET'])
-def create_reminder(request, menu_id):
+@async_permission_required('app.add_menu', login_url='/')
+@async_require_http_methods(['GET'])
+async def create_reminder(request, menu_id):
     """
-    Sends a async slack reminder to all employees of current menu
+    Queues a slack reminder to all employees of current menu, they are
+    sent by `manage.py reminder_worker`. Async, the queries run through
+    sync_to_async.
 
     Parameters:
     request (HttpReqest): object that contains metadata about the request
@@ -109,8 +154,8 @@ def create_reminder(request, menu_id):
     Returns
     HttpResponse object with template as content
     """
-    menu = Menu.objects.get(pk=menu_id)
-    create_reminder_async(menu)
+    menu = await sync_to_async(get_object_or_404)(Menu, pk=menu_id)
+    await sync_to_async(enqueue_reminders)(menu)
     return HttpResponseRedirect(reverse('mealshop:daily_menu'))
 
 
@@ -127,12 +172,8 @@ def daily_menu(request):
     Returns:
     Return a HttpResponse object with template as content
     """
-    try:
-        today_min, today_max = _get_datetime_today_range()
-        menu = (Menu.objects
-                .filter(pub_date__gte=today_min, pub_date__lte=today_max)
-                .latest('pub_date'))
-    except Menu.DoesNotExist:
+    menu = get_today_menu()
+    if menu is None:
         return render(request, 'app/daily_menu.html')
     return render(request, 'app/daily_menu.html', {'menu': menu})
 
@@ -252,17 +293,19 @@ def add_customization(request, menu_option_id):
 
 
 @require_http_methods(['GET'])
+@vary_on_cookie
+@condition(etag_func=menu_page_etag,
+           last_modified_func=menu_page_last_modified)
+@cache_anonymous_page
 def menu(request, uuid):
-    today_min, today_max = _get_datetime_today_range()
     context = {}
-    if now() <= today_max:
-        try:
-            menu = Menu.objects.filter(uuid=uuid, pub_date__lte=today_max)\
-                .first()
-            context['menu'] = menu
-        except Menu.DoesNotExist:
-            return HttpResponseRedirect(reverse(
-                'mealshop:index'))
+    menu = get_today_menu()
+    if menu is None or menu.uuid != uuid:
+        menu = Menu.objects.filter(uuid=uuid).order_by('-pub_date').first()
+    if menu is not None:
+        window = menu_order_window(menu)
+        if window.is_open():
+            context = {'menu': menu, 'window': window}
 
     return render(request, 'app/menu.html', context)
 
@@ -273,7 +316,7 @@ def choose_menu(request, menu_id):
     """
      View of daily menu for employees to order,
     only a menu will be displayed that corresponds do the date of today
-    is available to make orders until 11:00 am with timezone set on settings.py
+    is available to make orders until the cutoff of its order window
 
     If a user already created an order, it will be displayed below
     with the option to update.
@@ -285,27 +328,34 @@ def choose_menu(request, menu_id):
     Return a HttpResponse object with template as content
     Context {
         menu: (Menu),
+        window: (OrderWindow) of the menu,
         order: (Order) If it exsists
+        order_option: (MenuOption) of the order
+        customization_user: (set) customization ids of the order
     }
     """
     context = {}
-    today_min, today_max = _get_datetime_today_range()
-    if now() <= today_max:
-        try:
-            menu = Menu.objects.get(pk=menu_id, pub_date__lte=today_max)
-            context = {'menu': menu}
-            if request.user.is_authenticated:
-                order = Order.objects.filter(user=request.user, menu=menu)
-                if order.exists():
-                    order = order.first()
-                    customizations = order.ordercustomization_set.all()
-                    context['order'] = order
-                    context['customization_user'] = customizations\
-                        .values_list('menu_option_custom__id', flat=True)
-
-        except Menu.DoesNotExist:
-            return HttpResponseRedirect(reverse(
-                'mealshop:index'))
+    menu = get_today_menu()
+    if menu is None or menu.id != menu_id:
+        menu = Menu.objects.prefetch_related(MENU_PREFETCH)\
+            .filter(pk=menu_id).first()
+    if menu is None:
+        return HttpResponseRedirect(reverse('mealshop:index'))
+    window = menu_order_window(menu)
+    if window.is_open():
+        context = {'menu': menu, 'window': window}
+        order = Order.objects.select_related('menu_option')\
+            .filter(user=request.user, menu=menu).first()
+        if order is not None:
+            # the option of the order comes from the prefetched menu, so
+            # its customizations are already loaded
+            context['order'] = order
+            context['order_option'] = next(
+                (option for option in menu.menu_options.all()
+                 if option.id == order.menu_option_id), order.menu_option)
+            context['customization_user'] = set(
+                order.ordercustomization_set
+                .values_list('menu_option_custom_id', flat=True))
 
     return render(request, 'app/choose_menu.html', context)
 
@@ -331,13 +381,16 @@ def add_order(request, menu_id):
         return HttpResponseRedirect(reverse(
             'mealshop:choose_menu', args=[menu_id]))
     else:
-        obj, created = Order.objects.update_or_create(
-            user=request.user, menu=menu, defaults={
-                'user': request.user, 'menu': menu,
-                'purchased_date': now(), 'menu_option': menu_option
-            }
-        )
-        OrderCustomization.objects.filter(order=obj).delete()
+        with atomic_write():
+            obj, created = Order.objects.update_or_create(
+                user=request.user, menu=menu, defaults={
+                    'user': request.user, 'menu': menu,
+                    'purchased_date': now(), 'menu_option': menu_option
+                }
+            )
+            # through the related manager the deleted customizations keep
+            # their order loaded for the rollup signals
+            obj.ordercustomization_set.all().delete()
         return HttpResponseRedirect(reverse(
             'mealshop:choose_menu', args=[menu_id]))
 
@@ -355,28 +408,11 @@ def add_order_customizations(request, order_id):
     Returns:
     Return a HttpResponseRedirect to choose_menu view template
     """
-    try:
-        order = get_object_or_404(Order, pk=order_id)
-        menu_option = order.menu_option
-        customizations = menu_option.menuoptioncustomization_set.all()
-
-        # TODO: find a better way to update Manty-to-one relationship
-        # consider not deleting but updating status of field if it is created
-        OrderCustomization.objects.filter(order=order).delete()
-        for customization in customizations:
-            if request.POST.get('menu_option_customization_'
-                                + str(customization.id)):
-                OrderCustomization.objects.update_or_create(
-                    order=order, menu_option_custom=customization,
-                    defaults={'order': order,
-                              'menu_option_custom': customization}
-                )
-    except KeyError:
-        return HttpResponseRedirect(reverse(
-            'mealshop:choose_menu', args=[order.menu.id]))
-    else:
-        return HttpResponseRedirect(reverse(
-            'mealshop:choose_menu', args=[order.menu.id]))
+    order = get_object_or_404(Order, pk=order_id)
+    order.set_customizations(
+        _get_ids_from_post(request.POST, 'menu_option_customization_'))
+    return HttpResponseRedirect(reverse(
+        'mealshop:choose_menu', args=[order.menu_id]))
 
 
 @require_http_methods(['GET'])
@@ -391,28 +427,257 @@ def view_orders(request):
     Returns:
     Return a HttpResponseRedirect to view_orders view template
     """
-    today_min, today_max = _get_datetime_today_range(max_hour=23,
-                                                     max_second=59)
-    orders = Order.objects.filter(purchased_date__lte=today_max,
-                                  purchased_date__gte=today_min)
+    window = get_order_window()
+    orders = Order.objects.kitchen_report(window.opens, window.ends)
 
     return render(request, 'app/view_orders.html', {
         'orders': orders
     })
 
 
-# TODO: remove this burn out setting of hours
-def _get_datetime_today_range(max_hour=11, max_second=0):
-    assert max_hour >= 0 and max_hour < 24, \
-        'Max hour has to be between [0,24)'
-    assert max_second >= 0 and max_second < 60,\
-        'Max seconds has to be between [0,60)'
-    tz = pytz.timezone("America/Santiago")
-    today_min = datetime.datetime.combine(localtime(now()).date().today(),
-                                          datetime.time(hour=0, tzinfo=tz))
-    today_max = datetime.datetime.combine(localtime(now()).date().today(),
-                                          datetime.time(hour=max_hour,
-                                                        second=max_second,
-                                                        tzinfo=tz))
-
-    return (today_min, today_max)
+@require_http_methods(['GET'])
+@permission_required('app.view_order', login_url='/')
+def orders_summary(request):
+    """
+    Kitchen production summary of the orders taken for a day, counts per
+    menu option and per customization
+
+    Parameters:
+    request (HttpReqest): object that contains metadata about the request
+
+    Returns:
+    Return a HttpResponse object with template as content
+    Context {
+        summary: (list-> dict) see _get_orders_summary
+    }
+    """
+    return render(request, 'app/orders_summary.html', {
+        'summary': _get_orders_summary()
+    })
+
+
+@require_http_methods(['GET'])
+@permission_required('app.view_order', login_url='/')
+def orders_summary_json(request):
+    """
+    Same as orders_summary but as a JSON document
+
+    Parameters:
+    request (HttpReqest): object that contains metadata about the request
+
+    Returns:
+    Return a JsonResponse object {'summary': [...]}
+    """
+    return JsonResponse({'summary': _get_orders_summary()})
+
+
+@require_http_methods(['GET'])
+@permission_required('app.view_order', login_url='/')
+def analytics(request):
+    """
+    Most ordered dishes and customizations of the last days, read from the
+    daily rollups instead of the orders
+
+    Parameters:
+    request (HttpReqest): object that contains metadata about the request
+        GET days (int): days included, 90 by default
+
+    Returns:
+    Return a render object to analytics view template
+    context: {
+        days: (int)
+        top_dishes: (list-> dict) id, name and total of orders
+        top_customizations: (list-> dict) id, name and total of orders
+    }
+    """
+    try:
+        days = max(int(request.GET.get('days', ANALYTICS_DAYS)), 1)
+    except ValueError:
+        days = ANALYTICS_DAYS
+    day_max = localdate()
+    day_min = day_max - datetime.timedelta(days=days - 1)
+    return render(request, 'app/analytics.html', {
+        'days': days,
+        'top_dishes': DailyOptionRollup.objects.top(day_min, day_max),
+        'top_customizations': DailyCustomizationRollup.objects.top(
+            day_min, day_max),
+    })
+
+
+@require_http_methods(['GET'])
+@permission_required('app.view_order', login_url='/')
+def export_orders(request):
+    """
+    Streams the orders purchased between two dates as CSV or NDJSON,
+    rows are read in chunks so any date range can be exported. The ASGI
+    handler of Django 3.2 iterates streaming responses in its event loop,
+    where the database cannot be queried, so under ASGI the export is
+    written to a temporary file first and the file is streamed
+
+    Parameters:
+    request (HttpReqest): object that contains metadata about the request
+        GET start, end (YYYY-MM-DD): dates included in the export
+        GET format: csv (default) or ndjson
+
+    Returns:
+    Return a StreamingHttpResponse object with the orders as attachment
+    """
+    start = parse_date(request.GET.get('start', ''))
+    end = parse_date(request.GET.get('end', ''))
+    export_format = request.GET.get('format', 'csv')
+    if start is None or end is None or start > end:
+        return HttpResponseBadRequest('start and end dates are required '
+                                      '(YYYY-MM-DD)')
+    if export_format not in ('csv', 'ndjson'):
+        return HttpResponseBadRequest('format must be csv or ndjson')
+
+    tz = get_current_timezone()
+    date_min = tz.localize(datetime.datetime.combine(start, datetime.time()))
+    date_max = tz.localize(datetime.datetime.combine(
+        end, datetime.time.max))
+    rows = Order.objects.purchased_between(date_min, date_max)\
+        .iter_export(EXPORT_CHUNK_SIZE)
+
+    if export_format == 'csv':
+        content, content_type = _csv_lines(rows), 'text/csv'
+    else:
+        content, content_type = _ndjson_lines(rows), 'application/x-ndjson'
+    if isinstance(request, ASGIRequest):
+        spool = tempfile.SpooledTemporaryFile(max_size=EXPORT_SPOOL_SIZE)
+        for line in content:
+            spool.write(line.encode(settings.DEFAULT_CHARSET))
+        spool.seek(0)
+        response = FileResponse(spool, content_type=content_type)
+    else:
+        response = StreamingHttpResponse(content, content_type=content_type)
+    response['Content-Disposition'] = \
+        'attachment; filename="orders_{}_{}.{}"'.format(start, end,
+                                                        export_format)
+    return response
+
+
+def _csv_lines(rows):
+    writer = csv.writer(_Echo())
+    yield writer.writerow(EXPORT_COLUMNS)
+    for row in rows:
+        row['purchased_date'] = localtime(row['purchased_date']).isoformat()
+        row['customizations'] = '; '.join(row['customizations'])
+        yield writer.writerow([row[column] for column in EXPORT_COLUMNS])
+
+
+def _ndjson_lines(rows):
+    for row in rows:
+        row['purchased_date'] = localtime(row['purchased_date']).isoformat()
+        yield json.dumps(row) + '\n'
+
+
+@require_http_methods(['GET'])
+@user_passes_test(lambda user: user.is_staff, login_url='/')
+def request_metrics_view(request):
+    """
+    Time, queries and template rendering aggregated per view since the
+    process started, only for staff
+
+    Parameters:
+    request (HttpReqest): object that contains metadata about the request
+
+    Returns:
+    Return a JsonResponse object {view_name: metrics}
+    """
+    return JsonResponse(request_metrics.as_dict())
+
+
+@require_http_methods(['GET'])
+def metrics(request):
+    """
+    Reminder and request metrics in Prometheus text format, for staff or
+    for scrapers sending settings.METRICS_TOKEN as a bearer token
+
+    Parameters:
+    request (HttpReqest): object that contains metadata about the request
+
+    Returns:
+    Return a HttpResponse object with the metrics as content
+    """
+    token = settings.METRICS_TOKEN
+    authorization = request.META.get('HTTP_AUTHORIZATION', '')
+    if not (request.user.is_staff
+            or (token and authorization == 'Bearer {}'.format(token))):
+        return HttpResponse(status=403)
+    return HttpResponse(prometheus_text(),
+                        content_type='text/plain; version=0.0.4')
+
+
+def _get_datetime_from_post(post, name, day):
+    """
+    Time posted as HH:MM on the day of a datetime
+
+    Parameters:
+    post (QueryDict): request.POST
+    name (str): name of the field
+    day (datetime): aware datetime of the day
+
+    Returns:
+    aware datetime or None if the field is empty or invalid
+    """
+    try:
+        posted = parse_time(post.get(name, ''))
+    except ValueError:
+        return None
+    if posted is None:
+        return None
+    return make_aware(datetime.datetime.combine(localtime(day).date(),
+                                                posted), is_dst=False)
+
+
+def _get_ids_from_post(post, prefix):
+    """
+    Ids of the checked inputs named <prefix><id>
+
+    Parameters:
+    post (QueryDict): request.POST
+    prefix (str): name of the inputs without the id
+
+    Returns:
+    set of int
+    """
+    ids = set()
+    for key, value in post.items():
+        if key.startswith(prefix) and value:
+            try:
+                ids.add(int(key[len(prefix):]))
+            except ValueError:
+                continue
+    return ids
+
+
+def _get_orders_summary():
+    """
+    Counts of today's orders per menu option, each one with the counts of
+    its customizations. Counting is done by the database, so this costs
+    two queries whatever the amount of orders.
+
+    Returns:
+    list of dicts {id, name, total, customizations: [{id, name, total}]}
+    """
+    window = get_order_window()
+    orders = Order.objects.purchased_between(window.opens, window.ends)
+    summary = {}
+    for row in orders.option_counts():
+        summary[row['menu_option_id']] = {
+            'id': row['menu_option_id'],
+            'name': row['menu_option__name'],
+            'total': row['total'],
+            'customizations': []
+        }
+    for row in orders.customization_counts():
+        option = summary.get(row['menu_option_custom__menu_option_id'])
+        if option is None:
+            continue
+        option['customizations'].append({
+            'id': row['menu_option_custom_id'],
+            'name': row['menu_option_custom__name'],
+            'total': row['total']
+        })
+
+    return list(summary.values())
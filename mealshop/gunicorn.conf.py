@@ -0,0 +1,54 @@
+"""
+Gunicorn configuration used by SERVER=wsgi ./run.sh:
+
+$ gunicorn -c gunicorn.conf.py mealshop.wsgi:application
+
+Every setting can be overridden from the environment. Workers are
+processes, so pages rendering templates run on every core, and each one
+has threads that keep serving while others wait on SQLite, the session or
+a slow client.
+"""
+import multiprocessing
+import os
+
+bind = os.environ.get('GUNICORN_BIND', '0.0.0.0:{}'.format(
+    os.environ.get('PORT', 8000)))
+
+# 2 * cores + 1 processes, as the gunicorn docs recommend, with 2 threads
+# each: one core is kept busy while the other requests of its workers wait
+workers = int(os.environ.get('WEB_CONCURRENCY',
+                             multiprocessing.cpu_count() * 2 + 1))
+worker_class = 'gthread'
+threads = int(os.environ.get('GUNICORN_THREADS', 2))
+
+# Django is loaded once in the master and the workers are forked from it,
+# sharing its memory and starting without importing the project again
+preload_app = True
+
+# Workers are replaced after some requests so memory leaks are bounded,
+# the jitter keeps them from restarting at the same time
+max_requests = int(os.environ.get('GUNICORN_MAX_REQUESTS', 1000))
+max_requests_jitter = max_requests // 10
+
+timeout = int(os.environ.get('GUNICORN_TIMEOUT', 30))
+keepalive = 5
+
+
+def on_starting(server):
+    # a locmem cache is one per worker, what a worker invalidates stays
+    # cached in the others until it expires
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'mealshop.settings')
+    from django.conf import settings
+    if server.cfg.workers > 1 and not settings.SHARED_CACHE:
+        server.log.warning(
+            '%s workers with the cache %s, each worker caches on its own '
+            'and serves stale menus until they expire. Set CACHE_BACKEND '
+            'and CACHE_LOCATION to a cache shared by the workers, or '
+            'WEB_CONCURRENCY=1.', server.cfg.workers, settings.CACHE_BACKEND)
+
+
+def post_fork(server, worker):
+    # connections opened in the master while preloading are not shared
+    # with the forked workers, each one opens its own
+    from django.db import connections
+    connections.close_all()
@@ -11,24 +11,37 @@ https://docs.djangoproject.com/en/3.0/ref/settings/
 """
 
 import os
+from django.core.exceptions import ImproperlyConfigured
 
 # Build paths inside the project like this: os.path.join(BASE_DIR, ...)
 BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
 
 
-# Quick-start development settings - unsuitable for production
+# Development defaults, production sets them in the environment (see
+# gunicorn.conf.py and SERVER=wsgi in run.sh)
 # See https://docs.djangoproject.com/en/3.0/howto/deployment/checklist/
 
 # SECURITY WARNING: keep the secret key used in production secret!
-SECRET_KEY = 'nwl606+s$mus(_zk^rauxwan1_asu(6ihw5$v)_h*w-7^fb74c'
+SECRET_KEY = os.environ.get(
+    'SECRET_KEY', 'nwl606+s$mus(_zk^rauxwan1_asu(6ihw5$v)_h*w-7^fb74c')
 
 # SECURITY WARNING: don't run with debug turned on in production!
-DEBUG = True
+# DEBUG keeps every query of a request in memory in connection.queries
+DEBUG = os.environ.get('DEBUG', 'true').lower() in ('1', 'true', 'yes')
 
 ALLOWED_HOSTS = [
-    '.ngrok.io'
+    host.strip() for host
+    in os.environ.get('ALLOWED_HOSTS', '.ngrok.io').split(',')
+    if host.strip()
 ]
 
+# Served behind a proxy terminating https, SECURE_PROXY_SSL_HEADER trusts
+# its X-Forwarded-Proto and the cookies are only sent over https
+if os.environ.get('SECURE_PROXY', '').lower() in ('1', 'true', 'yes'):
+    SECURE_PROXY_SSL_HEADER = ('HTTP_X_FORWARDED_PROTO', 'https')
+    SESSION_COOKIE_SECURE = True
+    CSRF_COOKIE_SECURE = True
+
 
 # Application definition
 
@@ -44,6 +57,7 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'app.middleware.RequestMetricsMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -57,7 +71,7 @@ ROOT_URLCONF = 'mealshop.urls'
 
 TEMPLATES = [
     {
-        'BACKEND': 'django.template.backends.django.DjangoTemplates',
+        'BACKEND': 'app.templating.InstrumentedDjangoTemplates',
         'DIRS': [],
         'APP_DIRS': True,
         'OPTIONS': {
@@ -77,13 +91,117 @@ WSGI_APPLICATION = 'mealshop.wsgi.application'
 # Database
 # https://docs.djangoproject.com/en/3.0/ref/settings/#databases
 
-DATABASES = {
+# DATABASE_ENGINE=postgresql uses PostgreSQL with persistent connections
+# (requires psycopg2), otherwise SQLite is configured by app.db
+
+DATABASE_ENGINE = os.environ.get('DATABASE_ENGINE', 'sqlite3')
+
+if DATABASE_ENGINE == 'postgresql':
+    DATABASES = {
+        'default': {
+            'ENGINE': 'django.db.backends.postgresql',
+            'NAME': os.environ.get('DATABASE_NAME', 'mealshop'),
+            'USER': os.environ.get('DATABASE_USER', ''),
+            'PASSWORD': os.environ.get('DATABASE_PASSWORD', ''),
+            'HOST': os.environ.get('DATABASE_HOST', ''),
+            'PORT': os.environ.get('DATABASE_PORT', ''),
+            'CONN_MAX_AGE': int(os.environ.get('DATABASE_CONN_MAX_AGE', 60)),
+        }
+    }
+else:
+    DATABASES = {
+        'default': {
+            'ENGINE': 'django.db.backends.sqlite3',
+            'NAME': os.environ.get('DATABASE_NAME',
+                                   os.path.join(BASE_DIR, 'db.sqlite3')),
+            'OPTIONS': {
+                # seconds a writer waits for the lock of another one
+                'timeout': int(os.environ.get('DATABASE_TIMEOUT', 20)),
+            },
+        }
+    }
+
+# SQLITE_WAL=true journals with WAL so readers do not block the order
+# writes, run.sh sets it for SERVER=asgi and SERVER=wsgi. It is off by
+# default so commands run on the committed db.sqlite3 do not convert it
+# and leave -wal and -shm files next to it.
+SQLITE_WAL = os.environ.get('SQLITE_WAL', '').lower() in ('1', 'true', 'yes')
+
+SQLITE_PRAGMAS = {
+    'journal_mode': 'WAL',
+    'synchronous': 'NORMAL',
+} if SQLITE_WAL else {}
+
+
+# Cache
+# https://docs.djangoproject.com/en/3.0/topics/cache/
+
+# locmem is a cache per process, several workers share one with for
+# example CACHE_BACKEND=django.core.cache.backends.memcached.PyMemcacheCache
+# CACHE_LOCATION=127.0.0.1:11211
+
+CACHE_BACKEND = os.environ.get(
+    'CACHE_BACKEND', 'django.core.cache.backends.locmem.LocMemCache')
+
+CACHES = {
     'default': {
-        'ENGINE': 'django.db.backends.sqlite3',
-        'NAME': os.path.join(BASE_DIR, 'db.sqlite3'),
+        'BACKEND': CACHE_BACKEND,
+        'LOCATION': os.environ.get('CACHE_LOCATION', 'mealshop'),
     }
 }
 
+# Whether every process sees the same cache. A locmem cache only drops
+# what the process that saved a change invalidates, the other web workers,
+# the menu scheduler and the reminder worker keep their copy until it
+# expires.
+SHARED_CACHE = CACHE_BACKEND not in (
+    'django.core.cache.backends.locmem.LocMemCache',
+    'django.core.cache.backends.dummy.DummyCache',
+)
+
+# Seconds today's menus stay cached, changes are invalidated right away in
+# a shared cache, a cache per process serves them for at most these seconds
+TODAY_MENU_CACHE_TIMEOUT = int(os.environ.get(
+    'TODAY_MENU_CACHE_TIMEOUT', 60 * 60 if SHARED_CACHE else 10))
+
+# Orders of a menu are taken until this time of its day (HH:MM), menus
+# can override it with their own closes_at
+ORDER_CUTOFF = os.environ.get('ORDER_CUTOFF', '11:00')
+
+# Seconds before a scheduled menu opens that `manage.py menu_scheduler`
+# loads it into the cache, only done with a SHARED_CACHE
+MENU_WARM_LEAD = int(os.environ.get('MENU_WARM_LEAD', 60))
+
+
+# Request metrics
+# Requests doing more queries are logged as warnings by
+# app.middleware.RequestMetricsMiddleware
+
+REQUEST_QUERY_BUDGET = int(os.environ.get('REQUEST_QUERY_BUDGET', 20))
+
+# Bearer token allowing Prometheus to scrape /metrics, staff users can
+# always read it
+
+METRICS_TOKEN = os.environ.get('METRICS_TOKEN', '')
+
+# APP_LOG_LEVEL=INFO logs a JSON line with the metrics of every request
+
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'handlers': {
+        'console': {
+            'class': 'logging.StreamHandler',
+        },
+    },
+    'loggers': {
+        'app': {
+            'handlers': ['console'],
+            'level': os.environ.get('APP_LOG_LEVEL', 'WARNING'),
+        },
+    },
+}
+
 
 # Password validation
 # https://docs.djangoproject.com/en/3.0/ref/settings/#auth-password-validators
@@ -128,3 +246,58 @@ CRISPY_TEMPLATE_PACK = 'bootstrap4'
 LOGIN_REDIRECT_URL = '/'
 
 LOGOUT_REDIRECT_URL = '/login'
+
+# Sessions and authentication
+# SESSION_CACHE=cached_db reads sessions from the cache and writes them to
+# the database too, cache keeps them only in the cache and db only in the
+# database. Both cached engines need a SHARED_CACHE, a logout or a new
+# password in one worker would not reach the cache of the others.
+
+SESSION_CACHE = os.environ.get('SESSION_CACHE',
+                               'cached_db' if SHARED_CACHE else 'db')
+if SESSION_CACHE != 'db' and not SHARED_CACHE:
+    raise ImproperlyConfigured(
+        'SESSION_CACHE={} needs a CACHE_BACKEND shared by every '
+        'process'.format(SESSION_CACHE))
+
+SESSION_ENGINE = 'django.contrib.sessions.backends.{}'.format(SESSION_CACHE)
+
+# With a SHARED_CACHE logged in users and their permissions are cached for
+# AUTH_CACHE_TIMEOUT seconds, or until they change
+
+AUTHENTICATION_BACKENDS = [
+    'app.auth_cache.CachedModelBackend' if SHARED_CACHE
+    else 'django.contrib.auth.backends.ModelBackend'
+]
+
+AUTH_CACHE_TIMEOUT = int(os.environ.get('AUTH_CACHE_TIMEOUT', 60))
+
+# Reminders
+# Backend setting the reminders: app.notifiers.SlackNotifier,
+# app.notifiers.ConsoleNotifier or app.notifiers.InMemoryNotifier
+
+REMINDER_NOTIFIER = os.environ.get('REMINDER_NOTIFIER',
+                                   'app.notifiers.SlackNotifier')
+
+SLACK_TOKEN = os.environ.get('SLACK_TOKEN', '')
+
+# Host used in the link to the menu sent in reminders
+
+HOSTNAME = os.environ.get('HOSTNAME', 'http://localhost:8000')
+
+# Concurrent calls to reminders.add and retries when rate limited
+
+SLACK_REMINDER_WORKERS = int(os.environ.get('SLACK_REMINDER_WORKERS', 10))
+
+SLACK_REMINDER_MAX_RETRIES = 3
+
+SLACK_API_URL = os.environ.get('SLACK_API_URL', 'https://www.slack.com/api/')
+
+# Reminder queue processed by manage.py reminder_worker, failed deliveries
+# wait SLACK_REMINDER_BACKOFF * 2 ** (attempts - 1) seconds
+
+SLACK_REMINDER_MAX_ATTEMPTS = 5
+
+SLACK_REMINDER_BACKOFF = 30
+
+SLACK_REMINDER_LEASE = 300
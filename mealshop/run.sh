@@ -1,3 +1,39 @@
 #!/bin/sh
+# SERVER=asgi serves mealshop.asgi with uvicorn, async views then wait on
+# slow clients in the event loop instead of a thread each. WEB_CONCURRENCY
+# sets the uvicorn worker processes. SERVER=wsgi serves mealshop.wsgi with
+# gunicorn, workers and threads sized from the cores by gunicorn.conf.py,
+# and DEBUG off unless it is set. Both migrate the database first and
+# journal SQLite with WAL. The default is the development server.
+#
+# The reminder worker and the menu scheduler run next to the server and
+# are stopped with it, Ctrl-C included.
 
-python manage.py runserver 0.0.0.0:8000
+# pids are kept by hand, $(jobs -p) runs in a subshell without jobs in dash
+pids=
+trap 'exit' INT TERM
+trap 'kill $pids 2>/dev/null' EXIT
+
+if [ -n "$SERVER" ]; then
+    # before the worker and the scheduler start, so they run with them too
+    export SQLITE_WAL="${SQLITE_WAL:-true}"
+    if [ "$SERVER" = "wsgi" ]; then
+        export DEBUG="${DEBUG:-false}"
+    fi
+    python manage.py migrate || exit
+fi
+
+python manage.py reminder_worker &
+pids="$pids $!"
+python manage.py menu_scheduler &
+pids="$pids $!"
+if [ "$SERVER" = "asgi" ]; then
+    uvicorn mealshop.asgi:application --host 0.0.0.0 --port 8000 \
+        --workers "${WEB_CONCURRENCY:-1}" &
+elif [ "$SERVER" = "wsgi" ]; then
+    gunicorn -c gunicorn.conf.py mealshop.wsgi:application &
+else
+    python manage.py runserver 0.0.0.0:8000 &
+fi
+pids="$pids $!"
+wait $!